@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from price_table import PriceTable, base_of, chunks
+from scanner import create_exchanges
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncScanEngine:
+    """Параллельный опрос всех бирж через ccxt.async_support.
+
+    Каждая биржа опрашивается в своей задаче, число одновременных запросов
+    к одной бирже ограничено семафором, весь скан ограничен дедлайном.
+    Время скана = время самой медленной биржи, а не сумма всех запросов.
+    """
+
+    def __init__(self, exchanges: Optional[Dict] = None, source: Optional[Dict] = None,
+                 per_exchange_limit: int = 5, deadline: float = 10.0, batch_size: int = 20):
+        if exchanges is None:
+            import ccxt.async_support as ccxt_async
+            exchanges = create_exchanges(ccxt_async)
+        self.exchanges = exchanges
+        self.per_exchange_limit = per_exchange_limit
+        self.deadline = deadline
+        self.batch_size = batch_size
+        self.requests = 0  # счетчик HTTP запросов к биржам
+        # Полный ответ fetch_tickers() биржи (все рынки) - для треугольных циклов
+        self.on_tickers: Optional[Callable[[str, Dict], None]] = None
+        self._semaphores = {}
+
+        # Если sync клиенты уже загрузили рынки - не грузим их повторно
+        if source:
+            for name, exchange in self.exchanges.items():
+                markets = getattr(source.get(name), 'markets', None)
+                if markets and hasattr(exchange, 'set_markets'):
+                    exchange.set_markets(markets, source[name].currencies)
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        # Семафор создается внутри работающего loop (важно для python 3.9)
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.per_exchange_limit)
+        return self._semaphores[name]
+
+    async def fetch_price(self, name: str, symbol: str) -> float:
+        async with self._semaphore(name):
+            try:
+                self.requests += 1
+                ticker = await self.exchanges[name].fetch_ticker(symbol)
+                return float(ticker['last'])
+            except Exception as e:
+                logger.debug("%s %s: %s", name, symbol, e)
+                return 0
+
+    async def fetch_order_book(self, name: str, symbol: str, limit: int = 50) -> Optional[Dict]:
+        async with self._semaphore(name):
+            try:
+                self.requests += 1
+                return await self.exchanges[name].fetch_order_book(symbol, limit)
+            except Exception as e:
+                logger.debug("%s %s order book: %s", name, symbol, e)
+                return None
+
+    async def _fetch_exchange(self, name: str, symbols: List[str], out: Dict[str, float]):
+        async def one(symbol):
+            price = await self.fetch_price(name, symbol)
+            if price:
+                out[symbol] = price
+
+        await asyncio.gather(*(one(symbol) for symbol in symbols))
+
+    async def _fetch_tickers(self, name: str, symbols: Optional[List[str]] = None) -> Dict:
+        async with self._semaphore(name):
+            self.requests += 1
+            return await self.exchanges[name].fetch_tickers(symbols)
+
+    async def _snapshot_exchange(self, name: str, symbols: List[str], table: PriceTable):
+        """Весь стакан тикеров биржи одним запросом, иначе батчами"""
+        exchange = self.exchanges[name]
+        has = getattr(exchange, 'has', {})
+
+        if has.get('fetchTickers'):
+            try:
+                tickers = await self._fetch_tickers(name)
+                table.update_tickers(name, tickers, symbols)
+                if self.on_tickers is not None:
+                    self.on_tickers(name, tickers)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug("%s fetch_tickers(): %s, falling back to batches", name, e)
+
+        async def batch(chunk):
+            if has.get('fetchTickers'):
+                try:
+                    table.update_tickers(name, await self._fetch_tickers(name, chunk), chunk)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.debug("%s fetch_tickers(%d): %s", name, len(chunk), e)
+            prices = {}
+            await self._fetch_exchange(name, chunk, prices)
+            for symbol, price in prices.items():
+                table.update(name, base_of(symbol), price)
+
+        await asyncio.gather(*(batch(chunk) for chunk in chunks(symbols, self.batch_size)))
+
+    async def scan(self, markets: Dict[str, List[str]]) -> Dict[str, Dict[str, float]]:
+        """Цены {биржа: {символ: last}} по всем биржам сразу.
+
+        По истечении дедлайна незавершенные запросы отменяются, а уже
+        полученные цены возвращаются.
+        """
+        prices = {name: {} for name in markets if name in self.exchanges}
+        await self._run([
+            self._fetch_exchange(name, markets[name], prices[name]) for name in prices
+        ])
+        return prices
+
+    async def snapshot(self, markets: Dict[str, List[str]],
+                       table: Optional[PriceTable] = None) -> PriceTable:
+        """Снимок цен всех бирж в PriceTable: ~1 запрос на биржу вместо 1 на символ"""
+        table = table if table is not None else PriceTable()
+        await self._run([
+            self._snapshot_exchange(name, markets[name], table)
+            for name in markets if name in self.exchanges
+        ])
+        return table
+
+    async def _run(self, coros: List):
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        if not tasks:
+            return
+
+        started = time.perf_counter()
+        _, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning("Scan deadline %.1fs hit, %d exchange(s) incomplete",
+                           self.deadline, len(pending))
+
+        logger.debug("Scan finished in %.3fs", time.perf_counter() - started)
+
+    async def close(self):
+        for exchange in self.exchanges.values():
+            close = getattr(exchange, 'close', None)
+            if close:
+                await close()
+
+
+# ========== БЕНЧМАРК ==========
+class _FakeExchange:
+    """Заглушка sync клиента ccxt с фиксированной задержкой ответа"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    has = {'fetchTickers': True}
+
+    def fetch_ticker(self, symbol):
+        time.sleep(self.latency)
+        return {'symbol': symbol, 'last': 1.0}
+
+    def fetch_tickers(self, symbols=None):
+        time.sleep(self.latency)
+        return {f'C{i}/USDT': {'last': 1.0} for i in range(500)}
+
+
+class _FakeAsyncExchange(_FakeExchange):
+    async def fetch_ticker(self, symbol):
+        await asyncio.sleep(self.latency)
+        return {'symbol': symbol, 'last': 1.0}
+
+    async def fetch_tickers(self, symbols=None):
+        await asyncio.sleep(self.latency)
+        return {f'C{i}/USDT': {'last': 1.0} for i in range(500)}
+
+
+def benchmark(symbols_per_exchange: int = 50, latency: float = 0.02):
+    from scanner import ArbitrageScanner, EXCHANGE_CONFIGS
+
+    markets = {name: [f'C{i}/USDT' for i in range(symbols_per_exchange)]
+               for name in EXCHANGE_CONFIGS}
+
+    # Текущий путь: get_price по очереди для каждой биржи и символа
+    scanner = ArbitrageScanner.__new__(ArbitrageScanner)
+    sync_exchanges = {name: _FakeExchange(latency) for name in markets}
+    started = time.perf_counter()
+    for name, symbols in markets.items():
+        for symbol in symbols:
+            scanner.get_price(sync_exchanges[name], symbol)
+    sequential = time.perf_counter() - started
+
+    engine = AsyncScanEngine(exchanges={name: _FakeAsyncExchange(latency) for name in markets})
+    started = time.perf_counter()
+    asyncio.run(engine.scan(markets))
+    concurrent = time.perf_counter() - started
+    scan_requests = engine.requests
+
+    engine.requests = 0
+    started = time.perf_counter()
+    table = asyncio.run(engine.snapshot(markets))
+    snapshot = time.perf_counter() - started
+
+    requests = len(markets) * symbols_per_exchange
+    print(f"{requests} symbols, latency {latency * 1000:.0f}ms")
+    print(f"sequential: {sequential:.3f}s, {requests} requests")
+    print(f"async:      {concurrent:.3f}s (x{sequential / concurrent:.1f}), {scan_requests} requests")
+    print(f"snapshot:   {snapshot:.3f}s, {engine.requests} requests, {len(table)} prices")
+
+
+if __name__ == '__main__':
+    benchmark()
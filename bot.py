@@ -1,15 +1,24 @@
 import os
 import asyncio
 import logging
-import sqlite3
+import time
 import json
-import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from cryptobot import CryptoBotAPI, CryptoBotHealth
+from dedup import SignalDedup
+from reconciler import InvoiceReconciler
+from scanner import ArbitrageScanner
+from scan_service import ScanService, with_volume
+from fanout import SubscriberIndex
+from outbox import HIGH, LOW, Outbox
+from scan_counter import ScanCounter
+from storage import DBExecutor, get_storage
+from user_cache import UserCache
 
 # ========== НАСТРОЙКИ ==========
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -29,6 +38,11 @@ print(f"💰 CryptoBot: {'✅ Найден' if CRYPTOBOT_TOKEN else '❌ Не н
 # Настройки
 ADMIN_IDS = [5899591298]
 CHANNEL_ID = '@testscanset'
+SCAN_INTERVAL = int(os.getenv('SCAN_INTERVAL', 15))  # не чаще одного скана бирж за N секунд
+DEMO_PAIRS = os.getenv('DEMO_PAIRS') == '1'  # отладка: тестовые связки в ответе кнопки скана
+PUSH_MIN_GROSS_PCT = 1.0  # связки с меньшим спредом не рассылаются никому
+SIGNAL_TTL = 600  # пропавшая на столько секунд связка при возвращении снова считается новой
+SIGNAL_MIN_CHANGE = 1.0  # повторная отправка, если профит вырос на столько п.п.
 
 # Тарифы (дни: цена в USD)
 TARIFFS = {
@@ -37,103 +51,28 @@ TARIFFS = {
     90: {"price": 120, "discount": "💰 Экономия $30"}  # 90 дней за $120
 }
 
-# ========== ПРАВИЛЬНАЯ ИНТЕГРАЦИЯ CRYPTOBOT ==========
-class CryptoBotAPI:
-    def __init__(self, token):
-        self.token = token
-        # ПРАВИЛЬНЫЙ URL для CryptoPay API
-        self.base_url = "https://pay.crypt.bot/api"
-        
-    async def create_invoice(self, amount, currency="USD", description=""):
-        """Создание инвойса в CryptoBot - ПРАВИЛЬНЫЙ МЕТОД"""
-        try:
-            # ПРАВИЛЬНЫЙ формат запроса
-            payload = {
-                "asset": "USDT",  # Фиксированная валюта
-                "amount": str(amount),
-            }
-            
-            headers = {
-                "Crypto-Pay-API-Token": self.token,
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/createInvoice",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            print(f"🔍 CryptoBot Response Status: {response.status_code}")
-            print(f"🔍 CryptoBot Response Text: {response.text}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("ok"):
-                    result = data.get("result")
-                    return {
-                        'success': True,
-                        'invoice_id': result.get('invoice_id'),
-                        'hash': result.get('hash'),
-                        'pay_url': result.get('pay_url'),
-                        'bot_invoice_url': f"https://t.me/CryptoBot?start={result.get('hash')}",
-                        'amount': result.get('amount'),
-                        'asset': result.get('asset'),
-                        'status': result.get('status')
-                    }
-                else:
-                    error_msg = data.get('error', {}).get('name', 'Unknown error')
-                    print(f"❌ CryptoBot API Error: {error_msg}")
-                    return {
-                        'success': False,
-                        'error': error_msg
-                    }
-            else:
-                print(f"❌ HTTP Error {response.status_code}: {response.text}")
-                return {
-                    'success': False,
-                    'error': f"HTTP {response.status_code}"
-                }
-                
-        except Exception as e:
-            print(f"❌ Exception in CryptoBot API: {str(e)}")
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    async def test_connection(self):
-        """Тест подключения к CryptoBot API"""
-        try:
-            headers = {"Crypto-Pay-API-Token": self.token}
-            response = requests.get(
-                f"{self.base_url}/getMe",
-                headers=headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("ok"):
-                    app_info = data.get("result", {})
-                    return {
-                        'success': True,
-                        'app_id': app_info.get('app_id'),
-                        'name': app_info.get('name'),
-                        'payment_processing_bot_username': app_info.get('payment_processing_bot_username')
-                    }
-            return {'success': False, 'error': 'Connection failed'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
-
 # Инициализируем CryptoBot
 cryptobot = CryptoBotAPI(CRYPTOBOT_TOKEN)
+# Статус getMe проверяется в фоне, /start читает готовый результат
+cryptobot_health = CryptoBotHealth(cryptobot, interval=60)
 
 # ========== БАЗА ДАННЫХ ==========
+db = get_storage('cryptobot.db')
+db_executor = DBExecutor()  # все запросы из handlers идут через этот поток
+
+# Декодированные строки users; сбрасываются всеми путями записи
+user_cache = UserCache(max_size=10000, ttl=300)
+# Счетчик сканов копится в памяти и пишется пачками (колонки last_scan тут нет);
+# записанные приращения прибавляются к кэшу, а не сбрасывают его
+scan_counter = ScanCounter(db, last_scan_column=None, on_flush=lambda deltas: user_cache.update_many(
+    deltas, lambda user, change: {**user, 'total_scans': (user['total_scans'] or 0) + change[0]}))
+
+async def run_db(func, *args):
+    """Вызов helper базы из async-кода без блокировки event loop"""
+    return await db_executor.run(func, *args)
+
 def init_db():
-    conn = sqlite3.connect('cryptobot.db')
-    c = conn.cursor()
+    c = db.connection()
     
     # Таблица пользователей
     c.execute('''CREATE TABLE IF NOT EXISTS users
@@ -143,7 +82,7 @@ def init_db():
                   min_profit REAL DEFAULT 5,
                   min_profit_pct REAL DEFAULT 3.0,
                   networks TEXT DEFAULT '["BEP20","TRC20"]',
-                  brokers TEXT DEFAULT '["Binance","Bybit"]',
+                  brokers TEXT DEFAULT '[]',
                   subscription_days INTEGER DEFAULT 0,
                   subscription_until TEXT,
                   total_scans INTEGER DEFAULT 0,
@@ -162,22 +101,35 @@ def init_db():
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                   paid_at TIMESTAMP)''')
     
-    conn.commit()
-    conn.close()
+    # Прежнее значение по умолчанию: Binance не сканируется, и с ним связки
+    # не подходили никому. Поменять биржи в боте нельзя - это всегда default
+    c.execute('''UPDATE users SET brokers = '[]' WHERE brokers = '["Binance","Bybit"]' ''')
 
 init_db()
 
-def get_user(user_id):
-    conn = sqlite3.connect('cryptobot.db')
-    c = conn.cursor()
-    c.execute('''SELECT * FROM users WHERE user_id = ?''', (user_id,))
-    user = c.fetchone()
-    conn.close()
-    
+def _load_user(user_id):
+    user = db.fetchone('''SELECT * FROM users WHERE user_id = ?''', (user_id,))
+    if not user:
+        return None
+    return {
+        'user_id': user[0],
+        'username': user[1],
+        'min_volume': user[2],
+        'min_profit': user[3],
+        'min_profit_pct': user[4],
+        'networks': json.loads(user[5]),
+        'brokers': json.loads(user[6]),
+        'subscription_days': user[7],
+        'subscription_until': user[8],
+        'total_scans': user[9]
+    }
+
+def _user_view(user):
+    """Копия закэшированного пользователя с остатком подписки и сканами из буфера"""
     if user:
         # Проверяем подписку
-        sub_until = user[8]
-        sub_days = user[7]
+        sub_until = user['subscription_until']
+        sub_days = user['subscription_days']
         
         if sub_until:
             try:
@@ -192,93 +144,182 @@ def get_user(user_id):
         else:
             remaining_days = sub_days
         
+        total_scans, _ = scan_counter.merge(user['user_id'], user['total_scans'])
         return {
-            'user_id': user[0],
-            'username': user[1],
-            'min_volume': user[2],
-            'min_profit': user[3],
-            'min_profit_pct': user[4],
-            'networks': json.loads(user[5]),
-            'brokers': json.loads(user[6]),
+            **user,
+            'networks': list(user['networks']),
+            'brokers': list(user['brokers']),
             'subscription_days': remaining_days,
-            'subscription_until': sub_until,
-            'total_scans': user[9]
+            'total_scans': total_scans
         }
     else:
         return None
 
+def get_user(user_id):
+    with scan_counter.consistent():
+        return _user_view(user_cache.get(user_id, lambda: _load_user(user_id)))
+
+def cached_user(user_id):
+    """Пользователь из кэша без обращения к базе; None - нужен get_user"""
+    with scan_counter.consistent(blocking=False) as ready:
+        if not ready:
+            return None  # идет flush счетчиков - не ждем его в event loop
+        user = user_cache.peek(user_id)
+        return _user_view(user) if user else None
+
+async def load_user(user_id):
+    """get_user для handlers: повторная навигация по меню не идет в базу"""
+    return cached_user(user_id) or await run_db(get_user, user_id)
+
 def create_user(user_id, username):
-    conn = sqlite3.connect('cryptobot.db')
-    c = conn.cursor()
-    c.execute('''INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)''', 
-              (user_id, username))
-    conn.commit()
-    conn.close()
+    # brokers явно: у старых баз в DEFAULT колонки еще несканируемый Binance
+    db.execute('''INSERT OR IGNORE INTO users (user_id, username, brokers) VALUES (?, ?, '[]')''', 
+               (user_id, username))
 
 def add_subscription(user_id, days):
-    conn = sqlite3.connect('cryptobot.db')
-    c = conn.cursor()
-    
-    # Получаем текущую дату окончания
-    c.execute('''SELECT subscription_until FROM users WHERE user_id = ?''', (user_id,))
-    result = c.fetchone()
-    
-    if result and result[0]:
-        try:
-            until_date = datetime.fromisoformat(result[0])
-            if until_date > datetime.now():
-                new_until = until_date + timedelta(days=days)
-            else:
+    # Чтение и запись даты окончания - одна транзакция
+    with db.transaction() as c:
+        # Получаем текущую дату окончания
+        result = c.execute('''SELECT subscription_until FROM users WHERE user_id = ?''', (user_id,)).fetchone()
+        
+        if result and result[0]:
+            try:
+                until_date = datetime.fromisoformat(result[0])
+                if until_date > datetime.now():
+                    new_until = until_date + timedelta(days=days)
+                else:
+                    new_until = datetime.now() + timedelta(days=days)
+            except:
                 new_until = datetime.now() + timedelta(days=days)
-        except:
+        else:
             new_until = datetime.now() + timedelta(days=days)
-    else:
-        new_until = datetime.now() + timedelta(days=days)
-    
-    c.execute('''UPDATE users SET subscription_days = ?, subscription_until = ? WHERE user_id = ?''',
-              (days, new_until.isoformat(), user_id))
-    
-    conn.commit()
-    conn.close()
+        
+        c.execute('''UPDATE users SET subscription_days = ?, subscription_until = ? WHERE user_id = ?''',
+                  (days, new_until.isoformat(), user_id))
     
+    # Кэш и индекс подписчиков обновляются только после commit внешней
+    # транзакции (refresh_subscriptions) - при откате ничего не меняется
     return new_until
 
+def refresh_subscriptions(user_ids):
+    """После commit: сброс кэша и обновление индекса рассылки для user_ids"""
+    user_cache.invalidate_many(user_ids)
+    for user_id in user_ids:
+        subscribers.upsert_user(get_user(user_id))
+
 def save_payment(user_id, invoice_id, invoice_hash, amount, days, asset='USDT'):
     """Сохранение информации о платеже"""
-    conn = sqlite3.connect('cryptobot.db')
-    c = conn.cursor()
-    
-    c.execute('''INSERT OR REPLACE INTO payments 
-                 (user_id, invoice_id, invoice_hash, amount, asset, days, status) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
-              (user_id, invoice_id, invoice_hash, amount, asset, days, 'active'))
-    
-    conn.commit()
-    conn.close()
+    db.execute('''INSERT OR REPLACE INTO payments 
+                  (user_id, invoice_id, invoice_hash, amount, asset, days, status) 
+                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
+               (user_id, invoice_id, invoice_hash, amount, asset, days, 'active'))
 
 def update_payment_status(invoice_id, status):
-    """Обновление статуса платежа"""
-    conn = sqlite3.connect('cryptobot.db')
-    c = conn.cursor()
-    
-    c.execute('''UPDATE payments SET status = ?, paid_at = CURRENT_TIMESTAMP 
-                 WHERE invoice_id = ?''', (status, invoice_id))
-    
-    # Если платеж оплачен, активируем подписку
-    if status == 'paid':
-        c.execute('''SELECT user_id, days FROM payments WHERE invoice_id = ?''', (invoice_id,))
-        result = c.fetchone()
-        if result:
-            user_id, days = result
-            add_subscription(user_id, days)
-    
-    conn.commit()
-    conn.close()
+    """Обновление статуса платежа; (user_id, days), если подписка активирована.
+
+    Кэши не трогает: вызывающий после commit передает user_id в
+    refresh_subscriptions (см. apply_invoice_statuses).
+    """
+    # Статус и подписка меняются вместе: add_subscription входит в эту же транзакцию
+    with db.transaction() as c:
+        # Повторный 'paid' (вебхук + сверка) ничего не меняет - подписка не удвоится
+        changed = c.execute('''UPDATE payments SET status = ?, paid_at = CURRENT_TIMESTAMP 
+                               WHERE invoice_id = ? AND status != ?''', (status, invoice_id, status)).rowcount
+        
+        # Если платеж оплачен, активируем подписку
+        if status == 'paid' and changed:
+            result = c.execute('''SELECT user_id, days FROM payments WHERE invoice_id = ?''', (invoice_id,)).fetchone()
+            if result:
+                user_id, days = result
+                add_subscription(user_id, days)
+                return user_id, days
+    return None
+
+def get_payment_status(invoice_id):
+    row = db.fetchone('''SELECT status FROM payments WHERE invoice_id = ?''', (str(invoice_id),))
+    return row[0] if row else None
+
+def get_active_payments():
+    """(invoice_id, created_at unix) неоплаченных счетов для сверки"""
+    rows = db.fetchall('''SELECT invoice_id, created_at FROM payments WHERE status = 'active' ''')
+    result = []
+    for invoice_id, created_at in rows:
+        try:
+            # CURRENT_TIMESTAMP хранится в UTC
+            created = datetime.fromisoformat(created_at).replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            created = 0
+        result.append((str(invoice_id), created))
+    return result
+
+def apply_invoice_statuses(updates):
+    """Статусы счетов из сверки одной транзакцией; [(user_id, days)] активированных подписок"""
+    activated = []
+    with db.transaction():
+        for invoice_id, status in updates:
+            result = update_payment_status(invoice_id, status)
+            if result:
+                activated.append(result)
+    # Только после commit: при откате индекс не получит неоплаченную подписку
+    refresh_subscriptions([user_id for user_id, _ in activated])
+    return activated
 
 # ========== ИНИЦИАЛИЗАЦИЯ БОТА ==========
 logging.basicConfig(level=logging.INFO)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
+# Все исходящие сигналы и уведомления идут через очередь с лимитами Telegram
+outbox = Outbox(bot)
+
+# Один скан на всех пользователей, пороги применяются к общему результату
+scanner = ArbitrageScanner(incremental=True)  # общий набор связок пересчитывается по изменившимся ценам
+scan_service = ScanService(scanner, interval=SCAN_INTERVAL)
+subscribers = SubscriberIndex(scanner.exchanges)  # индекс подписчиков для push-рассылки связок
+# Одна и та же связка не рассылается на каждом скане, пока она держится
+signal_dedup = SignalDedup(ttl=SIGNAL_TTL, min_change=SIGNAL_MIN_CHANGE)
+
+async def apply_payments(updates):
+    activated = await run_db(apply_invoice_statuses, updates)
+    for user_id, days in activated:
+        outbox.send(user_id, f"✅ Оплата получена! Подписка продлена на {days} дней", priority=HIGH)
+
+# Оплаты сверяются пачками в фоне, вебхук CryptoPay - быстрый путь
+reconciler = InvoiceReconciler(cryptobot, lambda: run_db(get_active_payments), apply_payments,
+                               webhook_token=CRYPTOBOT_TOKEN)
+CRYPTOBOT_WEBHOOK_PORT = int(os.getenv('CRYPTOBOT_WEBHOOK_PORT', 0))  # 0 - без вебхука
+
+async def push_signals():
+    """Фоновая рассылка: новые и заметно улучшившиеся связки - в канал и подписчикам"""
+    while True:
+        try:
+            opportunities = await scan_service.opportunities()
+            subscribers.expire()
+            now = time.monotonic()
+            for opp in opportunities:
+                if opp['gross_pct'] < PUSH_MIN_GROSS_PCT:
+                    continue
+                # Дедупликация после подбора получателей: запоминается только
+                # то, что реально поставлено в очередь
+                channel = [CHANNEL_ID] if scan_service.apply_settings([opp]) else []
+                if signal_dedup.recipients(opp, channel, now):
+                    outbox.send(CHANNEL_ID, scanner.format_signal(opp), priority=LOW)
+                for variant, user_ids in subscribers.match_by_signal(opp, scanner.fees).items():
+                    user_ids = signal_dedup.recipients(opp, user_ids, now)
+                    if not user_ids:
+                        continue
+                    text = scanner.format_signal(with_volume(opp, variant.volume, network=variant.network,
+                                                             withdraw_fee=variant.withdraw_fee,
+                                                             withdraw_usd=variant.withdraw_usd))
+                    for user_id in user_ids:
+                        outbox.send(user_id, text, merge=True)
+        except Exception as e:
+            logging.warning(f"Signal push failed: {e}")
+        await asyncio.sleep(SCAN_INTERVAL)
+
+def load_subscribers():
+    """Заполняет индекс подписчиков из базы при старте"""
+    user_ids = [row[0] for row in db.fetchall('''SELECT user_id FROM users WHERE subscription_until IS NOT NULL''')]
+    subscribers.load_users(get_user(user_id) for user_id in user_ids)
 
 # ========== СОСТОЯНИЯ ==========
 class Form(StatesGroup):
@@ -292,13 +333,15 @@ async def cmd_start(message: types.Message):
     user_id = message.from_user.id
     username = message.from_user.username or message.from_user.first_name
     
-    create_user(user_id, username)
-    user = get_user(user_id)
+    user = await load_user(user_id)
+    if user is None:
+        await run_db(create_user, user_id, username)
+        user = await run_db(get_user, user_id)
     
-    # Проверяем подключение к CryptoBot
+    # Статус CryptoBot из фоновой проверки - без запроса к API
     cryptobot_status = ""
     if CRYPTOBOT_TOKEN:
-        test_result = await cryptobot.test_connection()
+        test_result = cryptobot_health.status
         if test_result['success']:
             cryptobot_status = "✅ CryptoBot подключен"
         else:
@@ -370,7 +413,8 @@ async def process_tariff(callback: types.CallbackQuery):
     
     if invoice_result['success']:
         # Сохраняем платеж
-        save_payment(
+        await run_db(
+            save_payment,
             callback.from_user.id,
             invoice_result['invoice_id'],
             invoice_result['hash'],
@@ -429,8 +473,36 @@ async def check_payment(callback: types.CallbackQuery):
     
     await callback.answer("Проверяем статус платежа...")
     
-    # Здесь можно добавить реальную проверку через CryptoBot API
-    # Пока используем заглушку
+    # Проверка идет в общей пачке сверки, а не отдельным запросом на клик
+    status = await reconciler.check(invoice_id)
+    if status is None or status == 'paid':
+        status = await run_db(get_payment_status, invoice_id)
+    
+    if status == 'paid':
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="👤 Профиль", callback_data="profile")]
+        ])
+        await callback.message.edit_text(
+            f"✅ <b>Оплата получена</b>\n\n"
+            f"🆔 ID: <code>{invoice_id}</code>\n"
+            f"Подписка активирована.",
+            reply_markup=keyboard,
+            parse_mode='HTML'
+        )
+        return
+    
+    if status == 'expired':
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="💳 Новый платеж", callback_data="buy_subscription")]
+        ])
+        await callback.message.edit_text(
+            f"⌛ <b>Счет истек</b>\n\n"
+            f"🆔 ID: <code>{invoice_id}</code>\n"
+            f"Создайте новый платеж.",
+            reply_markup=keyboard,
+            parse_mode='HTML'
+        )
+        return
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔄 Проверить снова", callback_data=f"check_{invoice_id}")],
@@ -440,7 +512,7 @@ async def check_payment(callback: types.CallbackQuery):
     await callback.message.edit_text(
         f"🔄 <b>Проверка платежа</b>\n\n"
         f"🆔 ID: <code>{invoice_id}</code>\n"
-        f"📊 Статус: <b>Проверяется...</b>\n\n"
+        f"📊 Статус: <b>Ожидает оплаты</b>\n\n"
         f"Если вы уже оплатили, подождите 1-2 минуты\n"
         f"и проверьте снова.",
         reply_markup=keyboard,
@@ -455,7 +527,7 @@ async def start_menu(callback: types.CallbackQuery):
 # ========== ПРОСТЫЕ ОБРАБОТЧИКИ ==========
 @dp.callback_query(F.data == "profile")
 async def profile_handler(callback: types.CallbackQuery):
-    user = get_user(callback.from_user.id)
+    user = await load_user(callback.from_user.id)
     
     sub_info = ""
     if user['subscription_until']:
@@ -482,7 +554,7 @@ async def profile_handler(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data == "scan")
 async def scan_handler(callback: types.CallbackQuery):
-    user = get_user(callback.from_user.id)
+    user = await load_user(callback.from_user.id)
     
     if user['subscription_days'] <= 0:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -501,20 +573,34 @@ async def scan_handler(callback: types.CallbackQuery):
     
     await callback.answer("🔍 Начинаю сканирование...")
     
-    # Имитация сканирования
-    await asyncio.sleep(2)
+    chat_id = callback.message.chat.id
+    # Общий набор - только реальные цены; тестовые связки не уходят в рассылку
+    try:
+        raw = await scan_service.opportunities()
+    except Exception as e:
+        # Первый скан не удался и отдать прошлый результат нечем
+        logging.warning(f"Scan failed: {e}")
+        outbox.send(chat_id, "⚠️ Не удалось получить цены с бирж, попробуйте через минуту", priority=HIGH)
+        return
+    if DEMO_PAIRS:
+        raw = raw + scanner.demo_opportunities()
+    opportunities = scan_service.apply_settings(
+        raw,
+        user['min_volume'],
+        user['min_profit'],
+        user['min_profit_pct'],
+        user['networks'],
+        brokers=user['brokers']
+    )
     
-    # Тестовые данные
-    opportunities = [
-        "📈 BTC: Binance → Bybit (+$215, +0.43%)",
-        "📈 ETH: KuCoin → Binance (+$86, +0.86%)",
-        "📈 SOL: Bybit → KuCoin (+$45, +1.2%)"
-    ]
+    scan_counter.increment(callback.from_user.id)
     
+    # Связки склеиваются очередью в несколько сообщений вместо одного на каждую
     for opp in opportunities:
-        await callback.message.reply(opp)
+        outbox.send(chat_id, scanner.format_signal(opp), priority=HIGH, merge=True)
     
-    await callback.answer(f"✅ Найдено {len(opportunities)} связок")
+    if not opportunities:
+        outbox.send(chat_id, "🔍 Связок по вашим настройкам не найдено", priority=HIGH)
 
 @dp.callback_query(F.data == "help")
 async def help_handler(callback: types.CallbackQuery):
@@ -553,8 +639,8 @@ async def test_cryptobot_cmd(message: types.Message):
     
     await message.answer("🔍 Тестирую подключение к CryptoBot...")
     
-    # Тест подключения
-    test_result = await cryptobot.test_connection()
+    # Живой тест подключения, заодно обновляет кэшированный статус
+    test_result = await cryptobot_health.probe()
     
     if test_result['success']:
         await message.answer(
@@ -575,6 +661,18 @@ async def test_cryptobot_cmd(message: types.Message):
             parse_mode='HTML'
         )
 
+@dp.message(Command("stats"))
+async def stats_cmd(message: types.Message):
+    """Метрики кэша, базы и сканера для админа"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    
+    lines = [cryptobot_health.report(), user_cache.report(), outbox.report(), signal_dedup.report(),
+             scanner.renderer.report(), *([scanner.recorder.report()] if scanner.recorder else []),
+             *db_executor.report()[:5],
+             f"scan service: {scan_service.scans} scans / {scan_service.requests} requests"]
+    await message.answer("📈 <b>Статистика</b>\n\n" + "\n".join(lines), parse_mode='HTML')
+
 @dp.message(Command("create_invoice"))
 async def create_invoice_cmd(message: types.Message):
     """Тест создания инвойса"""
@@ -616,7 +714,7 @@ async def main():
     # Тестируем подключение к CryptoBot
     if CRYPTOBOT_TOKEN:
         print("🔍 Тестирую подключение к CryptoBot...")
-        test_result = await cryptobot.test_connection()
+        test_result = await cryptobot_health.probe()
         
         if test_result['success']:
             print(f"✅ CryptoBot подключен: {test_result.get('name')}")
@@ -626,9 +724,41 @@ async def main():
     else:
         print("⚠️  CRYPTOBOT_TOKEN не найден. Оплата отключена.")
     
+    # Рынки грузим в потоке, чтобы не блокировать event loop
+    await asyncio.get_event_loop().run_in_executor(None, scanner.load_markets)
+    await run_db(load_subscribers)
+    print(f"📬 Подписчиков в индексе рассылки: {len(subscribers)}")
+    
+    outbox.start()
+    pusher = asyncio.ensure_future(push_signals())
+    webhook = None
+    if CRYPTOBOT_TOKEN:
+        cryptobot_health.start()
+        reconciler.start()
+        if CRYPTOBOT_WEBHOOK_PORT:
+            webhook = await reconciler.start_webhook(port=CRYPTOBOT_WEBHOOK_PORT)
+            print(f"🔔 Вебхук CryptoBot на порту {CRYPTOBOT_WEBHOOK_PORT}")
+    
     print("✅ Бот запущен! Используйте /start")
     
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await cryptobot_health.stop()
+        await reconciler.stop()
+        if webhook is not None:
+            await webhook.cleanup()
+        pusher.cancel()
+        await outbox.stop()
+        # Остаток счетчиков дописываем до остановки потока базы
+        await run_db(scan_counter.close)
+        db_executor.shutdown()
+        await cryptobot.close()
+        if scanner.recorder is not None:
+            scanner.recorder.close()
+            print(f"📼 {scanner.recorder.report()}")
+        for line in [user_cache.report(), outbox.report(), *db_executor.report()]:
+            print(f"🗄 {line}")
 
 if __name__ == '__main__':
     asyncio.run(main())
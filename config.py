@@ -8,6 +8,10 @@ CHANNEL_ID = os.getenv('CHANNEL_ID', '@arbitrage_signals')
 ADMIN_IDS = [int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip().isdigit()]
 NOWPAYMENTS_API_KEY = os.getenv('NOWPAYMENTS_API_KEY')
 SUBSCRIPTION_PRICE = float(os.getenv('SUBSCRIPTION_PRICE', 50))
+MARKET_CACHE_DIR = os.getenv('MARKET_CACHE_DIR', 'market_cache')
+MARKET_CACHE_TTL = int(os.getenv('MARKET_CACHE_TTL', 6 * 3600))
+FEE_CACHE_TTL = int(os.getenv('FEE_CACHE_TTL', 3600))
+TICK_DIR = os.getenv('TICK_DIR')  # каталог записи котировок (None - не писать)
 
 DEFAULT_SETTINGS = {
     'min_volume': 100,
@@ -17,6 +21,20 @@ DEFAULT_SETTINGS = {
     'brokers': ['KuCoin', 'Bybit', 'OKX', 'Gate.io', 'HTX']
 }
 
+# Прежняя упрощенная модель комиссий (когда нет FeeTable): -0.4% к спреду,
+# 98% от профита в USD
+TRADE_FEE_PCT = 0.4
+PROFIT_FACTOR = 0.98
+
+# Имя биржи в сканере -> ключ EXCHANGE_LINKS
+EXCHANGE_NAMES = {
+    'kucoin': 'KuCoin',
+    'bybit': 'Bybit',
+    'okx': 'OKX',
+    'gateio': 'Gate.io',
+    'htx': 'HTX'
+}
+
 EXCHANGE_LINKS = {
     'KuCoin': 'https://www.kucoin.com/ru/trade/{}-USDT',
     'Bybit': 'https://www.bybit.com/ru-RU/trade/spot/{}/USDT',
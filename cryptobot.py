@@ -0,0 +1,358 @@
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://pay.crypt.bot/api"
+# Временные ответы, которые повторяются для идемпотентных методов
+RETRY_STATUSES = {429, 502, 503, 504}
+# Запрос точно не обработан (лимит, сервис недоступен) - можно повторить и
+# создание счета; 502/504 шлюза могут прийти, когда счет уже создан
+SAFE_RETRY_STATUSES = {429, 503}
+MAX_INVOICES_PER_CALL = 1000  # лимит count у getInvoices
+
+
+def check_signature(token: str, body: bytes, signature: str) -> bool:
+    """Подпись вебхука: HMAC-SHA256 тела с ключом SHA256(token)"""
+    secret = hashlib.sha256(token.encode()).digest()
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or '')
+
+
+class CryptoBotError(Exception):
+    """Ответ CryptoPay с ok=false или HTTP-ошибка, которую нет смысла повторять"""
+
+
+class CryptoBotAPI:
+    """Клиент CryptoPay API на общей aiohttp-сессии.
+
+    Соединения переиспользуются (keep-alive), одновременных запросов не
+    больше max_concurrency, у каждого вызова свой таймаут. Временные ошибки
+    повторяются с экспоненциальной задержкой: для идемпотентных методов
+    (getMe, getInvoices) - любые сетевые ошибки и 5xx, для createInvoice -
+    только отказ соединения и SAFE_RETRY_STATUSES, чтобы не создать счет дважды.
+    """
+
+    def __init__(self, token, base_url: str = BASE_URL, timeout: float = 10,
+                 invoice_timeout: float = 30, max_concurrency: int = 10, retries: int = 3,
+                 backoff: float = 0.5):
+        self.token = token
+        self.base_url = base_url
+        self.timeout = timeout
+        self.invoice_timeout = invoice_timeout
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0  # HTTP-запросов, включая повторы
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None  # создается внутри цикла
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Crypto-Pay-API-Token": self.token or ""},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _call(self, method: str, payload: Optional[Dict] = None,
+                    timeout: Optional[float] = None, idempotent: bool = True) -> Dict:
+        """result метода API; CryptoBotError при ok=false или исчерпанных повторах"""
+        session = self._get_session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        url = f"{self.base_url}/{method}"
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    async with session.post(url, json=payload or {}, timeout=client_timeout) as response:
+                        if idempotent:
+                            retry = response.status in RETRY_STATUSES or response.status >= 500
+                        else:
+                            retry = response.status in SAFE_RETRY_STATUSES
+                            if not retry and response.status >= 500:
+                                raise CryptoBotError(f"HTTP {response.status}")
+                        if retry:
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history, status=response.status)
+                        try:
+                            data = await response.json(content_type=None)
+                        except ValueError:
+                            raise CryptoBotError(f"HTTP {response.status}")
+                if not data.get("ok"):
+                    error = data.get("error", {})
+                    raise CryptoBotError(error.get("name", f"HTTP {response.status}")
+                                         if isinstance(error, dict) else str(error))
+                return data.get("result")
+            except aiohttp.ClientResponseError as e:
+                error = CryptoBotError(f"HTTP {e.status}")
+            except aiohttp.ClientConnectorError as e:
+                error = CryptoBotError(str(e))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not idempotent:
+                    raise CryptoBotError(str(e) or type(e).__name__)
+                error = CryptoBotError(str(e) or type(e).__name__)
+
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        raise error
+
+    async def create_invoice(self, amount, currency="USD", description=""):
+        """Создание инвойса в CryptoBot"""
+        payload = {
+            "asset": "USDT",  # Фиксированная валюта
+            "amount": str(amount),
+        }
+        try:
+            result = await self._call("createInvoice", payload, timeout=self.invoice_timeout,
+                                      idempotent=False)
+        except CryptoBotError as e:
+            print(f"❌ CryptoBot API Error: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+        return {
+            'success': True,
+            'invoice_id': result.get('invoice_id'),
+            'hash': result.get('hash'),
+            'pay_url': result.get('pay_url'),
+            'bot_invoice_url': f"https://t.me/CryptoBot?start={result.get('hash')}",
+            'amount': result.get('amount'),
+            'asset': result.get('asset'),
+            'status': result.get('status')
+        }
+
+    async def get_invoices(self, invoice_ids: List, status: Optional[str] = None) -> List[Dict]:
+        """Счета по списку id одним запросом (не больше MAX_INVOICES_PER_CALL)"""
+        payload = {"invoice_ids": ",".join(str(i) for i in invoice_ids), "count": len(invoice_ids)}
+        if status:
+            payload["status"] = status
+        result = await self._call("getInvoices", payload)
+        return (result or {}).get("items", [])
+
+    async def test_connection(self):
+        """Тест подключения к CryptoBot API"""
+        try:
+            app_info = await self._call("getMe") or {}
+        except CryptoBotError as e:
+            return {'success': False, 'error': str(e)}
+        return {
+            'success': True,
+            'app_id': app_info.get('app_id'),
+            'name': app_info.get('name'),
+            'payment_processing_bot_username': app_info.get('payment_processing_bot_username')
+        }
+
+
+class CryptoBotHealth:
+    """Фоновая проверка getMe с кэшированным результатом.
+
+    Handlers читают status без сетевых запросов. Пока CryptoPay отвечает,
+    проверка идет раз в interval секунд (с разбросом +-20%); при ошибках
+    интервал удваивается до max_backoff, чтобы не долбить лежащий сервис.
+    """
+
+    def __init__(self, api: CryptoBotAPI, interval: float = 60, max_backoff: float = 900):
+        self.api = api
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.status: Dict = {'success': None, 'error': 'Проверяется'}
+        self.checked_at = 0.0
+        self.latency = 0.0
+        self.probes = 0
+        self.failures = 0  # всего неудачных проверок
+        self.consecutive_failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ok(self) -> Optional[bool]:
+        return self.status.get('success')
+
+    async def probe(self) -> Dict:
+        started = time.perf_counter()
+        result = await self.api.test_connection()
+        self.latency = time.perf_counter() - started
+        self.probes += 1
+        self.checked_at = time.time()
+        if result['success']:
+            if self.consecutive_failures:
+                logger.info("CryptoBot is back after %d failed probes", self.consecutive_failures)
+            self.consecutive_failures = 0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            logger.warning("CryptoBot probe failed (%d in a row): %s",
+                           self.consecutive_failures, result.get('error'))
+        self.status = result
+        return result
+
+    def next_delay(self) -> float:
+        delay = min(self.interval * 2 ** self.consecutive_failures, self.max_backoff)
+        return delay * random.uniform(0.8, 1.2)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.next_delay())
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.warning("CryptoBot probe crashed: %s", e)
+
+    def report(self) -> str:
+        state = {True: 'up', False: 'down', None: 'unknown'}[self.ok]
+        age = time.time() - self.checked_at if self.checked_at else 0
+        return (f"cryptobot: {state}, checked {age:.0f}s ago in {self.latency * 1000:.0f}ms, "
+                f"{self.failures}/{self.probes} probes failed")
+
+
+# ========== ЛОКАЛЬНЫЙ CRYPTOPAY ==========
+class FakeCryptoPay:
+    """Локальная замена pay.crypt.bot для тестов и нагрузки.
+
+    latency - задержка каждого ответа, error_rate - доля ответов 503,
+    hang_rate - доля запросов, на которые сервер не отвечает дольше таймаута.
+    """
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, hang_rate: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.host = host
+        self.port = port
+        self.received = 0
+        self.invoices: Dict[int, Dict] = {}
+        self.calls: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._rng = random.Random(seed)
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}/api'
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/api/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _handle(self, request):
+        self.received += 1
+        roll = self._rng.random()
+        if roll < self.hang_rate:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.latency)
+        if roll < self.hang_rate + self.error_rate:
+            return web.json_response({'ok': False, 'error': {'name': 'SERVICE_UNAVAILABLE'}}, status=503)
+
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        payload = await request.json() if request.can_read_body else {}
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'app_id': 1, 'name': 'local', 'payment_processing_bot_username': 'CryptoTestnetBot'}})
+        if method == 'createInvoice':
+            invoice_id = next(self._ids)
+            invoice = {'invoice_id': invoice_id, 'hash': f'IV{invoice_id}', 'status': 'active',
+                       'asset': payload.get('asset'), 'amount': payload.get('amount'),
+                       'pay_url': f'https://t.me/CryptoTestnetBot?start=IV{invoice_id}'}
+            self.invoices[invoice_id] = invoice
+            return web.json_response({'ok': True, 'result': invoice})
+        if method == 'getInvoices':
+            ids = [int(i) for i in str(payload.get('invoice_ids', '')).split(',') if i]
+            items = [self.invoices[i] for i in ids if i in self.invoices]
+            if payload.get('status'):
+                items = [item for item in items if item['status'] == payload['status']]
+            return web.json_response({'ok': True, 'result': {'items': items[:payload.get('count', 100)]}})
+        return web.json_response({'ok': False, 'error': {'name': 'METHOD_NOT_FOUND'}}, status=400)
+
+    def pay(self, invoice_id: int) -> Dict:
+        """Отмечает счет оплаченным; возвращает тело вебхука invoice_paid"""
+        invoice = self.invoices[invoice_id]
+        invoice['status'] = 'paid'
+        return {'update_type': 'invoice_paid', 'payload': invoice}
+
+    @staticmethod
+    def sign(token: str, update: Dict) -> tuple:
+        """(тело, подпись) вебхука, как их отправляет CryptoPay"""
+        body = json.dumps(update).encode()
+        secret = hashlib.sha256(token.encode()).digest()
+        return body, hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+async def load_test(calls: int = 300, latency: float = 0.05, error_rate: float = 0.2,
+                    hang_rate: float = 0.02):
+    server = FakeCryptoPay(latency=latency, error_rate=error_rate, hang_rate=hang_rate)
+    await server.start()
+    client = CryptoBotAPI('local', base_url=server.url, timeout=1, invoice_timeout=1,
+                          max_concurrency=20, backoff=0.05)
+
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - started - 0.01)
+
+    tick = asyncio.ensure_future(ticker())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(client.test_connection() for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+    invoice = await client.create_invoice(15)
+    done = True
+    await tick
+    await client.close()
+    await server.stop()
+
+    ok = sum(r['success'] for r in results)
+    print(f"{calls} getMe calls, {error_rate:.0%} errors + {hang_rate:.0%} hangs injected, "
+          f"{latency * 1000:.0f}ms latency")
+    print(f"succeeded {ok}/{calls} in {elapsed:.2f}s with {client.requests} HTTP requests, "
+          f"max loop lag {lag * 1000:.1f}ms")
+    print(f"createInvoice: {'ok' if invoice['success'] else invoice['error']}")
+
+
+if __name__ == '__main__':
+    asyncio.run(load_test())
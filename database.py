@@ -1,8 +1,26 @@
-import sqlite3
+import atexit
 import json
 from datetime import datetime, timedelta
 from typing import Dict, Any, List
 
+from scan_counter import ScanCounter
+from storage import get_storage
+from user_cache import UserCache
+
+db = get_storage('arbitrage_bot.db')
+# Декодированные настройки; сбрасываются при каждой записи в users
+settings_cache = UserCache(max_size=10000, ttl=300)
+
+def _apply_flushed_scans(settings: Dict[str, Any], change) -> Dict[str, Any]:
+    delta, last_scan = change
+    return {**settings, 'total_scans': (settings['total_scans'] or 0) + delta,
+            'last_scan': last_scan or settings.get('last_scan')}
+
+# total_scans и last_scan пишутся пачками, чтения прибавляют незаписанное;
+# записанное прибавляется к кэшу, а не сбрасывает его
+scan_counter = ScanCounter(db, on_flush=lambda changes: settings_cache.update_many(changes, _apply_flushed_scans))
+atexit.register(scan_counter.close)
+
 # Настройки по умолчанию
 DEFAULT_SETTINGS = {
     'min_volume': 100,
@@ -16,10 +34,7 @@ DEFAULT_SETTINGS = {
 }
 
 def init_db():
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    db.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
             username TEXT,
@@ -32,7 +47,7 @@ def init_db():
         )
     ''')
     
-    cursor.execute('''
+    db.execute('''
         CREATE TABLE IF NOT EXISTS payments (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
@@ -42,17 +57,13 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    conn.commit()
-    conn.close()
 
-def get_user_settings(user_id: int) -> Dict[str, Any]:
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT settings, subscription_days, username, total_scans FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+def _copy_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    # Списки копируем, чтобы изменения вызывающего кода не попали в кэш
+    return {key: list(value) if isinstance(value, list) else value for key, value in settings.items()}
+
+def _load_settings(user_id: int):
+    result = db.fetchone('SELECT settings, subscription_days, username, total_scans, last_scan FROM users WHERE user_id = ?', (user_id,))
     
     if result:
         settings = json.loads(result[0]) if result[0] else {}
@@ -61,26 +72,34 @@ def get_user_settings(user_id: int) -> Dict[str, Any]:
         subscription_days = result[1] or 0
         
         # Объединяем настройки: сначала дефолтные, потом из БД
-        user_settings = DEFAULT_SETTINGS.copy()
+        user_settings = _copy_settings(DEFAULT_SETTINGS)
         user_settings.update(settings)
         user_settings.update({
             'username': username,
             'total_scans': total_scans,
-            'subscription_days': subscription_days
+            'subscription_days': subscription_days,
+            'last_scan': result[4]
         })
         
         return user_settings
-    else:
-        # Новый пользователь
-        new_user_settings = DEFAULT_SETTINGS.copy()
-        new_user_settings['username'] = f'User{user_id}'
-        save_user_settings(user_id, new_user_settings)
-        return new_user_settings
+    return None
+
+def get_user_settings(user_id: int) -> Dict[str, Any]:
+    with scan_counter.consistent():
+        cached = settings_cache.get(user_id, lambda: _load_settings(user_id))
+        if cached:
+            user_settings = _copy_settings(cached)
+            user_settings['total_scans'], user_settings['last_scan'] = scan_counter.merge(
+                user_id, cached['total_scans'], cached.get('last_scan'))
+            return user_settings
+    
+    # Новый пользователь
+    new_user_settings = _copy_settings(DEFAULT_SETTINGS)
+    new_user_settings['username'] = f'User{user_id}'
+    save_user_settings(user_id, new_user_settings)
+    return new_user_settings
 
 def save_user_settings(user_id: int, settings: Dict[str, Any]):
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
     # Извлекаем поля для сохранения
     username = settings.get('username', f'User{user_id}')
     subscription_days = settings.get('subscription_days', 0)
@@ -88,61 +107,40 @@ def save_user_settings(user_id: int, settings: Dict[str, Any]):
     
     # Убираем поля, которые сохраняем отдельно
     settings_to_save = settings.copy()
-    for field in ['username', 'subscription_days', 'total_scans']:
+    for field in ['username', 'subscription_days', 'total_scans', 'last_scan']:
         settings_to_save.pop(field, None)
     
-    cursor.execute('''
-        INSERT OR REPLACE INTO users 
+    # total_scans задается только для новой строки: у существующей его
+    # ведет scan_counter, и перезапись потеряла бы незаписанные сканы
+    db.execute('''
+        INSERT INTO users 
         (user_id, username, settings, subscription_days, total_scans) 
         VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username = excluded.username,
+            settings = excluded.settings,
+            subscription_days = excluded.subscription_days
     ''', (user_id, username, json.dumps(settings_to_save), subscription_days, total_scans))
-    
-    conn.commit()
-    conn.close()
+    settings_cache.invalidate(user_id)
 
 def add_subscription_days(user_id: int, days: int):
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    db.execute('''
         UPDATE users SET subscription_days = subscription_days + ?
         WHERE user_id = ?
     ''', (days, user_id))
-    
-    conn.commit()
-    conn.close()
+    settings_cache.invalidate(user_id)
 
 def increment_scan_count(user_id: int):
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE users SET total_scans = total_scans + 1, last_scan = CURRENT_TIMESTAMP
-        WHERE user_id = ?
-    ''', (user_id,))
-    
-    conn.commit()
-    conn.close()
+    scan_counter.increment(user_id)
 
 def save_payment(user_id: int, payment_id: str, amount: float, status: str = 'pending'):
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    db.execute('''
         INSERT INTO payments (user_id, payment_id, amount, status)
         VALUES (?, ?, ?, ?)
     ''', (user_id, payment_id, amount, status))
-    
-    conn.commit()
-    conn.close()
 
 def get_payment_status(payment_id: str) -> Dict[str, Any]:
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM payments WHERE payment_id = ?', (payment_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = db.fetchone('SELECT * FROM payments WHERE payment_id = ?', (payment_id,))
     
     if result:
         return {
@@ -156,42 +154,27 @@ def get_payment_status(payment_id: str) -> Dict[str, Any]:
     return {}
 
 def update_payment_status(payment_id: str, status: str):
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    db.execute('''
         UPDATE payments SET status = ?
         WHERE payment_id = ?
     ''', (status, payment_id))
-    
-    conn.commit()
-    conn.close()
 
 def get_active_users_count() -> int:
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM users WHERE subscription_days > 0')
-    result = cursor.fetchone()
-    conn.close()
+    result = db.fetchone('SELECT COUNT(*) FROM users WHERE subscription_days > 0')
     
     return result[0] if result else 0
 
 def get_total_scans() -> int:
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT SUM(total_scans) FROM users')
-    result = cursor.fetchone()
-    conn.close()
+    with scan_counter.consistent():
+        result = db.fetchone('SELECT SUM(total_scans) FROM users')
+        pending = scan_counter.pending_total()
     
-    return result[0] if result and result[0] else 0
+    return (result[0] if result and result[0] else 0) + pending
 
 def get_all_users(limit: int = 100) -> List[Dict[str, Any]]:
-    conn = sqlite3.connect('arbitrage_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    # Сортировка по last_scan идет в SQL - сначала дописываем буфер
+    scan_counter.flush()
+    rows = db.fetchall('''
         SELECT user_id, username, subscription_days, total_scans, last_scan
         FROM users 
         ORDER BY last_scan DESC 
@@ -199,7 +182,7 @@ def get_all_users(limit: int = 100) -> List[Dict[str, Any]]:
     ''', (limit,))
     
     users = []
-    for row in cursor.fetchall():
+    for row in rows:
         users.append({
             'user_id': row[0],
             'username': row[1],
@@ -208,7 +191,6 @@ def get_all_users(limit: int = 100) -> List[Dict[str, Any]]:
             'last_scan': row[4]
         })
     
-    conn.close()
     return users
 
 # Инициализация БД при импорте
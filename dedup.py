@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+def signal_key(opp: Dict) -> Tuple:
+    """Связка как сигнал: (монета, биржа покупки, биржа продажи, сеть)"""
+    return (opp['symbol'], opp['buy_exchange'].lower(), opp['sell_exchange'].lower(), opp.get('network'))
+
+
+class SignalDedup:
+    """Память отправленных связок: повторно шлется только новая или заметно
+    улучшившаяся связка.
+
+    Запись живет, пока связку видно в сканах: каждый скан продлевает ее на
+    ttl секунд. Пропавшая дольше чем на ttl связка при возвращении считается
+    новой. Внутри связка повторно не шлется получателю, пока profit_pct не
+    вырастет на min_change процентных пунктов от последней отправки ему.
+    Получатели помнятся по отдельности: пользователь, чей порог связка
+    прошла позже остальных, получит ее, даже если рост меньше min_change.
+    Записи лежат в OrderedDict по времени последнего появления: истекшие
+    снимаются с начала, при переполнении max_size вытесняются самые
+    давние - все за O(1).
+    """
+
+    def __init__(self, ttl: float = 600, min_change: float = 1.0, max_size: int = 50000):
+        self.ttl = ttl
+        self.min_change = min_change
+        self.max_size = max_size
+        self.new = 0
+        self.improved = 0
+        self.suppressed = 0
+        # ключ -> (видна в, {получатель: pct при отправке})
+        self._items: 'OrderedDict[Hashable, list]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def recipients(self, opp: Dict, recipients: Iterable[Hashable], now: Optional[float] = None) -> List:
+        """Кому из recipients связку надо отправить сейчас (они запоминаются как
+        получившие). Вызывается с уже подходящими по настройкам получателями:
+        кому связка не ушла, тот не запоминается. Пустой список только
+        продлевает запись видимой связки."""
+        now = now if now is not None else time.monotonic()
+        key = signal_key(opp)
+        pct = opp['profit_pct']
+        result = []
+        with self._lock:
+            self._evict(now)
+            item = self._items.get(key)
+            if item is not None:
+                item[0] = now
+                self._items.move_to_end(key)
+            for recipient in recipients:
+                if item is None:
+                    item = self._items[key] = [now, {}]
+                    while len(self._items) > self.max_size:
+                        self._items.popitem(last=False)
+                sent = item[1].get(recipient)
+                if sent is None:
+                    self.new += 1
+                elif pct >= sent + self.min_change:
+                    self.improved += 1
+                else:
+                    self.suppressed += 1
+                    continue
+                item[1][recipient] = pct
+                result.append(recipient)
+        return result
+
+    def check(self, opp: Dict, now: Optional[float] = None) -> bool:
+        """True - связку надо отправить (и она запоминается как отправленная)"""
+        return bool(self.recipients(opp, (None,), now))
+
+    def filter(self, opportunities: List[Dict], now: Optional[float] = None) -> List[Dict]:
+        """Связки скана, которые надо разослать"""
+        now = now if now is not None else time.monotonic()
+        return [opp for opp in opportunities if self.check(opp, now)]
+
+    def _evict(self, now: float):
+        items = self._items
+        while items:
+            key, item = next(iter(items.items()))
+            if now - item[0] <= self.ttl:
+                break
+            del items[key]
+
+    def forget(self, opp: Dict):
+        """Разрешить повторную отправку (например, если рассылка не удалась)"""
+        with self._lock:
+            self._items.pop(signal_key(opp), None)
+
+    def __len__(self):
+        return len(self._items)
+
+    def report(self) -> str:
+        return (f"dedup: {len(self)} tracked, {self.new} new, {self.improved} improved, "
+                f"{self.suppressed} suppressed")
+
+
+# ========== БЕНЧМАРК ==========
+def benchmark(symbols: int = 2000, ticks: int = 240, interval: float = 15, opp_share: float = 0.05):
+    """Час сканов раз в 15с: сколько сигналов уходит без дедупликации и с ней"""
+    rng = random.Random(7)
+    exchanges = ['kucoin', 'bybit', 'okx', 'gateio', 'htx']
+    # Связка живет несколько минут, профит дрожит вокруг своего уровня
+    live: Dict[Tuple, list] = {}
+    dedup = SignalDedup(max_size=10000)
+    raw = sent = 0
+    elapsed = 0.0
+
+    for tick in range(ticks):
+        now = tick * interval
+        for key in [k for k, (_, until) in live.items() if until <= now]:
+            del live[key]
+        for _ in range(int(symbols * opp_share / 10)):
+            buy, sell = rng.sample(exchanges, 2)
+            key = (f'C{rng.randrange(symbols)}', buy, sell, 'BEP20')
+            live.setdefault(key, [rng.uniform(3, 10), now + rng.uniform(60, 900)])
+
+        opportunities = []
+        for (symbol, buy, sell, network), (pct, _) in live.items():
+            opportunities.append({'symbol': symbol, 'buy_exchange': buy, 'sell_exchange': sell,
+                                  'network': network, 'profit_pct': pct + rng.gauss(0, 0.4)})
+        started = time.perf_counter()
+        fresh = dedup.filter(opportunities, now)
+        elapsed += time.perf_counter() - started
+        raw += len(opportunities)
+        sent += len(fresh)
+
+    print(f"{ticks} scans, {raw} opportunities seen")
+    print(f"without dedup: {raw} signals; with dedup: {sent} ({sent / raw * 100:.1f}%)")
+    print(dedup.report())
+    print(f"dedup cost: {elapsed / raw * 1e6:.2f} us per opportunity")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,275 @@
+import bisect
+import heapq
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from fees import normalize_network
+
+
+def normalize_broker(name: str) -> str:
+    """'Gate.io' -> 'gateio', 'KuCoin' -> 'kucoin': имена из настроек -> имена сканера"""
+    return name.replace('.', '').replace(' ', '').lower()
+
+
+def broker_filter(brokers: Optional[Iterable[str]], known: Optional[Iterable[str]] = None) -> Optional[Set[str]]:
+    """Биржи пользователя именами сканера; None - любые.
+
+    Биржи не из known (не сканируются, например Binance) отбрасываются:
+    если не осталось ни одной, фильтра нет. Одно правило для рассылки
+    (SubscriberIndex) и кнопки скана (ScanService.apply_settings).
+    """
+    names = {normalize_broker(name) for name in brokers or []}
+    if known is not None:
+        names &= {normalize_broker(name) for name in known}
+    return names or None
+
+
+class FilterKey(NamedTuple):
+    brokers: int  # битовая маска бирж (-1 - любые)
+    networks: int  # битовая маска сетей (0 - любые)
+
+
+class ThresholdKey(NamedTuple):
+    min_volume: float
+    min_profit: float
+
+
+class SignalVariant(NamedTuple):
+    """Все, от чего зависит текст сигнала для группы получателей"""
+    volume: float
+    network: Optional[str]
+    withdraw_fee: float
+    withdraw_usd: float
+
+
+class SubscriberIndex:
+    """Индекс подписчиков для рассылки связок.
+
+    Пользователи группируются по битовым маскам бирж и сетей, внутри -
+    по (объем, min_profit), и в каждой группе лежит список, отсортированный
+    по min_profit_pct. Для связки маски проверяются одной операцией, а
+    подходящие пользователи берутся префиксом списка через bisect. Итого
+    O(групп + совпадений) вместо O(пользователей); число групп зависит
+    от числа различных комбинаций настроек, а не от числа пользователей.
+    """
+
+    def __init__(self, exchanges: Optional[Iterable[str]] = None):
+        self.exchanges = list(exchanges) if exchanges is not None else None  # сканируемые биржи
+        self._bits: Dict[str, int] = {}  # биржа или сеть -> бит
+        self._groups: Dict[FilterKey, Dict[ThresholdKey, List[Tuple[float, int]]]] = {}
+        # id -> (фильтры, пороги, pct, подписка до)
+        self._users: Dict[int, Tuple[FilterKey, ThresholdKey, float, float]] = {}
+        self._expiry: List[Tuple[float, int]] = []
+        # Подписки обновляются из потока базы, рассылка читает из event loop
+        self._lock = threading.RLock()
+
+    def _mask(self, names: Iterable[str], prefix: str, normalize: Callable[[str], str]) -> int:
+        mask = 0
+        for name in names:
+            key = prefix + normalize(name)
+            if key not in self._bits:
+                self._bits[key] = 1 << len(self._bits)
+            mask |= self._bits[key]
+        return mask
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._users
+
+    def upsert(self, user_id: int, min_volume: float, min_profit: float, min_profit_pct: float,
+               brokers: Optional[List[str]] = None, networks: Optional[List[str]] = None,
+               until: Optional[float] = None):
+        """Добавляет или обновляет подписчика (пустые brokers/networks - любые)"""
+        with self._lock:
+            self.remove(user_id)
+            filters = FilterKey(self._mask(broker_filter(brokers, self.exchanges) or [], 'b:', normalize_broker) or -1,
+                                self._mask(networks or [], 'n:', normalize_network))
+            thresholds = ThresholdKey(float(min_volume), float(min_profit))
+            group = self._groups.setdefault(filters, {}).setdefault(thresholds, [])
+            bisect.insort(group, (float(min_profit_pct), user_id))
+            self._users[user_id] = (filters, thresholds, float(min_profit_pct), until or 0.0)
+            if until:
+                heapq.heappush(self._expiry, (until, user_id))
+
+    def remove(self, user_id: int):
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is None:
+                return
+            filters, thresholds, pct, _ = entry
+            groups = self._groups[filters]
+            group = groups[thresholds]
+            group.pop(bisect.bisect_left(group, (pct, user_id)))
+            if not group:
+                del groups[thresholds]
+                if not groups:
+                    del self._groups[filters]
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Убирает пользователей с закончившейся подпиской, O(log n) на каждого"""
+        now = now if now is not None else time.time()
+        removed = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                until, user_id = heapq.heappop(self._expiry)
+                entry = self._users.get(user_id)
+                if entry is not None and entry[3] == until:  # подписку могли продлить
+                    self.remove(user_id)
+                    removed += 1
+        return removed
+
+    def match(self, opp: Dict, fees=None) -> List[int]:
+        """Пользователи, которым подходит связка.
+
+        Профит считается под объем каждой группы: volume * gross_pct / 100 -
+        withdraw_usd (поля из find_raw_async / ScanService).
+        """
+        return [user_id for user_ids in self.match_by_signal(opp, fees).values() for user_id in user_ids]
+
+    def _network_names(self, mask: int) -> List[str]:
+        return [key[2:] for key, bit in self._bits.items() if bit & mask and key.startswith('n:')]
+
+    def match_by_signal(self, opp: Dict, fees=None) -> Dict[SignalVariant, List[int]]:
+        """То же, что match, но сгруппировано по тексту сигнала (объем и сеть):
+        на каждый вариант текст достаточно собрать один раз.
+
+        Сети - как в ScanService.apply_settings: если сеть связки не из
+        выбранных группой, маршрут пересчитывается по ним через fees.route
+        (без fees такая группа пропускается), и профит - с его комиссией.
+        """
+        need = (self._bits.get('b:' + normalize_broker(opp['buy_exchange']), 0)
+                | self._bits.get('b:' + normalize_broker(opp['sell_exchange']), 0))
+        if not need or bin(need).count('1') < 2:
+            need = -1  # биржу не выбрал ни один пользователь - совпадений нет
+        network = self._bits.get('n:' + normalize_network(opp['network'])) if opp.get('network') else None
+        gross_pct = opp['gross_pct']
+        direct = (opp.get('network'), opp.get('withdraw_fee', 0.0), opp['withdraw_usd'])
+        routes: Dict[int, Optional[Tuple]] = {}  # маска сетей -> (сеть, комиссия, в USD) или None
+
+        matched: Dict[SignalVariant, List[int]] = {}
+        with self._lock:
+            for filters, groups in self._groups.items():
+                if filters.brokers & need != need:
+                    continue
+                route = direct
+                if filters.networks and opp.get('network') and not (network and filters.networks & network):
+                    if filters.networks not in routes:
+                        routes[filters.networks] = self._reroute(opp, fees, filters.networks)
+                    route = routes[filters.networks]
+                    if route is None:
+                        continue
+                withdraw_usd = route[2]
+                for (volume, min_profit), group in groups.items():
+                    profit_usd = volume * gross_pct / 100 - withdraw_usd
+                    if profit_usd < min_profit:
+                        continue
+                    end = bisect.bisect_right(group, (profit_usd / volume * 100, float('inf')))
+                    if end:
+                        matched.setdefault(SignalVariant(volume, *route), []).extend(
+                            user_id for _, user_id in group[:end])
+        return matched
+
+    def _reroute(self, opp: Dict, fees, networks_mask: int) -> Optional[Tuple]:
+        if fees is None:
+            return None
+        sell = opp['sell_exchange'].lower()
+        route = fees.route(opp['symbol'], opp['buy_exchange'].lower(), sell, self._network_names(networks_mask))
+        if route is None:
+            return None
+        network, withdraw_fee = route
+        return network, withdraw_fee, withdraw_fee * opp['sell_price'] * (1 - fees.taker(sell))
+
+    def load_users(self, users: Iterable[Dict]):
+        """Заполняет индекс из get_user-подобных словарей (только активные подписки)"""
+        for user in users:
+            self.upsert_user(user)
+
+    def upsert_user(self, user: Optional[Dict]):
+        if not user:
+            return
+        if user.get('subscription_days', 0) <= 0:
+            self.remove(user['user_id'])
+            return
+        until = None
+        if user.get('subscription_until'):
+            try:
+                until = datetime.fromisoformat(user['subscription_until']).timestamp()
+            except ValueError:
+                pass
+        self.upsert(user['user_id'], user['min_volume'], user['min_profit'], user['min_profit_pct'],
+                    user.get('brokers'), user.get('networks'), until)
+
+
+# ========== БЕНЧМАРК ==========
+def benchmark(users: int = 100000, opportunities: int = 200):
+    rng = random.Random(42)
+    exchanges = ['KuCoin', 'Bybit', 'OKX', 'Gate.io', 'HTX']
+    networks = ['BEP20', 'TRC20', 'ERC20', 'SOL']
+    settings = []
+    for user_id in range(users):
+        settings.append((
+            user_id,
+            rng.choice([100, 250, 500, 1000]),
+            rng.choice([1, 5, 10, 20]),
+            round(rng.uniform(0.5, 6.0), 1),
+            rng.sample(exchanges, rng.randint(2, 5)),
+            rng.sample(networks, rng.randint(1, 3)),
+        ))
+
+    opps = []
+    for _ in range(opportunities):
+        buy, sell = rng.sample(exchanges, 2)
+        opps.append({
+            'buy_exchange': buy.replace('.', ''),
+            'sell_exchange': sell.replace('.', ''),
+            'network': rng.choice(networks),
+            'gross_pct': rng.uniform(0, 8),
+            'withdraw_usd': rng.uniform(0, 3),
+        })
+
+    started = time.perf_counter()
+    index = SubscriberIndex()
+    for user_id, volume, profit, pct, brokers, nets in settings:
+        index.upsert(user_id, volume, profit, pct, brokers, nets)
+    build = time.perf_counter() - started
+
+    def naive(opp):
+        buy, sell = normalize_broker(opp['buy_exchange']), normalize_broker(opp['sell_exchange'])
+        found = []
+        for user_id, volume, profit, pct, brokers, nets in settings:
+            names = {normalize_broker(b) for b in brokers}
+            if buy not in names or sell not in names or opp['network'] not in nets:
+                continue
+            profit_usd = volume * opp['gross_pct'] / 100 - opp['withdraw_usd']
+            if profit_usd >= profit and profit_usd / volume * 100 >= pct:
+                found.append(user_id)
+        return found
+
+    started = time.perf_counter()
+    expected = [naive(opp) for opp in opps[:20]]
+    naive_time = (time.perf_counter() - started) / 20
+
+    started = time.perf_counter()
+    actual = [index.match(opp) for opp in opps]
+    index_time = (time.perf_counter() - started) / len(opps)
+
+    assert [sorted(m) for m in actual[:20]] == [sorted(m) for m in expected]
+    matches = sum(len(m) for m in actual) / len(opps)
+    print(f"{users} users, {sum(map(len, index._groups.values()))} setting groups, index built in {build:.2f}s")
+    print(f"naive: {naive_time * 1000:.1f}ms per opportunity")
+    print(f"index: {index_time * 1000:.2f}ms per opportunity, {matches:.0f} matches avg "
+          f"(x{naive_time / index_time:.0f})")
+
+    started = time.perf_counter()
+    for user_id in range(0, users, 10):
+        index.upsert(user_id, 100, 5, 3.0, exchanges, networks)
+    print(f"update: {(time.perf_counter() - started) / (users / 10) * 1e6:.1f}us per settings change")
+
+
+if __name__ == '__main__':
+    benchmark()
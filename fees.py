@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from price_table import normalize_base
+
+DEFAULT_TAKER = 0.002  # 0.2% - публичная ставка большинства бирж для спота
+DEFAULT_TTL = 3600
+
+# Разные названия одной сети у бирж
+NETWORK_ALIASES = {
+    'TRX': 'TRC20',
+    'TRON': 'TRC20',
+    'BSC': 'BEP20',
+    'BNB SMART CHAIN': 'BEP20',
+    'ETH': 'ERC20',
+    'ETHEREUM': 'ERC20',
+}
+
+
+def normalize_network(network: str) -> str:
+    network = network.strip().upper()
+    return NETWORK_ALIASES.get(network, network)
+
+
+class Network(NamedTuple):
+    fee: float  # комиссия вывода в монетах
+    deposit: bool
+    withdraw: bool
+
+
+class FeeTable:
+    """Торговые комиссии и сети ввода/вывода монет по биржам.
+
+    Данные берутся из рынков ccxt (exchange.currencies, exchange.fees),
+    хранятся в памяти и на диске с TTL. Все запросы - поиск по dict, O(1).
+    Если по бирже или монете данных нет, маршрут не отбрасывается.
+    """
+
+    def __init__(self, path: str = 'market_cache', ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.takers: Dict[str, float] = {}
+        # (биржа, монета) -> {сеть: Network}
+        self.networks: Dict[Tuple[str, str], Dict[str, Network]] = {}
+        self.updated_at: Dict[str, float] = {}
+        # Биржи грузятся параллельно из потоков _refresh_markets
+        self._lock = threading.Lock()
+
+    # ---------- загрузка ----------
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.fees.json')
+
+    def is_fresh(self, name: str) -> bool:
+        return time.time() - self.updated_at.get(name, 0) < self.ttl
+
+    def load(self, name: str, exchange=None) -> bool:
+        """Комиссии биржи: из памяти, с диска или из exchange, если кэш устарел"""
+        if self.is_fresh(name):
+            return True
+        if self._load_file(name) and self.is_fresh(name):
+            return True
+        if exchange is not None:
+            return self.update_from_exchange(name, exchange)
+        return name in self.updated_at
+
+    def _load_file(self, name: str) -> bool:
+        try:
+            with open(self._file(name), encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"⚠️ {name}: fee cache unreadable ({e})")
+            return False
+
+        self._set(name, data['taker'], {
+            coin: {network: Network(*info) for network, info in networks.items()}
+            for coin, networks in data['networks'].items()
+        }, data['saved_at'])
+        return True
+
+    def update_from_exchange(self, name: str, exchange) -> bool:
+        taker = (getattr(exchange, 'fees', {}) or {}).get('trading', {}).get('taker') or DEFAULT_TAKER
+        if getattr(exchange, 'apiKey', None) and exchange.has.get('fetchTradingFees'):
+            try:
+                fees = exchange.fetch_trading_fees()
+                usdt = [fee['taker'] for sym, fee in fees.items() if sym.endswith('/USDT') and fee.get('taker')]
+                if usdt:
+                    taker = max(usdt)
+            except Exception:
+                print(f"⚠️ {name}: trading fees error, using public rate")
+
+        coins = {}
+        for code, currency in (getattr(exchange, 'currencies', None) or {}).items():
+            networks = {}
+            for network_code, network in (currency.get('networks') or {}).items():
+                fee = network.get('fee')
+                networks[normalize_network(network_code)] = Network(
+                    float(fee) if fee is not None else 0.0,
+                    network.get('deposit') is not False and network.get('active') is not False,
+                    network.get('withdraw') is not False and network.get('active') is not False,
+                )
+            if networks:
+                coins[normalize_base(code)] = networks
+
+        self._set(name, float(taker), coins, time.time())
+        self.save(name)
+        return True
+
+    def _set(self, name: str, taker: float, coins: Dict[str, Dict[str, Network]], saved_at: float):
+        # Новый словарь подменяется целиком: читатели (route, save) никогда
+        # не видят его посреди изменения, писатели идут по одному
+        with self._lock:
+            networks = {key: value for key, value in self.networks.items() if key[0] != name}
+            for coin, info in coins.items():
+                networks[(name, coin)] = info
+            self.networks = networks
+            self.takers[name] = taker
+            self.updated_at[name] = saved_at
+
+    def save(self, name: str):
+        os.makedirs(self.path, exist_ok=True)
+        data = {
+            'taker': self.takers.get(name, DEFAULT_TAKER),
+            'saved_at': self.updated_at.get(name, time.time()),
+            'networks': {
+                coin: {network: list(info) for network, info in networks.items()}
+                for (exch, coin), networks in self.networks.items() if exch == name
+            },
+        }
+        tmp = self._file(name) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, self._file(name))
+
+    # ---------- запросы ----------
+    def taker(self, exchange: str) -> float:
+        return self.takers.get(exchange, DEFAULT_TAKER)
+
+    def can_withdraw(self, exchange: str, coin: str) -> bool:
+        networks = self.networks.get((exchange, coin))
+        return networks is None or any(n.withdraw for n in networks.values())
+
+    def can_deposit(self, exchange: str, coin: str) -> bool:
+        networks = self.networks.get((exchange, coin))
+        return networks is None or any(n.deposit for n in networks.values())
+
+    def withdraw_fee(self, exchange: str, coin: str, network: str) -> Optional[float]:
+        info = self.networks.get((exchange, coin), {}).get(normalize_network(network))
+        return info.fee if info else None
+
+    def route(self, coin: str, buy_exchange: str, sell_exchange: str,
+              networks: Optional[List[str]] = None) -> Optional[Tuple[Optional[str], float]]:
+        """Самая дешевая общая сеть: вывод открыт на покупке, ввод - на продаже.
+
+        Возвращает (сеть, комиссия вывода в монетах), (None, 0) если данных
+        по монете нет, и None если общей открытой сети нет - маршрут невозможен.
+        """
+        out = self.networks.get((buy_exchange, coin))
+        into = self.networks.get((sell_exchange, coin))
+        if out is None and into is None:
+            return None, 0.0
+        allowed = {normalize_network(n) for n in networks} if networks else None
+
+        # Если одна сторона неизвестна - проверяем только известную
+        best = None
+        for name in (out if out is not None else into):
+            if allowed is not None and name not in allowed:
+                continue
+            sending = out.get(name) if out is not None else None
+            receiving = into.get(name) if into is not None else None
+            if out is not None and not sending.withdraw:
+                continue
+            if into is not None and (receiving is None or not receiving.deposit):
+                continue
+            fee = sending.fee if sending else 0.0
+            if best is None or fee < best[1]:
+                best = (name, fee)
+        return best
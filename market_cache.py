@@ -0,0 +1,56 @@
+import os
+import pickle
+import time
+import zlib
+from typing import Dict, NamedTuple, Optional
+
+# Рынки бирж меняются редко: листинги и делистинги раз в несколько часов
+DEFAULT_TTL = 6 * 3600
+
+
+class CachedMarkets(NamedTuple):
+    markets: Dict
+    currencies: Dict
+    saved_at: float
+
+
+class MarketCache:
+    """Кэш exchange.markets на диске: один файл pickle+zlib на биржу.
+
+    Загрузка из файла занимает миллисекунды вместо секунд load_markets().
+    TTL задается на каждую биржу, просроченный кэш все равно отдается -
+    его свежесть проверяет вызывающий код через is_fresh.
+    """
+
+    def __init__(self, path: str = 'market_cache', ttl: float = DEFAULT_TTL,
+                 ttls: Optional[Dict[str, float]] = None):
+        self.path = path
+        self.ttl = ttl
+        self.ttls = ttls or {}
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.markets')
+
+    def load(self, name: str) -> Optional[CachedMarkets]:
+        try:
+            with open(self._file(name), 'rb') as f:
+                return CachedMarkets(*pickle.loads(zlib.decompress(f.read())))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ {name}: market cache unreadable ({e})")
+            return None
+
+    def save(self, name: str, markets: Dict, currencies: Optional[Dict] = None):
+        os.makedirs(self.path, exist_ok=True)
+        data = zlib.compress(pickle.dumps(
+            (markets, currencies or {}, time.time()), protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+        # Пишем во временный файл и подменяем, чтобы не оставить битый кэш
+        tmp = self._file(name) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._file(name))
+
+    def is_fresh(self, name: str, cached: CachedMarkets) -> bool:
+        return time.time() - cached.saved_at < self.ttls.get(name, self.ttl)
@@ -0,0 +1,155 @@
+import heapq
+import itertools
+import random
+import time
+import tracemalloc
+from operator import attrgetter, itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+# По чему выбираются лучшие связки
+SORT_KEYS = ('profit_pct', 'profit_usd')
+
+
+class Opportunity:
+    """Компактная связка вместо словаря на 12 ключей.
+
+    __slots__ без __dict__ - в несколько раз меньше памяти на кандидата.
+    Для чтения ведет себя как словарь (opp['symbol'], opp.get, {**opp}),
+    поэтому ScanService, SubscriberIndex, рендер и dedup принимают ее
+    без изменений; to_dict() - для кода, который правит связку на месте.
+    """
+
+    __slots__ = ('symbol', 'buy_exchange', 'buy_price', 'sell_exchange', 'sell_price',
+                 'profit_usd', 'profit_pct', 'volume', 'network', 'withdraw_fee',
+                 'gross_pct', 'withdraw_usd')
+
+    def __init__(self, symbol: str, buy_exchange: str, buy_price: float, sell_exchange: str,
+                 sell_price: float, profit_usd: float, profit_pct: float, volume: float,
+                 network: Optional[str] = None, withdraw_fee: float = 0.0,
+                 gross_pct: Optional[float] = None, withdraw_usd: float = 0.0):
+        self.symbol = symbol
+        self.buy_exchange = buy_exchange
+        self.buy_price = buy_price
+        self.sell_exchange = sell_exchange
+        self.sell_price = sell_price
+        self.profit_usd = profit_usd
+        self.profit_pct = profit_pct
+        self.volume = volume
+        self.network = network
+        self.withdraw_fee = withdraw_fee
+        self.gross_pct = gross_pct if gross_pct is not None else profit_pct
+        self.withdraw_usd = withdraw_usd
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def __contains__(self, key: str):
+        return key in self.__slots__
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return (f"Opportunity({self.symbol} {self.buy_exchange}->{self.sell_exchange} "
+                f"{self.profit_pct:.2f}% / {self.profit_usd:.2f} USDT)")
+
+
+def sort_key(key: str, records: bool = True) -> Callable:
+    """Функция ключа для top_k: по атрибуту записи или по ключу словаря"""
+    if key not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key {key!r}, expected one of {SORT_KEYS}")
+    return attrgetter(key) if records else itemgetter(key)
+
+
+def top_k(items: Iterable, k: Optional[int] = 3, key: Union[str, Callable] = 'profit_pct') -> List:
+    """k лучших по убыванию key за один проход с кучей размера k.
+
+    O(n log k) и O(k) памяти вместо сортировки всего списка. При равных
+    значениях раньше идет тот, кто раньше пришел - как у sorted(reverse=True).
+    k=None - все элементы, отсортированные.
+    """
+    if isinstance(key, str):
+        key = sort_key(key)
+    if k is None:
+        return sorted(items, key=key, reverse=True)
+    if k <= 0:
+        return []
+
+    heap: List = []
+    counter = itertools.count()
+    for item in items:
+        # -seq: при равенстве из кучи первым уходит пришедший позже
+        entry = (key(item), -next(counter), item)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    heap.sort(reverse=True)
+    return [item for _, _, item in heap]
+
+
+# ========== БЕНЧМАРК ==========
+def _candidates(n: int, seed: int = 5) -> Iterator[tuple]:
+    rng = random.Random(seed)
+    exchanges = ['Kucoin', 'Bybit', 'Okx', 'Gateio', 'Htx']
+    for i in range(n):
+        buy, sell = rng.sample(exchanges, 2)
+        price = rng.uniform(0.01, 1000)
+        gross = rng.gauss(0, 2)
+        withdraw_usd = rng.uniform(0, 1)
+        yield (f'C{i}', buy, price, sell, price * (1 + gross / 100), 100 * gross / 100 - withdraw_usd,
+               gross - withdraw_usd, 100, 'BEP20', withdraw_usd / price, gross, withdraw_usd)
+
+
+def benchmark(candidates: int = 100000, k: int = 3):
+    rows = list(_candidates(candidates))
+    fields = Opportunity.__slots__
+
+    def dicts_sorted(key):
+        found = [dict(zip(fields, row)) for row in rows]
+        return sorted(found, key=lambda x: x[key], reverse=True)[:k]
+
+    def records_heap(key):
+        return top_k((Opportunity(*row) for row in rows), k, key)
+
+    def records_list(_):
+        return [Opportunity(*row) for row in rows]
+
+    def measure(fn, key):
+        # Время и память отдельными прогонами: tracemalloc сильно замедляет
+        started = time.perf_counter()
+        result = fn(key)
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        fn(key)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    print(f"{candidates} candidates, top {k}")
+    for key in SORT_KEYS:
+        expected, dict_time, dict_peak = measure(dicts_sorted, key)
+        actual, heap_time, heap_peak = measure(records_heap, key)
+        assert [opp[key] for opp in actual] == [opp[key] for opp in expected]
+        assert [opp['symbol'] for opp in actual] == [opp['symbol'] for opp in expected]
+        print(f"  by {key}:")
+        print(f"    dicts + sort[:k]: {dict_time * 1000:6.1f}ms, peak {dict_peak / 2**20:6.1f} MiB")
+        print(f"    records + heap:   {heap_time * 1000:6.1f}ms, peak {heap_peak / 2**20:6.1f} MiB")
+
+    # Когда нужен весь набор (общий скан ScanService), выигрыш - в размере записи
+    _, _, dict_peak = measure(lambda _: [dict(zip(fields, row)) for row in rows], None)
+    _, _, record_peak = measure(records_list, None)
+    print(f"  full set kept: dicts {dict_peak / 2**20:.1f} MiB, records {record_peak / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,245 @@
+import bisect
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import PROFIT_FACTOR, TRADE_FEE_PCT
+
+Level = Tuple[float, float]  # (цена, количество монет)
+
+
+class OrderBook:
+    """Топ-N стакана одной пары, обновляемый диффами.
+
+    Уровни хранятся в dict цена -> объем плюс отсортированный список цен
+    (bisect), поэтому дифф стоит O(log N + изменения), а не пересборку стакана.
+    """
+
+    def __init__(self, depth: int = 50):
+        self.depth = depth
+        self.bids: Dict[float, float] = {}
+        self.asks: Dict[float, float] = {}
+        self._bid_keys: List[float] = []  # -цена, чтобы лучший bid был первым
+        self._ask_keys: List[float] = []
+        self.seq: Optional[int] = None
+        self.synced = False
+        self.updated_at = 0.0
+
+    def apply_snapshot(self, bids: Iterable[Sequence], asks: Iterable[Sequence],
+                       seq: Optional[int] = None):
+        self.bids.clear()
+        self.asks.clear()
+        self._bid_keys.clear()
+        self._ask_keys.clear()
+        self.seq = None
+        self.synced = True
+        self.apply_diff(bids, asks, seq)
+
+    def apply_diff(self, bids: Iterable[Sequence], asks: Iterable[Sequence],
+                   seq: Optional[int] = None, prev_seq: Optional[int] = None) -> bool:
+        """Применяет изменения уровней (объем 0 - удалить уровень).
+
+        Устаревший дифф (seq <= текущего) пропускается. Если prev_seq не
+        совпадает с текущим seq, значит пропущен дифф - стакан помечается
+        несинхронизированным и ждет нового снимка.
+        """
+        if seq is not None and self.seq is not None:
+            if seq <= self.seq:
+                return True
+            if prev_seq is not None and prev_seq != self.seq:
+                self.synced = False
+                return False
+
+        # Уровень может содержать лишние поля (OKX, ccxt) - берем цену и объем
+        for level in bids:
+            self._set(self.bids, self._bid_keys, float(level[0]), float(level[1]), -1)
+        for level in asks:
+            self._set(self.asks, self._ask_keys, float(level[0]), float(level[1]), 1)
+        self._trim(self.bids, self._bid_keys, -1)
+        self._trim(self.asks, self._ask_keys, 1)
+
+        if seq is not None:
+            self.seq = seq
+        self.updated_at = time.time()
+        return True
+
+    @staticmethod
+    def _set(levels: Dict[float, float], keys: List[float], price: float, size: float, sign: int):
+        key = sign * price
+        if size <= 0:
+            if levels.pop(price, None) is not None:
+                keys.pop(bisect.bisect_left(keys, key))
+        else:
+            if price not in levels:
+                bisect.insort(keys, key)
+            levels[price] = size
+
+    def _trim(self, levels: Dict[float, float], keys: List[float], sign: int):
+        while len(keys) > self.depth:
+            levels.pop(sign * keys.pop())
+
+    def best_bid(self) -> Optional[float]:
+        return -self._bid_keys[0] if self._bid_keys else None
+
+    def best_ask(self) -> Optional[float]:
+        return self._ask_keys[0] if self._ask_keys else None
+
+    def bid_levels(self) -> List[Level]:
+        return [(-key, self.bids[-key]) for key in self._bid_keys]
+
+    def ask_levels(self) -> List[Level]:
+        return [(key, self.asks[key]) for key in self._ask_keys]
+
+
+def buy_with_quote(asks: List[Level], volume: float) -> Tuple[float, float]:
+    """Покупка на volume USDT по asks: (куплено монет, потрачено USDT)"""
+    coins = spent = 0.0
+    for price, size in asks:
+        cost = price * size
+        if spent + cost >= volume:
+            coins += (volume - spent) / price
+            return coins, volume
+        coins += size
+        spent += cost
+    return coins, spent
+
+
+def sell_coins(bids: List[Level], coins: float) -> Tuple[float, float]:
+    """Продажа coins монет по bids: (продано монет, получено USDT)"""
+    sold = received = 0.0
+    for price, size in bids:
+        if sold + size >= coins:
+            received += (coins - sold) * price
+            return coins, received
+        sold += size
+        received += price * size
+    return sold, received
+
+
+def max_profitable_size(asks: List[Level], bids: List[Level],
+                        min_ratio: float = 1 + TRADE_FEE_PCT / 100) -> Tuple[float, float, float]:
+    """Объем, после которого очередная монета уже не окупает комиссии.
+
+    Идем одновременно по asks (вверх) и bids (вниз), пока bid / ask на текущих
+    уровнях больше min_ratio. Возвращает (монет, потрачено USDT, получено USDT).
+    """
+    coins = spent = received = 0.0
+    ai = bi = 0
+    ask_left = asks[0][1] if asks else 0
+    bid_left = bids[0][1] if bids else 0
+    while ai < len(asks) and bi < len(bids):
+        ask_price, bid_price = asks[ai][0], bids[bi][0]
+        if bid_price <= ask_price * min_ratio:
+            break
+        size = min(ask_left, bid_left)
+        coins += size
+        spent += size * ask_price
+        received += size * bid_price
+        ask_left -= size
+        bid_left -= size
+        if ask_left <= 0:
+            ai += 1
+            ask_left = asks[ai][1] if ai < len(asks) else 0
+        if bid_left <= 0:
+            bi += 1
+            bid_left = bids[bi][1] if bi < len(bids) else 0
+    return coins, spent, received
+
+
+class DepthEvaluator:
+    """Профит связки по глубине стаканов вместо цены последней сделки"""
+
+    def __init__(self, depth: int = 50, max_age: float = 30, fees=None):
+        self.depth = depth
+        self.max_age = max_age
+        self.fees = fees  # FeeTable; без нее - прежняя формула find_arbitrage
+        self.books: Dict[Tuple[str, str], OrderBook] = {}
+
+    def book(self, exchange: str, base: str) -> OrderBook:
+        key = (exchange, base)
+        if key not in self.books:
+            self.books[key] = OrderBook(self.depth)
+        return self.books[key]
+
+    def update(self, exchange: str, base: str, bids, asks, snapshot: bool = False,
+               seq: Optional[int] = None, prev_seq: Optional[int] = None) -> bool:
+        book = self.book(exchange, base)
+        if snapshot:
+            book.apply_snapshot(bids, asks, seq)
+            return True
+        return book.apply_diff(bids, asks, seq, prev_seq)
+
+    def fresh_book(self, exchange: str, base: str) -> Optional[OrderBook]:
+        """Синхронизированный и не устаревший стакан, иначе None"""
+        book = self.books.get((exchange, base))
+        if book is None or not book.synced or time.time() - book.updated_at > self.max_age:
+            return None
+        return book
+
+    def evaluate(self, base: str, buy_exchange: str, sell_exchange: str,
+                 volume: float, network: Optional[str] = None) -> Optional[Dict]:
+        """VWAP покупки/продажи на volume USDT и максимальный прибыльный объем.
+
+        None - если стакана нет или он устарел. Без FeeTable формула профита
+        та же, что у find_arbitrage: при бесконечной глубине результат совпадает.
+        """
+        buy_book = self.fresh_book(buy_exchange, base)
+        sell_book = self.fresh_book(sell_exchange, base)
+        if buy_book is None or sell_book is None:
+            return None
+
+        buy_keep = sell_keep = 1.0
+        withdraw_fee = 0.0
+        if self.fees is not None:
+            buy_keep = 1 - self.fees.taker(buy_exchange)
+            sell_keep = 1 - self.fees.taker(sell_exchange)
+            if network:
+                withdraw_fee = self.fees.withdraw_fee(buy_exchange, base, network) or 0.0
+
+        asks, bids = buy_book.ask_levels(), sell_book.bid_levels()
+        coins, spent = buy_with_quote(asks, volume)
+        if not coins or spent < volume:
+            return None  # глубины не хватает на весь объем
+        to_sell = coins * buy_keep - withdraw_fee
+        if to_sell <= 0:
+            return None
+        sold, received = sell_coins(bids, to_sell)
+        if sold < to_sell:
+            return None
+
+        if self.fees is None:
+            max_coins, max_spent, max_received = max_profitable_size(asks, bids)
+            return {
+                'buy_price': spent / coins,
+                'sell_price': received / sold,
+                'profit_pct': (received - spent) / spent * 100 - TRADE_FEE_PCT,
+                'profit_usd': (received - spent) * PROFIT_FACTOR,
+                'max_volume': max_spent,
+                'max_profit_usd': (max_received - max_spent) * PROFIT_FACTOR,
+            }
+
+        keep = buy_keep * sell_keep
+        max_coins, max_spent, max_received = max_profitable_size(asks, bids, 1 / keep)
+        profit_usd = received * sell_keep - spent
+        return {
+            'buy_price': spent / coins,
+            'sell_price': received / sold,
+            'profit_pct': profit_usd / spent * 100,
+            'profit_usd': profit_usd,
+            'max_volume': max_spent,
+            'max_profit_usd': max_received * keep - max_spent - withdraw_fee * bids[0][0] * sell_keep
+            if max_coins else 0.0,
+        }
+
+    def refine(self, opportunities: List[Dict], min_profit=5, min_pct=3.0) -> List[Dict]:
+        """Пересчитывает связки find_arbitrage по стаканам и заново фильтрует.
+
+        Связки без актуальных стаканов отбрасываются: цене последней сделки
+        для не-топовых монет верить нельзя.
+        """
+        refined = []
+        for opp in opportunities:
+            result = self.evaluate(opp['symbol'], opp['buy_exchange'].lower(),
+                                   opp['sell_exchange'].lower(), opp['volume'], opp.get('network'))
+            if result and result['profit_usd'] >= min_profit and result['profit_pct'] >= min_pct:
+                refined.append({**opp, **result})
+        return sorted(refined, key=lambda x: x['profit_pct'], reverse=True)
@@ -0,0 +1,368 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional, Union
+
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+logger = logging.getLogger(__name__)
+
+ChatId = Union[int, str]
+
+# Приоритеты: меньше - раньше
+HIGH = 0  # ответы на нажатия кнопок, оплаты
+NORMAL = 1  # push-сигналы подписчикам
+LOW = 2  # канал и массовые рассылки
+
+MAX_TEXT = 4096  # лимит Telegram на длину сообщения
+MERGE_SEPARATOR = '\n\n'
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до следующего токена (0 - можно сейчас)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Item:
+    __slots__ = ('priority', 'seq', 'text', 'merge', 'kwargs', 'attempts')
+
+    def __init__(self, priority: int, seq: int, text: str, merge: bool, kwargs: Dict):
+        self.priority = priority
+        self.seq = seq
+        self.text = text
+        self.merge = merge
+        self.kwargs = kwargs
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Chat:
+    __slots__ = ('items', 'bucket', 'not_before', 'scheduled')
+
+    def __init__(self, bucket: TokenBucket):
+        self.items: List[_Item] = []  # куча по (приоритет, порядок)
+        self.bucket = bucket
+        self.not_before = 0.0  # пауза после retry_after
+        self.scheduled = False
+
+
+class Outbox:
+    """Очередь исходящих сообщений с лимитами Telegram.
+
+    Глобальный token bucket (~30 сообщений/с на бота) и bucket на каждый
+    чат (1/с для личных, 20/мин для групп и каналов). Чаты, у которых есть
+    сообщения и свободный токен, выбираются по приоритету; чаты в ожидании
+    токена лежат в отдельной куче по времени готовности, поэтому занятый
+    чат не задерживает остальных. Сообщения с merge=True, накопившиеся в
+    одном чате, уходят одним сообщением. На 429 чат ставится на паузу на
+    retry_after, сообщение возвращается в очередь.
+    """
+
+    def __init__(self, bot, global_rate: float = 25, global_burst: float = 5,
+                 chat_rate: float = 1, group_rate: float = 20 / 60, max_merge: int = 5,
+                 max_retries: int = 3, concurrency: int = 16):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_merge = max_merge
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self.sent = 0  # сообщений в Telegram
+        self.delivered = 0  # исходных сообщений (с учетом склеенных)
+        self.retried = 0
+        self.dropped = 0
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic())
+        self._chats: Dict[ChatId, _Chat] = {}
+        self._ready: List = []  # (приоритет, порядок, chat_id)
+        self._waiting: List = []  # (готов в, порядок, chat_id)
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None  # создаются внутри цикла
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight = 0
+        self._idle: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- постановка в очередь ----------
+    def send(self, chat_id: ChatId, text: str, priority: int = NORMAL, merge: bool = False, **kwargs):
+        """Ставит сообщение в очередь и сразу возвращается"""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self._bucket_for(chat_id))
+        heapq.heappush(chat.items, _Item(priority, next(self._seq), text, merge, kwargs))
+        self._schedule(chat_id, chat)
+        if self._idle is not None:
+            self._idle.clear()
+        if self._wake is not None:
+            self._wake.set()
+
+    def _bucket_for(self, chat_id: ChatId) -> TokenBucket:
+        # Группы и каналы: отрицательный id или @username
+        group = isinstance(chat_id, str) or chat_id < 0
+        return TokenBucket(self.group_rate if group else self.chat_rate, 1, time.monotonic())
+
+    def _schedule(self, chat_id: ChatId, chat: _Chat, now: Optional[float] = None):
+        if chat.scheduled or not chat.items:
+            return
+        chat.scheduled = True
+        now = now if now is not None else time.monotonic()
+        ready_at = max(chat.not_before, now + chat.bucket.delay(now))
+        if ready_at <= now:
+            heapq.heappush(self._ready, (chat.items[0].priority, next(self._seq), chat_id))
+        else:
+            heapq.heappush(self._waiting, (ready_at, next(self._seq), chat_id))
+
+    def __len__(self):
+        return sum(len(chat.items) for chat in self._chats.values())
+
+    # ---------- отправка ----------
+    def start(self):
+        self._wake = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        if not len(self):
+            self._idle.set()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def join(self):
+        """Ждет, пока очередь опустеет"""
+        while len(self) or self._inflight:
+            self._idle.clear()
+            await self._idle.wait()
+
+    async def stop(self, drain: bool = True, timeout: float = 10):
+        if drain and self._task is not None:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Outbox stopped with %d undelivered messages", len(self))
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._waiting)
+                chat = self._chats[chat_id]
+                heapq.heappush(self._ready, (chat.items[0].priority, next(self._seq), chat_id))
+
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = self._global.delay(now)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            chat = self._chats[chat_id]
+            chat.scheduled = False
+            if chat.bucket.delay(now) or chat.not_before > now:
+                self._schedule(chat_id, chat, now)  # retry_after пришел, пока чат ждал в очереди
+                continue
+
+            batch = self._take_batch(chat)
+            self._global.take()
+            chat.bucket.take()
+            self._schedule(chat_id, chat, now)
+
+            await self._slots.acquire()
+            self._inflight += 1
+            asyncio.ensure_future(self._deliver(chat_id, batch))
+
+    def _take_batch(self, chat: _Chat) -> List[_Item]:
+        first = heapq.heappop(chat.items)
+        batch = [first]
+        if not first.merge:
+            return batch
+        length = len(first.text)
+        while (chat.items and chat.items[0].merge and len(batch) < self.max_merge
+               and chat.items[0].kwargs == first.kwargs
+               and length + len(MERGE_SEPARATOR) + len(chat.items[0].text) <= MAX_TEXT):
+            item = heapq.heappop(chat.items)
+            length += len(MERGE_SEPARATOR) + len(item.text)
+            batch.append(item)
+        return batch
+
+    async def _deliver(self, chat_id: ChatId, batch: List[_Item]):
+        text = MERGE_SEPARATOR.join(item.text for item in batch)
+        try:
+            await self.bot.send_message(chat_id, text, **batch[0].kwargs)
+            self.sent += 1
+            self.delivered += len(batch)
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            chat = self._chats[chat_id]
+            chat.not_before = time.monotonic() + e.retry_after
+            self._requeue(chat_id, batch, count_attempt=False)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чат не существует - повтор не поможет
+            self.dropped += len(batch)
+            logger.info("Dropping %d messages to %s: %s", len(batch), chat_id, e)
+        except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+            self.retried += 1
+            logger.warning("Send to %s failed: %s", chat_id, e)
+            self._requeue(chat_id, batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning("Send to %s failed: %s", chat_id, e)
+        finally:
+            self._inflight -= 1
+            self._slots.release()
+            if not self._inflight and not len(self):
+                self._idle.set()
+
+    def _requeue(self, chat_id: ChatId, batch: List[_Item], count_attempt: bool = True):
+        chat = self._chats[chat_id]
+        for item in batch:
+            if count_attempt:
+                item.attempts += 1
+            if item.attempts > self.max_retries:
+                self.dropped += 1
+                continue
+            heapq.heappush(chat.items, item)
+        self._schedule(chat_id, chat)
+        self._wake.set()
+
+    def report(self) -> str:
+        return (f"outbox: {len(self)} queued, {self.delivered} delivered in {self.sent} messages, "
+                f"{self.retried} retries, {self.dropped} dropped")
+
+
+# ========== ЛОКАЛЬНЫЙ BOT API ==========
+class FakeBotAPI:
+    """Локальный Bot API с лимитами Telegram: 30 сообщений/с на бота,
+    1/с в личный чат, 20/мин в группу. Превышение - 429 с retry_after."""
+
+    def __init__(self, latency: float = 0.03, global_limit: int = 30, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.host = host
+        self.port = port
+        self.accepted = 0
+        self.rejected = 0
+        self._recent: List[float] = []
+        self._last: Dict[str, List[float]] = {}
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post('/bot{token}/sendMessage', self._send_message)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _limited(self, chat_id: str, now: float) -> bool:
+        self._recent = [t for t in self._recent if now - t < 1.0]
+        group = chat_id.startswith('-') or chat_id.startswith('@')
+        window, limit = (60.0, 20) if group else (1.0, 1)
+        sent = [t for t in self._last.get(chat_id, []) if now - t < window * 0.95]
+        self._last[chat_id] = sent
+        return len(self._recent) >= self.global_limit or len(sent) >= limit
+
+    async def _send_message(self, request):
+        from aiohttp import web
+        data = await request.post() if request.content_type != 'application/json' else await request.json()
+        chat_id = str(data['chat_id'])
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        if self._limited(chat_id, now):
+            self.rejected += 1
+            return web.json_response({'ok': False, 'error_code': 429,
+                                      'description': 'Too Many Requests: retry after 1',
+                                      'parameters': {'retry_after': 1}}, status=429)
+        self._recent.append(now)
+        self._last[chat_id].append(now)
+        self.accepted += 1
+        chat_type = 'channel' if chat_id.startswith('@') else 'group' if chat_id.startswith('-') else 'private'
+        return web.json_response({'ok': True, 'result': {
+            'message_id': next(self._ids), 'date': int(time.time()), 'text': data.get('text', ''),
+            'chat': {'id': int(chat_id) if chat_id.lstrip('-').isdigit() else 0, 'type': chat_type},
+        }})
+
+
+async def benchmark(chats: int = 150, per_chat: int = 4):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+    messages = [(1000 + c, f"🔥 signal {i} for chat {c}") for i in range(per_chat) for c in range(chats)]
+
+    for label in ('naive', 'outbox'):
+        server = FakeBotAPI()
+        await server.start()
+        session = AiohttpSession(api=TelegramAPIServer.from_base(server.base))
+        bot = Bot('123456:TEST', session=session)
+        started = time.perf_counter()
+
+        if label == 'naive':
+            async def send(chat_id, text):
+                try:
+                    await bot.send_message(chat_id, text)
+                    return 1
+                except TelegramRetryAfter:
+                    return 0
+            delivered = sum(await asyncio.gather(*(send(c, t) for c, t in messages)))
+            sent = len(messages)
+        else:
+            outbox = Outbox(bot)
+            outbox.start()
+            for chat_id, text in messages:
+                outbox.send(chat_id, text, merge=True)
+            await outbox.join()
+            await outbox.stop()
+            delivered, sent = outbox.delivered, outbox.sent
+
+        elapsed = time.perf_counter() - started
+        await session.close()
+        await server.stop()
+        print(f"{label:<7} {len(messages)} signals -> {delivered} delivered in {sent} sends, "
+              f"{server.rejected} x 429, {elapsed:.2f}s ({delivered / elapsed:.0f} signals/s)")
+
+
+if __name__ == '__main__':
+    asyncio.run(benchmark())
@@ -0,0 +1,134 @@
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Разные названия одной монеты на биржах (сверх того, что уже сводит ccxt)
+BASE_ALIASES = {
+    'XBT': 'BTC',
+    'BCC': 'BCH',
+    'BCHABC': 'BCH',
+    'WAXP': 'WAX',
+}
+
+# Плечевые токены - это не та же монета, арбитража между ними нет
+LEVERAGED_SUFFIXES = ('3L', '3S', '5L', '5S', 'UP', 'DOWN', 'BULL', 'BEAR')
+
+
+def normalize_base(base: str) -> str:
+    base = base.strip().upper()
+    return BASE_ALIASES.get(base, base)
+
+
+def base_of(symbol: str) -> str:
+    """'XBT/USDT' -> 'BTC': ключ монеты в PriceTable и индексе листингов"""
+    return normalize_base(symbol.split('/')[0])
+
+
+class PriceTable:
+    """Единая таблица цен в памяти: (биржа, базовая монета) -> котировка.
+
+    Котировка хранится кортежем (bid, ask, last, timestamp), чтобы не
+    создавать объект на каждое обновление.
+    """
+
+    def __init__(self):
+        self._quotes: Dict[Tuple[str, str], Tuple[float, float, float, float]] = {}
+        self._dirty: Optional[Set[str]] = None  # монеты с изменившейся ценой, см. track_changes
+        # (биржа, монета, bid, ask, last, ts) на каждое обновление - например TickRecorder.record
+        self.on_update: Optional[Callable] = None
+
+    def update(self, exchange: str, base: str, last: float,
+               bid: Optional[float] = None, ask: Optional[float] = None,
+               ts: Optional[float] = None):
+        key = (exchange, base)
+        quote = (bid or last, ask or last, last, ts if ts is not None else time.time())
+        if self._dirty is not None:
+            old = self._quotes.get(key)
+            if old is None or old[:3] != quote[:3]:
+                self._dirty.add(base)
+        self._quotes[key] = quote
+        if self.on_update is not None:
+            self.on_update(exchange, base, *quote)
+
+    def track_changes(self):
+        """Включает учет монет, у которых изменилась котировка (для SpreadBook)"""
+        if self._dirty is None:
+            self._dirty = set(base for _, base in self._quotes)
+
+    def take_dirty(self) -> Set[str]:
+        """Монеты с изменениями с прошлого вызова; набор очищается"""
+        if self._dirty is None:
+            return set()
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def update_tickers(self, exchange: str, tickers: Dict[str, Dict],
+                       wanted: Optional[Iterable[str]] = None) -> int:
+        """Кладет в таблицу ответ fetch_tickers (только USDT пары из wanted)"""
+        wanted = set(wanted) if wanted is not None else None
+        count = 0
+        for symbol, ticker in tickers.items():
+            if wanted is not None and symbol not in wanted:
+                continue
+            if not ticker or not symbol.endswith('/USDT'):
+                continue
+            last = ticker.get('last') or ticker.get('close')
+            if not last:
+                continue
+            self.update(exchange, base_of(symbol), float(last),
+                        ticker.get('bid'), ticker.get('ask'))
+            count += 1
+        return count
+
+    def get(self, exchange: str, base: str) -> float:
+        quote = self._quotes.get((exchange, base))
+        return quote[2] if quote else 0
+
+    def quote(self, exchange: str, base: str) -> Optional[Tuple[float, float, float, float]]:
+        return self._quotes.get((exchange, base))
+
+    def pairs(self, max_age: Optional[float] = None, now: Optional[float] = None) -> List[Dict]:
+        """Цены в формате find_arbitrage: {'symbol': base, биржа: last, ...}
+
+        Котировки старше max_age секунд пропускаются (now - для повтора
+        истории со своими часами, по умолчанию текущее время).
+        """
+        oldest = (now if now is not None else time.time()) - max_age if max_age is not None else 0
+        by_symbol = {}
+        for (exchange, base), quote in self._quotes.items():
+            if quote[3] < oldest:
+                continue
+            by_symbol.setdefault(base, {'symbol': base})[exchange] = quote[2]
+        return list(by_symbol.values())
+
+    def matrix(self, exchanges: List[str], max_age: Optional[float] = None, now: Optional[float] = None
+               ) -> Tuple[List[str], np.ndarray]:
+        """Цены last матрицей символы x биржи (NaN - нет цены), порядок как в pairs()"""
+        oldest = (now if now is not None else time.time()) - max_age if max_age is not None else 0
+        index = {name: i for i, name in enumerate(exchanges)}
+        rows_by_symbol = {}
+        rows, cols, values = [], [], []
+        for (exchange, base), quote in self._quotes.items():
+            col = index.get(exchange)
+            if col is None or quote[3] < oldest:
+                continue
+            rows.append(rows_by_symbol.setdefault(base, len(rows_by_symbol)))
+            cols.append(col)
+            values.append(quote[2])
+
+        prices = np.full((len(rows_by_symbol), len(exchanges)), np.nan)
+        prices[rows, cols] = values
+        return list(rows_by_symbol), prices
+
+    def clear(self):
+        if self._dirty is not None:
+            self._dirty.update(base for _, base in self._quotes)
+        self._quotes.clear()
+
+    def __len__(self):
+        return len(self._quotes)
+
+
+def chunks(items: List[str], size: int) -> List[List[str]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from cryptobot import MAX_INVOICES_PER_CALL, CryptoBotAPI, FakeCryptoPay, check_signature
+from price_table import chunks
+
+logger = logging.getLogger(__name__)
+
+# (invoice_id, created_at unix) активных счетов из payments
+ActiveInvoices = Callable[[], Awaitable[List[Tuple[str, float]]]]
+# [(invoice_id, статус)] -> применить одной транзакцией
+ApplyStatuses = Callable[[List[Tuple[str, str]]], Awaitable[None]]
+
+
+class InvoiceReconciler:
+    """Фоновая сверка активных счетов с CryptoPay пачками getInvoices.
+
+    Свежие счета (моложе fast_age) проверяются раз в fast_interval секунд -
+    их как раз сейчас оплачивают; старые - раз в slow_interval. Нажатие
+    "Проверить оплату" не делает отдельный запрос: check() ставит счет
+    в ближайшую пачку и ждет ее результата. Вебхук invoice_paid применяется
+    сразу, без ожидания сверки.
+    """
+
+    def __init__(self, api: CryptoBotAPI, load_active: ActiveInvoices, apply: ApplyStatuses,
+                 fast_interval: float = 5, slow_interval: float = 60, fast_age: float = 600,
+                 batch_size: int = 100, webhook_token: Optional[str] = None):
+        self.api = api
+        self.load_active = load_active
+        self.apply = apply
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.fast_age = fast_age
+        self.batch_size = min(batch_size, MAX_INVOICES_PER_CALL)
+        self.webhook_token = webhook_token
+        self.api_calls = 0
+        self.applied = 0
+        self._checked: Dict[str, float] = {}  # invoice_id -> время последней проверки
+        self._forced: Set[str] = set()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._wake: Optional[asyncio.Event] = None  # создается внутри цикла
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning("Invoice reconcile failed: %s", e)
+            try:
+                # Небольшой разброс, чтобы не совпадать по фазе с другими задачами
+                await asyncio.wait_for(self._wake.wait(), self.fast_interval * random.uniform(0.9, 1.1))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _due(self, invoice_id: str, created_at: float, now: float) -> bool:
+        if invoice_id in self._forced:
+            return True
+        interval = self.fast_interval if now - created_at < self.fast_age else self.slow_interval
+        return now - self._checked.get(invoice_id, 0) >= interval
+
+    async def reconcile(self) -> int:
+        """Одна сверка: возвращает число счетов, запрошенных у API"""
+        now = time.time()
+        active = await self.load_active()
+        active_ids = {invoice_id for invoice_id, _ in active}
+        due = [invoice_id for invoice_id, created_at in active if self._due(invoice_id, created_at, now)]
+
+        # Счета, которые уже не активны (оплачены вебхуком и т.п.), отдаем ожидающим сразу
+        for invoice_id in self._forced - active_ids:
+            self._resolve(invoice_id, None)
+        self._forced.clear()
+        for invoice_id in list(self._checked):
+            if invoice_id not in active_ids:
+                del self._checked[invoice_id]
+
+        updates = []
+        statuses = {}
+        for batch in chunks(due, self.batch_size):
+            try:
+                items = await self.api.get_invoices(batch)
+            finally:
+                self.api_calls += 1
+            for item in items:
+                invoice_id = str(item['invoice_id'])
+                statuses[invoice_id] = item['status']
+                if item['status'] != 'active':
+                    updates.append((invoice_id, item['status']))
+            for invoice_id in batch:
+                self._checked[invoice_id] = now
+
+        if updates:
+            await self.apply(updates)
+            self.applied += len(updates)
+        for invoice_id in due:
+            self._resolve(invoice_id, statuses.get(invoice_id, 'active'))
+        return len(due)
+
+    def _resolve(self, invoice_id: str, status: Optional[str]):
+        for future in self._waiters.pop(invoice_id, []):
+            if not future.done():
+                future.set_result(status)
+
+    async def check(self, invoice_id: str, timeout: float = 5) -> Optional[str]:
+        """Статус счета из ближайшей пачки; None - счет уже не активен в базе
+        или сверка не запущена (статус надо брать из базы).
+
+        Одновременные нажатия на один счет ждут один и тот же запрос.
+        """
+        if self._task is None or self._task.done():
+            return None
+        invoice_id = str(invoice_id)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(invoice_id, []).append(future)
+        self._forced.add(invoice_id)
+        if self._wake is not None:
+            self._wake.set()
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            waiters = self._waiters.get(invoice_id, [])
+            if future in waiters:
+                waiters.remove(future)
+            return 'active'
+
+    # ---------- вебхук ----------
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not self.webhook_token or not check_signature(
+                self.webhook_token, body, request.headers.get('crypto-pay-api-signature')):
+            return web.Response(status=401)
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+
+        if update.get('update_type') == 'invoice_paid':
+            invoice_id = str(update['payload']['invoice_id'])
+            await self.apply([(invoice_id, 'paid')])
+            self.applied += 1
+            self._checked.pop(invoice_id, None)
+            self._resolve(invoice_id, 'paid')
+        return web.Response(text='OK')
+
+    async def start_webhook(self, host: str = '0.0.0.0', port: int = 8080,
+                            path: str = '/cryptobot/webhook') -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post(path, self.handle_webhook)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+# ========== НАГРУЗКА ==========
+async def simulate(invoices: int = 2000, clicks: int = 5000, paid_share: float = 0.3):
+    """Сверка против локального CryptoPay: запросов к API vs проверка на каждый клик"""
+    # Остановка посреди getInvoices - ожидаемый обрыв соединения
+    logging.getLogger('aiohttp.server').setLevel(logging.CRITICAL)
+    server = FakeCryptoPay(latency=0.02)
+    await server.start()
+    api = CryptoBotAPI('local', base_url=server.url)
+
+    now = time.time()
+    payments: Dict[str, Tuple[str, float]] = {}
+    for i in range(invoices):
+        invoice = await api._call('createInvoice', {'asset': 'USDT', 'amount': '15'}, idempotent=False)
+        # Половина счетов свежие, половина - старше fast_age
+        payments[str(invoice['invoice_id'])] = ('active', now - (60 if i % 2 else 3600))
+    server.calls.clear()
+
+    async def load_active():
+        return [(invoice_id, created) for invoice_id, (status, created) in payments.items()
+                if status == 'active']
+
+    async def apply(updates):
+        for invoice_id, status in updates:
+            payments[invoice_id] = (status, payments[invoice_id][1])
+
+    reconciler = InvoiceReconciler(api, load_active, apply, fast_interval=0.2, slow_interval=2,
+                                   webhook_token='local')
+    reconciler.start()
+
+    rng = random.Random(1)
+    ids = list(payments)
+    for invoice_id in rng.sample(ids, int(invoices * paid_share)):
+        server.pay(int(invoice_id))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(reconciler.check(rng.choice(ids)) for _ in range(clicks)))
+    elapsed = time.perf_counter() - started
+
+    # Вебхук: оплата видна без ожидания сверки
+    fresh = await api._call('createInvoice', {'asset': 'USDT', 'amount': '15'}, idempotent=False)
+    payments[str(fresh['invoice_id'])] = ('active', time.time())
+    body, signature = server.sign('local', server.pay(fresh['invoice_id']))
+    webhook = await reconciler.start_webhook('127.0.0.1', 0)
+    host, port = webhook.addresses[0][:2]
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f'http://{host}:{port}/cryptobot/webhook', data=body,
+                                headers={'crypto-pay-api-signature': signature}) as response:
+            assert response.status == 200
+        async with session.post(f'http://{host}:{port}/cryptobot/webhook', data=body,
+                                headers={'crypto-pay-api-signature': 'forged'}) as response:
+            assert response.status == 401
+    await webhook.cleanup()
+
+    await reconciler.stop()
+    await api.close()
+    await server.stop()
+
+    paid = sum(status == 'paid' for status, _ in payments.values())
+    print(f"{invoices} invoices, {clicks} concurrent 'check payment' clicks in {elapsed:.2f}s")
+    print(f"getInvoices calls: {server.calls.get('getInvoices', 0)} (per-click checks would make {clicks})")
+    print(f"paid applied: {paid} (expected {int(invoices * paid_share) + 1}), "
+          f"clicks answered: {sum(r is not None for r in results)}")
+
+
+if __name__ == '__main__':
+    asyncio.run(simulate())
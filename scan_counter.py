@@ -0,0 +1,191 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from storage import Storage
+
+DEFAULT_FLUSH_INTERVAL = 1.0  # секунд
+DEFAULT_FLUSH_EVENTS = 500
+
+
+def sqlite_timestamp(ts: float) -> str:
+    """Тот же формат, что у CURRENT_TIMESTAMP (UTC)"""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class ScanCounter:
+    """Write-behind буфер счетчиков сканов пользователей.
+
+    increment() только меняет словарь в памяти; фоновый поток пишет
+    накопленные приращения total_scans (и last_scan) одной транзакцией
+    раз в flush_interval секунд или после flush_events событий. Чтения
+    прибавляют pending() к значению из базы внутри consistent(), чтобы
+    flush не попал между ними - тогда счетчик не отстает и не двоится.
+    close() дописывает остаток при остановке.
+    """
+
+    def __init__(self, storage: Storage, table: str = 'users',
+                 last_scan_column: Optional[str] = 'last_scan',
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 flush_events: int = DEFAULT_FLUSH_EVENTS,
+                 on_flush: Optional[Callable[[Dict[int, Tuple[int, Optional[str]]]], None]] = None):
+        self.storage = storage
+        # Вызывается после commit с {user_id: (записанное приращение, last_scan)};
+        # last_scan - None, если колонки нет
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.flushes = 0  # транзакций записи
+        self.events = 0
+        if last_scan_column:
+            self._sql = (f'UPDATE {table} SET total_scans = total_scans + ?, '
+                         f'{last_scan_column} = ? WHERE user_id = ?')
+        else:
+            self._sql = f'UPDATE {table} SET total_scans = total_scans + ? WHERE user_id = ?'
+        self._last_scan = bool(last_scan_column)
+        self._pending: Dict[int, List] = {}  # user_id -> [приращение, время последнего скана]
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def increment(self, user_id: int, n: int = 1):
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = [n, time.time()]
+            else:
+                entry[0] += n
+                entry[1] = time.time()
+            self._count += 1
+            self.events += 1
+            full = self._count >= self.flush_events
+        if self._thread is None:
+            self._start()
+        if full:
+            self._wake.set()
+
+    @contextmanager
+    def consistent(self, blocking: bool = True):
+        """Чтение из базы + pending() без flush между ними.
+
+        С blocking=False отдает False, если flush идет прямо сейчас, -
+        для event loop, который не должен ждать запись на диск.
+        """
+        acquired = self._flush_lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._flush_lock.release()
+
+    def pending(self, user_id: int) -> Tuple[int, Optional[str]]:
+        """Незаписанные (приращение, last_scan) пользователя"""
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                return 0, None
+            return entry[0], sqlite_timestamp(entry[1])
+
+    def pending_total(self) -> int:
+        with self._lock:
+            return sum(entry[0] for entry in self._pending.values())
+
+    def merge(self, user_id: int, total_scans: int, last_scan: Optional[str] = None) -> Tuple[int, Optional[str]]:
+        delta, pending_scan = self.pending(user_id)
+        return (total_scans or 0) + delta, pending_scan or last_scan
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._count = 0
+            if not batch:
+                return 0
+            if self._last_scan:
+                rows = [(delta, sqlite_timestamp(ts), user_id) for user_id, (delta, ts) in batch.items()]
+            else:
+                rows = [(delta, user_id) for user_id, (delta, _) in batch.items()]
+            try:
+                self.storage.executemany(self._sql, rows)
+            except Exception:
+                # Возвращаем приращения в буфер, чтобы не потерять их
+                with self._lock:
+                    for user_id, (delta, ts) in batch.items():
+                        entry = self._pending.setdefault(user_id, [0, ts])
+                        entry[0] += delta
+                        entry[1] = max(entry[1], ts)
+                raise
+            self.flushes += 1
+            if self.on_flush is not None:
+                self.on_flush({user_id: (delta, sqlite_timestamp(ts) if self._last_scan else None)
+                               for user_id, (delta, ts) in batch.items()})
+            return len(rows)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._run, name='scan-counter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Scan counter flush failed: {e}")
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+# ========== БЕНЧМАРК ==========
+def benchmark(users: int = 1000, scans: int = 20000, threads: int = 8):
+    def run(increment):
+        started = time.perf_counter()
+        workers = [threading.Thread(target=lambda k=k: [increment((k * 7919 + i) % users)
+                                                        for i in range(scans // threads)])
+                   for k in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, 'counters.db'))
+        storage.execute('''CREATE TABLE users (user_id INTEGER PRIMARY KEY,
+                           total_scans INTEGER DEFAULT 0, last_scan TIMESTAMP)''')
+        storage.executemany('INSERT INTO users (user_id) VALUES (?)', [(i,) for i in range(users)])
+
+        direct = run(lambda uid: storage.execute(
+            '''UPDATE users SET total_scans = total_scans + 1, last_scan = CURRENT_TIMESTAMP
+               WHERE user_id = ?''', (uid,)))
+        print(f"direct UPDATE:  {scans} write transactions, {direct:.2f}s")
+
+        counter = ScanCounter(storage, flush_interval=0.05)
+        buffered = run(counter.increment)
+        counter.close()
+        print(f"write-behind:   {counter.flushes} write transactions, {buffered:.2f}s "
+              f"(x{scans / max(counter.flushes, 1):.0f} fewer)")
+
+        total = storage.fetchone('SELECT SUM(total_scans) FROM users')[0]
+        assert total == 2 * (scans // threads) * threads, total
+        storage.close()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from operator import itemgetter
+from typing import Dict, List, Optional
+
+from fanout import broker_filter, normalize_broker
+from fees import normalize_network
+from opportunity import SORT_KEYS, sort_key, top_k
+
+logger = logging.getLogger(__name__)
+
+
+def with_volume(opp: Dict, volume: float, **fields) -> Dict:
+    """Связка из общего скана, пересчитанная под объем пользователя"""
+    opp = {**opp, **fields}
+    profit_usd = volume * opp['gross_pct'] / 100 - opp['withdraw_usd']
+    opp.update(volume=volume, profit_usd=profit_usd, profit_pct=profit_usd / volume * 100)
+    return opp
+
+
+class ScanService:
+    """Общий скан рынка для всех пользователей.
+
+    Биржи опрашиваются не чаще раза в interval секунд; одновременные
+    запросы ждут уже идущий скан (single-flight). Пороги пользователя
+    (min_volume / min_profit / min_profit_pct / networks) применяются к
+    закэшированному набору связок, поэтому нагрузка на биржи не растет
+    с числом пользователей.
+    """
+
+    def __init__(self, scanner, interval: float = 15.0):
+        self.scanner = scanner
+        self.interval = interval
+        self.scans = 0  # реальных сканов бирж
+        self.requests = 0  # запросов от пользователей
+        self._result: Optional[List[Dict]] = None
+        self._scanned_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+
+    async def opportunities(self) -> List[Dict]:
+        """Сырой набор связок: из кэша, из идущего скана или новый скан"""
+        self.requests += 1
+        if self._result is not None and time.monotonic() - self._scanned_at < self.interval:
+            return self._result
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._scan())
+        # shield: отмена одного ожидающего не должна отменять общий скан
+        return await asyncio.shield(self._inflight)
+
+    async def _scan(self) -> List[Dict]:
+        try:
+            result = await self.scanner.find_raw_async()
+            self._result = result
+            self._scanned_at = time.monotonic()
+            self.scans += 1
+            return result
+        except Exception as e:
+            if self._result is None:
+                raise
+            logger.warning("Scan failed, serving previous result: %s", e)
+            return self._result
+        finally:
+            self._inflight = None
+
+    async def scan_for(self, min_volume=100, min_profit=5, min_profit_pct=3.0,
+                       networks: Optional[List[str]] = None, limit: int = 3,
+                       order_by: str = 'profit_pct', brokers: Optional[List[str]] = None) -> List[Dict]:
+        return self.apply_settings(await self.opportunities(), min_volume, min_profit,
+                                   min_profit_pct, networks, limit, order_by, brokers)
+
+    def apply_settings(self, opportunities: List[Dict], min_volume=100, min_profit=5,
+                       min_profit_pct=3.0, networks: Optional[List[str]] = None,
+                       limit: Optional[int] = 3, order_by: str = 'profit_pct',
+                       brokers: Optional[List[str]] = None) -> List[Dict]:
+        """Пересчет профита под объем и сети пользователя, без запросов к биржам.
+
+        brokers - обе биржи связки должны быть среди них (правило broker_filter,
+        как у SubscriberIndex). Кандидаты идут в кучу top_k кортежами; словари
+        собираются только для limit лучших по order_by (profit_pct / profit_usd).
+        """
+        fees = self.scanner.fees
+        allowed = {normalize_network(n) for n in networks} if networks else None
+        exchanges = broker_filter(brokers, getattr(self.scanner, 'exchanges', None))
+        key = itemgetter(SORT_KEYS.index(order_by))
+
+        def candidates():
+            for opp in opportunities:
+                if exchanges is not None and (normalize_broker(opp['buy_exchange']) not in exchanges
+                                              or normalize_broker(opp['sell_exchange']) not in exchanges):
+                    continue
+                network, withdraw_fee, withdraw_usd = opp['network'], opp['withdraw_fee'], opp['withdraw_usd']
+                if allowed is not None and network is not None and network not in allowed:
+                    sell = opp['sell_exchange'].lower()
+                    route = fees.route(opp['symbol'], opp['buy_exchange'].lower(), sell, networks)
+                    if route is None:
+                        continue
+                    network, withdraw_fee = route
+                    withdraw_usd = withdraw_fee * opp['sell_price'] * (1 - fees.taker(sell))
+
+                profit_usd = min_volume * opp['gross_pct'] / 100 - withdraw_usd
+                profit_pct = profit_usd / min_volume * 100
+                if profit_usd >= min_profit and profit_pct >= min_profit_pct:
+                    # Порядок как в SORT_KEYS: (profit_pct, profit_usd, ...)
+                    yield profit_pct, profit_usd, opp, network, withdraw_fee, withdraw_usd
+
+        depth_aware = self.scanner.depth_aware
+        best = top_k(candidates(), None if depth_aware else limit, key)
+        result = [with_volume(opp, min_volume, network=network, withdraw_fee=withdraw_fee,
+                              withdraw_usd=withdraw_usd)
+                  for _, _, opp, network, withdraw_fee, withdraw_usd in best]
+        if depth_aware:
+            result = top_k(self.scanner.depth.refine(result, min_profit, min_profit_pct), limit,
+                           sort_key(order_by, records=False))
+        return result
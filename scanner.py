@@ -1,38 +1,186 @@
+import asyncio
 import ccxt
+import copy
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict, List
-from config import EXCHANGE_LINKS
+from config import FEE_CACHE_TTL, MARKET_CACHE_DIR, MARKET_CACHE_TTL, TICK_DIR
+from fees import FeeTable
+from market_cache import MarketCache
+from opportunity import Opportunity, sort_key, top_k
+from order_book import DepthEvaluator
+from price_table import LEVERAGED_SUFFIXES, PriceTable, base_of, chunks, normalize_base
+from signal_render import SignalRenderer
+from spread_book import SpreadBook
+from spread_matrix import find_opportunities
+from tick_recorder import TickRecorder
+from triangular import TriangularEngine
+
+BACKUP_SYMBOLS = ['BTC/USDT', 'ETH/USDT', 'SOL/USDT', 'BNB/USDT', 'XRP/USDT']
+
+# Имя биржи -> (класс ccxt, параметры клиента)
+EXCHANGE_CONFIGS = {
+    'kucoin': ('kucoin', {'enableRateLimit': True}),
+    'bybit': ('bybit', {'enableRateLimit': True, 'options': {'defaultType': 'spot'}}),
+    'okx': ('okx', {'enableRateLimit': True}),
+    'gateio': ('gateio', {'enableRateLimit': True}),
+    'htx': ('huobi', {'enableRateLimit': True})
+}
+
+# Тестовые данные, которые подмешиваются к реальному скану
+TEST_PAIRS = [
+    {'symbol': 'SOL', 'kucoin': 150.25, 'bybit': 152.80, 'okx': 151.10},
+    {'symbol': 'BNB', 'htx': 550.40, 'gateio': 558.20},
+]
+
+# Цены в таблице старше этого (сек) не участвуют в поиске связок
+PRICE_MAX_AGE = 60
+
+def usdt_spot_symbols(markets: Dict) -> Dict[str, str]:
+    """Активные спотовые USDT пары биржи: {монета: символ ccxt}"""
+    symbols = {}
+    for sym, market in markets.items():
+        if not market.get('spot') or market.get('quote') != 'USDT':
+            continue
+        # active=None значит биржа не сообщает статус - оставляем
+        if market.get('active') is False:
+            continue
+        base = normalize_base(market.get('base') or sym.split('/')[0])
+        if base.endswith(LEVERAGED_SUFFIXES) and len(base) > 4:
+            continue
+        symbols.setdefault(base, sym)
+    return symbols
+
+def create_exchanges(module=ccxt) -> Dict:
+    """Клиенты всех бирж из sync (ccxt) или async (ccxt.async_support) модуля"""
+    return {
+        name: getattr(module, cls_name)(copy.deepcopy(params))
+        for name, (cls_name, params) in EXCHANGE_CONFIGS.items()
+    }
 
 class ArbitrageScanner:
-    def __init__(self):
-        self.exchanges = {
-            'kucoin': ccxt.kucoin({'enableRateLimit': True}),
-            'bybit': ccxt.bybit({'enableRateLimit': True, 'options': {'defaultType': 'spot'}}),
-            'okx': ccxt.okx({'enableRateLimit': True}),
-            'gateio': ccxt.gateio({'enableRateLimit': True}),
-            'htx': ccxt.huobi({'enableRateLimit': True})
-        }
+    def __init__(self, snapshot=True, depth_aware=False, triangular=False, incremental=False,
+                 record_dir=TICK_DIR):
+        self.exchanges = create_exchanges()
         self.markets = {}
+        # Индекс листингов: монета -> {биржа: символ}, строится в load_markets
+        self.listings = {}
+        self.engine = None  # AsyncScanEngine, создается при первом async скане
+        # snapshot: цены всех символов биржи одним fetch_tickers вместо get_price на каждый
+        self.snapshot = snapshot
+        self.prices = PriceTable()
+        self.batch_size = 20
+        self.stream = None  # StreamingFeed, если цены идут по WebSocket
+        # depth_aware: профит считается по VWAP стаканов на объем пользователя
+        self.depth_aware = depth_aware
+        # Комиссии бирж и сети вывода: берутся из рынков ccxt, кэш на диске
+        self.fees = FeeTable(MARKET_CACHE_DIR, FEE_CACHE_TTL)
+        self.depth = DepthEvaluator(fees=self.fees)
+        self.renderer = SignalRenderer(self.fees)
+        self.market_cache = MarketCache(MARKET_CACHE_DIR, MARKET_CACHE_TTL)
+        # triangular: циклы USDT -> X -> Y -> USDT внутри каждой биржи по всем ее рынкам
+        self.triangular = triangular
+        self.cycles: Dict[str, TriangularEngine] = {}
+        # incremental: общий набор связок пересчитывается только по изменившимся ценам
+        self.book = SpreadBook(self.prices, self.fees, list(self.exchanges),
+                               max_age=PRICE_MAX_AGE) if incremental else None
+        # record_dir: история котировок в колоночных файлах (см. tick_recorder)
+        self.recorder = None
+        if record_dir:
+            self.recorder = TickRecorder(record_dir)
+            self.prices.on_update = self.recorder.record
+            self.recorder.start()
+        self._listed = {}  # биржа -> {монета: символ}
+        self._lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(max_workers=len(self.exchanges))
     
-    def load_markets(self):
+    def load_markets(self, startup_timeout=15):
+        """Рынки из кэша на диске сразу, обновление просроченных - в фоне.
+        
+        Биржи без кэша грузятся параллельно; кто не успел за startup_timeout,
+        догружается в фоне и попадает в индекс позже.
+        """
         print("🔄 Loading markets...")
-        backup_symbols = ['BTC/USDT', 'ETH/USDT', 'SOL/USDT', 'BNB/USDT', 'XRP/USDT']
         
+        to_refresh = []
         for name, exchange in self.exchanges.items():
-            try:
-                exchange.load_markets()
-                symbols = []
-                for sym in exchange.markets:
-                    market = exchange.markets[sym]
-                    if market.get('spot') and market['quote'] == 'USDT':
-                        symbols.append(sym)
-                self.markets[name] = symbols[:50]  # топ 50
-                print(f"✅ {name.capitalize()}: {len(symbols)} pairs")
-            except Exception as e:
-                print(f"⚠️ {name}: error")
-                self.markets[name] = backup_symbols
+            cached = self.market_cache.load(name)
+            if cached:
+                exchange.set_markets(cached.markets, cached.currencies)
+                self.fees.load(name, exchange)
+                self._build_cycles(name)
+                self._listed[name] = usdt_spot_symbols(exchange.markets)
+                print(f"⚡ {name.capitalize()}: {len(self._listed[name])} pairs (cache)")
+                if self.market_cache.is_fresh(name, cached):
+                    continue
+            to_refresh.append(name)
+        
+        futures = {name: self._loader.submit(self._refresh_markets, name) for name in to_refresh}
+        wait([f for name, f in futures.items() if name not in self._listed], timeout=startup_timeout)
+        
+        with self._lock:
+            self.build_index(self._listed)
+        print(f"📊 Ready to scan! {len(self.listings)} cross-listed coins")
+    
+    def _refresh_markets(self, name):
+        exchange = self.exchanges[name]
+        try:
+            exchange.load_markets(True)
+            self.market_cache.save(name, exchange.markets, exchange.currencies)
+            self.fees.update_from_exchange(name, exchange)
+            self.renderer.clear()  # в кэше текстов старые комиссии
+            self._build_cycles(name)
+            symbols = usdt_spot_symbols(exchange.markets)
+            print(f"✅ {name.capitalize()}: {len(symbols)} pairs")
+        except Exception as e:
+            print(f"⚠️ {name}: error")
+            if name in self._listed:
+                return  # остаемся на кэше
+            symbols = {base_of(sym): sym for sym in BACKUP_SYMBOLS}
+        
+        with self._lock:
+            self._listed[name] = symbols
+            self.build_index(self._listed)
+        if self.engine is not None and name in self.engine.exchanges:
+            self.engine.exchanges[name].set_markets(exchange.markets, exchange.currencies)
+    
+    def _build_cycles(self, name):
+        if self.triangular:
+            exchange = self.exchanges[name]
+            self.cycles[name] = TriangularEngine(name, exchange.markets, self.fees.taker(name))
+    
+    def _on_tickers(self, name, tickers):
+        """Полный fetch_tickers биржи обновляет ребра ее графа циклов"""
+        engine = self.cycles.get(name)
+        if engine is not None:
+            engine.update_tickers(tickers)
+    
+    def find_triangular(self, min_volume=100, min_profit=0.5, min_pct=0.3, limit=3,
+                        order_by='profit_pct') -> List[Dict]:
+        """Выгодные циклы всех бирж в формате find_arbitrage (сеть - маршрут цикла).
         
-        print(f"📊 Ready to scan!")
+        Пересчета нет: движки обновляются по мере прихода тикеров, здесь
+        только выборка уже найденных циклов.
+        """
+        found = (opp for engine in self.cycles.values()
+                 for opp in engine.opportunities(min_volume, min_profit)
+                 if opp.profit_pct >= min_pct)
+        return [opp.to_dict() for opp in top_k(found, limit, sort_key(order_by))]
+    
+    def build_index(self, listed: Dict[str, Dict[str, str]]):
+        """Оставляет в markets только монеты, которые торгуются хотя бы на 2 биржах"""
+        listings = {}
+        for name, symbols in listed.items():
+            for base, sym in symbols.items():
+                listings.setdefault(base, {})[name] = sym
+        
+        listings = {base: exch for base, exch in listings.items() if len(exch) >= 2}
+        markets = {name: [] for name in listed}
+        for exch in listings.values():
+            for name, sym in exch.items():
+                markets[name].append(sym)
+        self.listings, self.markets = listings, markets
     
     def get_price(self, exchange, symbol: str) -> float:
         try:
@@ -41,41 +189,140 @@ class ArbitrageScanner:
         except:
             return 0
     
-    def find_arbitrage(self, min_volume=100, min_profit=5, min_pct=3.0) -> List[Dict]:
-        opportunities = []
+    def refresh_prices(self) -> PriceTable:
+        """Снимок цен: один fetch_tickers на биржу, батчи или get_price если не вышло"""
+        for name, symbols in self.markets.items():
+            exchange = self.exchanges[name]
+            supports_bulk = exchange.has.get('fetchTickers')
+            
+            if supports_bulk:
+                try:
+                    tickers = exchange.fetch_tickers()
+                    self.prices.update_tickers(name, tickers, symbols)
+                    self._on_tickers(name, tickers)
+                    continue
+                except Exception:
+                    print(f"⚠️ {name}: fetch_tickers error, using batches")
+            
+            for chunk in chunks(symbols, self.batch_size):
+                if supports_bulk:
+                    try:
+                        self.prices.update_tickers(name, exchange.fetch_tickers(chunk), chunk)
+                        continue
+                    except Exception:
+                        pass
+                for symbol in chunk:
+                    price = self.get_price(exchange, symbol)
+                    if price:
+                        self.prices.update(name, base_of(symbol), price)
         
+        return self.prices
+    
+    def find_arbitrage(self, min_volume=100, min_profit=5, min_pct=3.0, networks=None,
+                       limit=3, order_by='profit_pct') -> List[Dict]:
         # Тестовые данные + реальные
-        test_pairs = [
-            {'symbol': 'SOL', 'kucoin': 150.25, 'bybit': 152.80, 'okx': 151.10},
-            {'symbol': 'BNB', 'htx': 550.40, 'gateio': 558.20},
-        ]
+        opportunities = self._evaluate(TEST_PAIRS + self._scan_real(), min_volume, min_profit,
+                                       min_pct, networks, limit, order_by)
+        if self.depth_aware:
+            for exch, base in self._missing_books(opportunities):
+                try:
+                    book = self.exchanges[exch].fetch_order_book(self._symbol(exch, base), self.depth.depth)
+                    self.depth.update(exch, base, book['bids'], book['asks'], snapshot=True)
+                except Exception:
+                    pass
+            opportunities = top_k(self.depth.refine(opportunities, min_profit, min_pct), limit,
+                                  sort_key(order_by, records=False))
+        return opportunities
+    
+    async def find_arbitrage_async(self, min_volume=100, min_profit=5, min_pct=3.0,
+                                   networks=None, limit=3, order_by='profit_pct') -> List[Dict]:
+        """То же, что find_arbitrage, но цены со всех бирж запрашиваются параллельно"""
+        pairs = await self._scan_real_async()
+        opportunities = self._evaluate(TEST_PAIRS + pairs, min_volume, min_profit, min_pct, networks,
+                                       limit, order_by)
+        if self.depth_aware:
+            missing = self._missing_books(opportunities)
+            books = await asyncio.gather(*(
+                self.get_engine().fetch_order_book(exch, self._symbol(exch, base), self.depth.depth)
+                for exch, base in missing
+            ))
+            for (exch, base), book in zip(missing, books):
+                if book:
+                    self.depth.update(exch, base, book['bids'], book['asks'], snapshot=True)
+            opportunities = top_k(self.depth.refine(opportunities, min_profit, min_pct), limit,
+                                  sort_key(order_by, records=False))
+        return opportunities
+    
+    async def find_raw_async(self, volume=100) -> List[Opportunity]:
+        """Все связки без порогов пользователя - общий набор для ScanService.
         
-        for pair in test_pairs + self._scan_real():
-            prices = {k: v for k, v in pair.items() if isinstance(v, (int, float))}
-            
-            if len(prices) >= 2:
-                sorted_prices = sorted(prices.items(), key=lambda x: x[1])
-                buy_exch, buy_price = sorted_prices[0]
-                sell_exch, sell_price = sorted_prices[-1]
-                
-                profit_pct = ((sell_price - buy_price) / buy_price * 100) - 0.4
-                profit_usd = (min_volume / buy_price) * (sell_price - buy_price) * 0.98
-                
-                if profit_usd >= min_profit and profit_pct >= min_pct:
-                    opportunities.append({
-                        'symbol': pair['symbol'],
-                        'buy_exchange': buy_exch.capitalize(),
-                        'buy_price': buy_price,
-                        'sell_exchange': sell_exch.capitalize(),
-                        'sell_price': sell_price,
-                        'profit_usd': profit_usd,
-                        'profit_pct': profit_pct,
-                        'volume': min_volume
-                    })
+        Набор держится в памяти между сканами, поэтому это компактные записи
+        Opportunity, а не словари.
+        """
+        if self.stream is None and not self.snapshot:
+            pairs = await self._scan_real_async()
+            return find_opportunities(pairs, volume, float('-inf'), float('-inf'),
+                                      limit=None, fees=self.fees, records=True)
+        if self.stream is None:
+            await self.get_engine().snapshot(self.markets, self.prices)
+        return self.raw_opportunities(volume)
+    
+    def raw_opportunities(self, volume=100, now=None) -> List[Opportunity]:
+        """Общий набор связок по текущей таблице цен, без запросов к биржам.
         
-        return sorted(opportunities, key=lambda x: x['profit_pct'], reverse=True)[:3]
+        Только реальные котировки: набор уходит в push-рассылку, TEST_PAIRS
+        сюда не попадают (см. demo_opportunities).
+        now - время для отсечения устаревших цен (часы повтора истории).
+        """
+        if self.book is not None and volume == self.book.volume:
+            self.book.refresh(now)
+            return self.book.all()
+        pairs = self.prices.pairs(max_age=PRICE_MAX_AGE, now=now)
+        return find_opportunities(pairs, volume, float('-inf'), float('-inf'),
+                                  limit=None, fees=self.fees, records=True)
+    
+    def demo_opportunities(self, volume=100) -> List[Opportunity]:
+        """Связки из TEST_PAIRS в формате общего набора - для отладки кнопки скана"""
+        return find_opportunities(TEST_PAIRS, volume, float('-inf'), float('-inf'),
+                                  limit=None, fees=self.fees, records=True)
+    
+    def _evaluate(self, pairs: List[Dict], min_volume, min_profit, min_pct, networks=None,
+                  limit=3, order_by='profit_pct') -> List[Dict]:
+        # Все пары считаются одной матрицей numpy (см. spread_matrix);
+        # для проверки по стаканам нужны все кандидаты, а не только топ-K
+        return find_opportunities(pairs, min_volume, min_profit, min_pct,
+                                  limit=None if self.depth_aware else limit,
+                                  fees=self.fees, networks=networks, order_by=order_by)
+    
+    def _symbol(self, exch: str, base: str) -> str:
+        return self.listings.get(base, {}).get(exch, f'{base}/USDT')
+    
+    def _missing_books(self, opportunities: List[Dict]) -> List[tuple]:
+        """(биржа, монета) без актуального стакана - их берем снимком через REST"""
+        missing = []
+        for opp in opportunities:
+            for exch in (opp['buy_exchange'].lower(), opp['sell_exchange'].lower()):
+                key = (exch, opp['symbol'])
+                if key not in missing and self.depth.fresh_book(*key) is None:
+                    missing.append(key)
+        return missing
+    
+    def attach_stream(self, feed):
+        """Брать цены из живого стакана StreamingFeed вместо REST запросов"""
+        feed.table = self.prices
+        if feed.depth is not None:
+            feed.depth.fees = self.fees
+            self.depth = feed.depth
+        self.stream = feed
     
     def _scan_real(self):
+        if self.stream is not None:
+            return self.prices.pairs(max_age=PRICE_MAX_AGE)
+        
+        if self.snapshot:
+            self.refresh_prices()
+            return self.prices.pairs(max_age=PRICE_MAX_AGE)
+        
         # Реальный скан (упрощенный для стабильности)
         pairs = []
         for name, symbols in list(self.markets.items())[:2]:  # 2 биржи
@@ -86,32 +333,31 @@ class ArbitrageScanner:
                     pairs.append({'symbol': symbol.replace('/USDT', ''), name: price + random.uniform(-1, 2)})
         return pairs
     
-    def format_signal(self, opp: Dict, network='BEP20') -> str:
-        symbol = opp['symbol']
-        buy_link = EXCHANGE_LINKS[opp['buy_exchange']].format(symbol)
-        sell_link = EXCHANGE_LINKS[opp['sell_exchange']].format(symbol.lower())
+    def get_engine(self):
+        if self.engine is None:
+            from async_scanner import AsyncScanEngine
+            self.engine = AsyncScanEngine(source=self.exchanges, batch_size=self.batch_size)
+            self.engine.on_tickers = self._on_tickers
+        return self.engine
+    
+    async def _scan_real_async(self) -> List[Dict]:
+        if self.stream is not None:
+            return self.prices.pairs(max_age=PRICE_MAX_AGE)
         
-        coins = opp['volume'] / opp['buy_price']
-        coins_after_fee = coins * 0.996
-        fee_coins = coins - coins_after_fee
-        fee_usd = fee_coins * opp['buy_price']
-        sell_value = coins_after_fee * opp['sell_price'] * 0.998
+        if self.snapshot:
+            await self.get_engine().snapshot(self.markets, self.prices)
+            return self.prices.pairs(max_age=PRICE_MAX_AGE)
         
-        return f"""👁‍🗨{opp['buy_exchange']} ({buy_link}) -> {opp['sell_exchange']} ({sell_link}) ({symbol}/USDT)
-
-↘️{opp['buy_exchange']} BUY ({buy_link}) 👉🏻 #{symbol}
-💰Цена: {opp['buy_price']:.6f} USDT
-💎Монет: {coins:,.0f} {symbol} = {opp['volume']:.1f} USDT
-
-💳Комиссия вывода
-💎{fee_coins:,.0f} {symbol} = {fee_usd:.2f} USDT
-
-➡️{opp['sell_exchange']} SELL ({sell_link}) 👉🏻 #{symbol}
-💰Цена: {opp['sell_price']:.6f} USDT
-💎Монет: {coins_after_fee:,.0f} {symbol} = {sell_value:.1f} USDT
-
-💰Профит: {opp['profit_usd']:.1f} USDT
-🚩Доход: {opp['profit_pct']:.1f}%
-
-Вывод: 🔀 {network}
-Ввод: 🔀 {network}"""
+        prices = await self.get_engine().scan(self.markets)
+        
+        # Склеиваем цены одной монеты с разных бирж в одну пару
+        by_symbol = {}
+        for name, symbol_prices in prices.items():
+            for symbol, price in symbol_prices.items():
+                base = base_of(symbol)
+                by_symbol.setdefault(base, {'symbol': base})[name] = price
+        return list(by_symbol.values())
+    
+    def format_signal(self, opp: Dict, network=None) -> str:
+        # Текст на (связка, объем, сеть) собирается один раз - см. signal_render
+        return self.renderer.render(opp, network)
@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from config import EXCHANGE_LINKS, EXCHANGE_NAMES
+
+DEFAULT_NETWORK = 'BEP20'
+
+
+def _link_template(name: str, display: str) -> Callable[[str], str]:
+    """Связанный str.format шаблона ссылки на пару биржи"""
+    return EXCHANGE_LINKS[EXCHANGE_NAMES.get(name, display)].format
+
+
+def opportunity_id(opp: Dict) -> Tuple:
+    """Связка конкретного скана: маршрут + цены (новые цены - новый id)"""
+    return (opp['symbol'], opp['buy_exchange'], opp['sell_exchange'],
+            opp['buy_price'], opp['sell_price'], opp.get('withdraw_fee'))
+
+
+class _Parts:
+    """Все, что не зависит от объема: ссылки, заголовок, комиссии"""
+
+    __slots__ = ('head', 'buy_line', 'sell_line', 'footer', 'fee_coins', 'buy_keep', 'sell_keep')
+
+    def __init__(self, opp: Dict, network: str, links: Callable, fees):
+        symbol = opp['symbol']
+        buy_name, sell_name = opp['buy_exchange'].lower(), opp['sell_exchange'].lower()
+        buy_url = links(buy_name, opp['buy_exchange'])(symbol)
+        sell_url = links(sell_name, opp['sell_exchange'])(symbol.lower())
+
+        fee_coins = fees.withdraw_fee(buy_name, symbol, network)
+        if fee_coins is None:
+            fee_coins = opp.get('withdraw_fee', 0.0)
+        self.fee_coins = fee_coins
+        self.buy_keep = 1 - fees.taker(buy_name)
+        self.sell_keep = 1 - fees.taker(sell_name)
+
+        self.head = f"👁‍🗨{opp['buy_exchange']} ({buy_url}) -> {opp['sell_exchange']} ({sell_url}) ({symbol}/USDT)"
+        self.buy_line = (f"↘️{opp['buy_exchange']} BUY ({buy_url}) 👉🏻 #{symbol}\n"
+                         f"💰Цена: {opp['buy_price']:.6f} USDT")
+        self.sell_line = (f"➡️{opp['sell_exchange']} SELL ({sell_url}) 👉🏻 #{symbol}\n"
+                          f"💰Цена: {opp['sell_price']:.6f} USDT")
+        self.footer = f"Вывод: 🔀 {network}\nВвод: 🔀 {network}"
+
+
+class SignalRenderer:
+    """Текст сигнала для рассылки, собранный один раз на (связка, объем, сеть).
+
+    При рассылке тысячам подписчиков тексты различаются только объемом и
+    сетью, поэтому готовый текст берется из LRU-кэша. Части, не зависящие
+    от объема (ссылки, цены, комиссии), считаются один раз на связку;
+    шаблоны ссылок бирж связываются заранее. Ключ включает цены, так что
+    следующий скан с новыми ценами дает новые записи, а старые вытесняются.
+    """
+
+    def __init__(self, fees, max_size: int = 4096, max_parts: int = 1024):
+        self.fees = fees
+        self.max_size = max_size
+        self.max_parts = max_parts
+        self.hits = 0
+        self.misses = 0
+        self._texts: 'OrderedDict[Hashable, str]' = OrderedDict()
+        self._parts: 'OrderedDict[Hashable, _Parts]' = OrderedDict()
+        self._links: Dict[str, Callable[[str], str]] = {}
+        self._lock = threading.Lock()
+
+    def _link(self, name: str, display: str) -> Callable[[str], str]:
+        link = self._links.get(name)
+        if link is None:
+            link = self._links[name] = _link_template(name, display)
+        return link
+
+    def render(self, opp: Dict, network: Optional[str] = None) -> str:
+        network = network or opp.get('network') or DEFAULT_NETWORK
+        opp_id = opportunity_id(opp)
+        key = (opp_id, opp['volume'], network, opp['profit_usd'], opp['profit_pct'])
+        with self._lock:
+            text = self._texts.get(key)
+            if text is not None:
+                self._texts.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+            parts = self._get_parts(opp_id, opp, network)
+            text = self._texts[key] = self._render(opp, parts)
+            if len(self._texts) > self.max_size:
+                self._texts.popitem(last=False)
+        return text
+
+    def _get_parts(self, opp_id: Tuple, opp: Dict, network: str) -> _Parts:
+        key = (opp_id, network)
+        parts = self._parts.get(key)
+        if parts is None:
+            parts = self._parts[key] = _Parts(opp, network, self._link, self.fees)
+            if len(self._parts) > self.max_parts:
+                self._parts.popitem(last=False)
+        else:
+            self._parts.move_to_end(key)
+        return parts
+
+    @staticmethod
+    def _render(opp: Dict, parts: _Parts) -> str:
+        symbol = opp['symbol']
+        coins = opp['volume'] / opp['buy_price']
+        fee_coins = parts.fee_coins
+        coins_after_fee = coins * parts.buy_keep - fee_coins
+        fee_usd = fee_coins * opp['buy_price']
+        sell_value = coins_after_fee * opp['sell_price'] * parts.sell_keep
+
+        return f"""{parts.head}
+
+{parts.buy_line}
+💎Монет: {coins:,.0f} {symbol} = {opp['volume']:.1f} USDT
+
+💳Комиссия вывода
+💎{fee_coins:,.0f} {symbol} = {fee_usd:.2f} USDT
+
+{parts.sell_line}
+💎Монет: {coins_after_fee:,.0f} {symbol} = {sell_value:.1f} USDT
+
+💰Профит: {opp['profit_usd']:.1f} USDT
+🚩Доход: {opp['profit_pct']:.1f}%
+
+{parts.footer}"""
+
+    def render_uncached(self, opp: Dict, network: Optional[str] = None) -> str:
+        network = network or opp.get('network') or DEFAULT_NETWORK
+        return self._render(opp, _Parts(opp, network, _link_template, self.fees))
+
+    def clear(self):
+        """Сброс после обновления комиссий"""
+        with self._lock:
+            self._texts.clear()
+            self._parts.clear()
+
+    def __len__(self):
+        return len(self._texts)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = f"{self.hits / total * 100:.1f}%" if total else "n/a"
+        return f"render cache: {len(self)}/{self.max_size} texts, hit rate {rate}"
+
+
+# ========== БЕНЧМАРК ==========
+def benchmark(opportunities: int = 50, recipients: int = 10000, volumes=(100, 250, 500, 1000, 5000)):
+    """Рассылка одного скана: текст на каждого получателя vs кэш"""
+    import tempfile
+
+    from fees import FeeTable
+    from scan_service import with_volume
+
+    rng = random.Random(3)
+    fees = FeeTable(tempfile.mkdtemp())
+    names = list(EXCHANGE_NAMES)
+    opps = []
+    for i in range(opportunities):
+        buy, sell = rng.sample(names, 2)
+        price = rng.uniform(0.01, 500)
+        opps.append({'symbol': f'C{i}', 'buy_exchange': EXCHANGE_NAMES[buy], 'sell_exchange': EXCHANGE_NAMES[sell],
+                     'buy_price': price, 'sell_price': price * rng.uniform(1.02, 1.1),
+                     'gross_pct': rng.uniform(2, 10), 'withdraw_usd': rng.uniform(0, 2),
+                     'withdraw_fee': rng.uniform(0, 5), 'network': rng.choice(['BEP20', 'TRC20'])})
+    # Получатели делятся на группы с одинаковым объемом (как match_by_signal)
+    user_volumes = [rng.choice(volumes) for _ in range(recipients)]
+
+    renderer = SignalRenderer(fees)
+    for label, render in (('per recipient', renderer.render_uncached), ('cached', renderer.render)):
+        started = time.perf_counter()
+        for opp in opps:
+            sized = {volume: with_volume(opp, volume) for volume in volumes}
+            for volume in user_volumes:
+                render(sized[volume])
+        elapsed = time.perf_counter() - started
+        print(f"{label:<14} {opportunities * recipients} messages in {elapsed:.2f}s "
+              f"({elapsed / (opportunities * recipients) * 1e6:.2f} us each)")
+
+    for opp in opps:
+        for volume in volumes:
+            sized = with_volume(opp, volume)
+            assert renderer.render(sized) == renderer.render_uncached(sized)
+    print(renderer.report())
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,209 @@
+import bisect
+import heapq
+import math
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from opportunity import SORT_KEYS, Opportunity
+from price_table import PriceTable
+from spread_matrix import viable_pair
+
+
+class SpreadBook:
+    """Инкрементальный расчет кросс-биржевых связок по PriceTable.
+
+    Таблица отмечает монеты, у которых изменилась котировка (track_changes),
+    и refresh() пересчитывает лучшую покупку/продажу и профит только для
+    них - стоимость тика пропорциональна числу обновлений, а не размеру
+    рынка. Текущие связки лежат в списке, отсортированном по убыванию
+    profit_pct (при одном объеме тот же порядок и по profit_usd), и
+    top() отдает лучшие без пересчета в любой момент.
+
+    Формулы те же, что в spread_matrix._net_opportunities: комиссии taker
+    каждой биржи, открытые вывод/ввод, самая дешевая общая сеть.
+    """
+
+    def __init__(self, table: PriceTable, fees, exchanges: List[str], volume: float = 100,
+                 networks: Optional[List[str]] = None, max_age: Optional[float] = None):
+        self.table = table
+        self.fees = fees
+        self.exchanges = list(exchanges)
+        self.volume = volume
+        self.networks = networks
+        self.max_age = max_age
+        self.recomputed = 0
+        self._names = [name.capitalize() for name in self.exchanges]
+        self._by_symbol: Dict[str, Opportunity] = {}
+        self._order: List[Tuple[float, str]] = []  # (-profit_pct, монета)
+        self._expiry: List[Tuple[float, str]] = []  # (котировка устареет в, монета)
+        table.track_changes()
+
+    def refresh(self, now: Optional[float] = None) -> int:
+        """Пересчитывает связки измененных монет; возвращает их число"""
+        dirty = self.table.take_dirty()
+        if self.max_age is not None:
+            # Устаревшая котировка - тоже изменение: биржа выпадает из связки
+            now = now if now is not None else time.time()
+            while self._expiry and self._expiry[0][0] <= now:
+                dirty.add(heapq.heappop(self._expiry)[1])
+        for base in dirty:
+            self._recompute(base, now)
+        self.recomputed += len(dirty)
+        return len(dirty)
+
+    def _recompute(self, base: str, now: Optional[float]):
+        fees, exchanges = self.fees, self.exchanges
+        oldest = now - self.max_age if self.max_age is not None else None
+        buy = sell = -1
+        buy_price = sell_price = 0.0
+        buy_cost, sell_gain = float('inf'), float('-inf')
+        expires = None
+        prices: List[Optional[float]] = [None] * len(exchanges)
+        keeps, buy_ok, sell_ok = [1.0] * len(exchanges), [False] * len(exchanges), [False] * len(exchanges)
+        for j, name in enumerate(exchanges):
+            quote = self.table.quote(name, base)
+            if quote is None:
+                continue
+            if oldest is not None:
+                if quote[3] < oldest:
+                    continue
+                expires = quote[3] if expires is None else min(expires, quote[3])
+            price, keep = quote[2], 1 - fees.taker(name)
+            prices[j], keeps[j] = price, keep
+            buy_ok[j], sell_ok[j] = fees.can_withdraw(name, base), fees.can_deposit(name, base)
+            # Как argmin / argmax по матрице: покупка - первая биржа с минимумом,
+            # продажа - последняя с максимумом
+            if buy_ok[j] and price / keep < buy_cost:
+                buy, buy_cost, buy_price = j, price / keep, price
+            if sell_ok[j] and price * keep >= sell_gain:
+                sell, sell_gain, sell_price = j, price * keep, price
+
+        opp = None
+        if buy >= 0 and sell >= 0:
+            route = fees.route(base, exchanges[buy], exchanges[sell], self.networks) if buy != sell else None
+            if route is None:
+                # Как в _net_opportunities: следующая по цене пара с общей сетью
+                pair = viable_pair(fees, base, exchanges, prices, keeps, buy_ok, sell_ok, self.networks)
+                if pair is not None:
+                    buy, sell, buy_cost, sell_gain, route = pair
+                    buy_price, sell_price = prices[buy], prices[sell]
+            if route is not None:
+                network, withdraw_fee = route
+                volume = self.volume
+                gross_usd = volume / buy_cost * sell_gain - volume
+                withdraw_usd = withdraw_fee * sell_gain
+                profit_usd = gross_usd - withdraw_usd
+                opp = Opportunity(base, self._names[buy], buy_price,
+                                  self._names[sell], sell_price, profit_usd, profit_usd / volume * 100,
+                                  volume, network, withdraw_fee, gross_usd / volume * 100, withdraw_usd)
+        if expires is not None:
+            heapq.heappush(self._expiry, (expires + self.max_age, base))
+        self._store(base, opp)
+
+    def _store(self, base: str, opp: Optional[Opportunity]):
+        old = self._by_symbol.get(base)
+        if old is not None:
+            order = self._order
+            del order[bisect.bisect_left(order, (-old.profit_pct, base))]
+        if opp is None:
+            self._by_symbol.pop(base, None)
+            return
+        self._by_symbol[base] = opp
+        bisect.insort(self._order, (-opp.profit_pct, base))
+
+    # ---------- запросы ----------
+    def __len__(self):
+        return len(self._by_symbol)
+
+    def get(self, base: str) -> Optional[Opportunity]:
+        return self._by_symbol.get(base)
+
+    def top(self, limit: Optional[int] = 3, min_profit: float = float('-inf'),
+            min_pct: float = float('-inf'), order_by: str = 'profit_pct') -> List[Opportunity]:
+        """Лучшие связки из поддерживаемого порядка, O(limit)"""
+        if order_by not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key {order_by!r}, expected one of {SORT_KEYS}")
+        result = []
+        for neg_pct, base in self._order:
+            if -neg_pct < min_pct:
+                break
+            opp = self._by_symbol[base]
+            if opp.profit_usd >= min_profit:
+                result.append(opp)
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+    def all(self) -> List[Opportunity]:
+        """Все связки по убыванию profit_pct - замена find_raw_async без пересчета"""
+        return [self._by_symbol[base] for _, base in self._order]
+
+
+# ========== БЕНЧМАРК ==========
+def _same(a: Opportunity, b: Opportunity) -> bool:
+    """Одна и та же связка: текстовые поля точно, числа - с точностью до
+    округления (матрица и поштучный расчет складывают в разном порядке)"""
+    da, db = a.to_dict(), b.to_dict()
+    return all(math.isclose(value, db[key], rel_tol=1e-9, abs_tol=1e-12)
+               if isinstance(value, float) else value == db[key] for key, value in da.items())
+
+
+def benchmark(symbols: int = 5000, exchanges: int = 5, ticks: int = 100):
+    """Повтор потока котировок: пересчет всего рынка vs только изменившихся монет"""
+    import tempfile
+
+    from fees import FeeTable, Network
+    from spread_matrix import find_opportunities
+
+    rng = random.Random(9)
+    names = [f'ex{j}' for j in range(exchanges)]
+    fees = FeeTable(tempfile.mkdtemp())
+    fair = {f'C{i}': 10 ** rng.uniform(-3, 3) for i in range(symbols)}
+    listed = {base: [name for name in names if rng.random() < 0.6] for base in fair}
+    quotes = [(name, base) for base, where in listed.items() for name in where]
+    # У части монет сети известны и бывают закрыты: лучшая по цене пара
+    # не всегда проходима, и считается следующая
+    for name, base in quotes:
+        if rng.random() < 0.3:
+            fees.networks[(name, base)] = {
+                network: Network(rng.uniform(0, 1), rng.random() < 0.7, rng.random() < 0.7)
+                for network in rng.sample(['BEP20', 'TRC20', 'ERC20'], rng.randint(1, 2))}
+
+    def price(base):
+        return fair[base] * rng.uniform(0.97, 1.03)
+
+    table = PriceTable()
+    for name, base in quotes:
+        table.update(name, base, price(base))
+    book = SpreadBook(table, fees, names)
+    book.refresh()
+
+    print(f"{symbols} symbols x {exchanges} exchanges, {len(quotes)} quotes, {len(book)} opportunities")
+    for updates in (10, 100, 1000):
+        incremental = full = 0.0
+        for tick in range(ticks):
+            for name, base in rng.sample(quotes, min(updates, len(quotes))):
+                table.update(name, base, price(base))
+
+            started = time.perf_counter()
+            book.refresh()
+            best = book.top(3)
+            incremental += time.perf_counter() - started
+
+            started = time.perf_counter()
+            expected = find_opportunities(table.pairs(), 100, float('-inf'), float('-inf'),
+                                          limit=None, fees=fees, records=True)
+            full += time.perf_counter() - started
+
+            if tick % 10 == 0:
+                assert len(best) == len(expected[:3]) and all(map(_same, best, expected))
+                by_symbol = {o.symbol: o for o in expected}
+                assert len(book) == len(by_symbol) and all(
+                    o.symbol in by_symbol and _same(o, by_symbol[o.symbol]) for o in book.all())
+        print(f"  {updates:>4} updates/tick: incremental {incremental / ticks * 1000:7.2f}ms, "
+              f"full recompute {full / ticks * 1000:7.2f}ms (x{full / incremental:.0f})")
+
+
+if __name__ == '__main__':
+    benchmark()
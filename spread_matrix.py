@@ -0,0 +1,304 @@
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from config import PROFIT_FACTOR, TRADE_FEE_PCT
+from opportunity import SORT_KEYS, Opportunity, sort_key, top_k
+
+
+class Spreads(NamedTuple):
+    """Результат пакетного расчета: по одному значению на символ"""
+    buy_idx: np.ndarray
+    sell_idx: np.ndarray
+    buy_price: np.ndarray
+    sell_price: np.ndarray
+    profit_pct: np.ndarray
+    profit_usd: np.ndarray
+    mask: np.ndarray  # прошел фильтры min_profit / min_pct
+
+
+def build_matrix(pairs: List[Dict], exchanges: Optional[List[str]] = None
+                 ) -> Tuple[List[str], List[str], np.ndarray]:
+    """Пары find_arbitrage -> (символы, биржи, матрица цен символы x биржи, NaN = нет листинга)"""
+    if exchanges is None:
+        exchanges = []
+        for pair in pairs:
+            for key, value in pair.items():
+                if isinstance(value, (int, float)) and key not in exchanges:
+                    exchanges.append(key)
+    index = {name: i for i, name in enumerate(exchanges)}
+
+    # Индексы собираем списками и пишем в матрицу одной операцией
+    rows, cols, values = [], [], []
+    for row, pair in enumerate(pairs):
+        for key, value in pair.items():
+            col = index.get(key)
+            if col is not None and isinstance(value, (int, float)):
+                rows.append(row)
+                cols.append(col)
+                values.append(value)
+
+    prices = np.full((len(pairs), len(exchanges)), np.nan)
+    prices[rows, cols] = values
+    return [pair['symbol'] for pair in pairs], exchanges, prices
+
+
+def compute_spreads(prices: np.ndarray, min_volume=100, min_profit=5, min_pct=3.0) -> Spreads:
+    """Лучшая покупка/продажа и профит по всем символам за один проход.
+
+    Формула та же, что в ArbitrageScanner: при равных ценах покупка берется
+    на первой бирже, продажа на последней (как у стабильной сортировки).
+    """
+    rows, cols = prices.shape
+    listed = ~np.isnan(prices)
+    row_idx = np.arange(rows)
+
+    buy_idx = np.where(listed, prices, np.inf).argmin(axis=1)
+    sell_idx = cols - 1 - np.where(listed, prices, -np.inf)[:, ::-1].argmax(axis=1)
+    buy_price = prices[row_idx, buy_idx]
+    sell_price = prices[row_idx, sell_idx]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profit_pct = ((sell_price - buy_price) / buy_price * 100) - TRADE_FEE_PCT
+        profit_usd = (min_volume / buy_price) * (sell_price - buy_price) * PROFIT_FACTOR
+        mask = (listed.sum(axis=1) >= 2) & (profit_usd >= min_profit) & (profit_pct >= min_pct)
+
+    return Spreads(buy_idx, sell_idx, buy_price, sell_price, profit_pct, profit_usd, mask)
+
+
+def compute_net_spreads(prices: np.ndarray, taker: np.ndarray, buy_ok: np.ndarray,
+                        sell_ok: np.ndarray, min_volume=100) -> Spreads:
+    """Профит с торговыми комиссиями каждой биржи (без комиссии вывода).
+
+    Покупка стоит цена / (1 - taker), продажа дает цена * (1 - taker).
+    buy_ok / sell_ok - где вывод / ввод монеты открыт: биржи без открытой
+    сети исключаются еще до расчета цен. В mask - все связки с двумя разными
+    биржами, пороги прибыли применяет вызывающий код.
+    """
+    rows, cols = prices.shape
+    listed = ~np.isnan(prices)
+    row_idx = np.arange(rows)
+    keep = 1 - taker
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        buy_cost = np.where(listed & buy_ok, prices / keep, np.inf)
+        sell_gain = np.where(listed & sell_ok, prices * keep, -np.inf)
+        buy_idx = buy_cost.argmin(axis=1)
+        sell_idx = cols - 1 - sell_gain[:, ::-1].argmax(axis=1)
+
+        best_cost = buy_cost[row_idx, buy_idx]
+        # Купить негде (вывод закрыт везде) - связки нет, а не профит -100%
+        coins = np.where(np.isfinite(best_cost), min_volume / best_cost, np.nan)
+        profit_usd = coins * sell_gain[row_idx, sell_idx] - min_volume
+        profit_pct = profit_usd / min_volume * 100
+        mask = (buy_idx != sell_idx) & np.isfinite(profit_usd)
+
+    return Spreads(buy_idx, sell_idx, prices[row_idx, buy_idx], prices[row_idx, sell_idx],
+                   profit_pct, profit_usd, mask)
+
+
+def find_opportunities(pairs: List[Dict], min_volume=100, min_profit=5, min_pct=3.0,
+                       limit: Optional[int] = 3, fees=None, networks=None,
+                       order_by: str = 'profit_pct', records: bool = False) -> List:
+    """Векторная замена цикла find_arbitrage с тем же форматом результата"""
+    symbols, exchanges, prices = build_matrix(pairs)
+    return opportunities_from_matrix(symbols, exchanges, prices, min_volume, min_profit,
+                                     min_pct, limit, fees, networks, order_by, records)
+
+
+def opportunities_from_matrix(symbols: List[str], exchanges: List[str], prices: np.ndarray,
+                              min_volume=100, min_profit=5, min_pct=3.0,
+                              limit: Optional[int] = 3, fees=None, networks=None,
+                              order_by: str = 'profit_pct', records: bool = False) -> List:
+    """Связки из матрицы цен.
+
+    Без fees - прежняя формула (TRADE_FEE_PCT / PROFIT_FACTOR). С FeeTable -
+    комиссии каждой биржи, самая дешевая общая сеть из networks и ее
+    комиссия вывода; маршруты без общей открытой сети отбрасываются.
+    Лучшие limit связок по order_by (profit_pct / profit_usd); records=True -
+    записи Opportunity вместо словарей.
+    """
+    if order_by not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key {order_by!r}, expected one of {SORT_KEYS}")
+    if not symbols or not exchanges:
+        return []
+    if fees is not None:
+        return _net_opportunities(symbols, exchanges, prices, min_volume, min_profit,
+                                  min_pct, limit, fees, networks, order_by, records)
+    spreads = compute_spreads(prices, min_volume, min_profit, min_pct)
+
+    found = np.flatnonzero(spreads.mask)
+    found = found[np.argsort(-getattr(spreads, order_by)[found], kind='stable')][:limit]
+
+    names = [name.capitalize() for name in exchanges]
+    columns = zip(found.tolist(), spreads.buy_idx[found].tolist(), spreads.buy_price[found].tolist(),
+                  spreads.sell_idx[found].tolist(), spreads.sell_price[found].tolist(),
+                  spreads.profit_usd[found].tolist(), spreads.profit_pct[found].tolist())
+    if records:
+        return [Opportunity(symbols[i], names[buy], buy_price, names[sell], sell_price, profit_usd,
+                            profit_pct, min_volume)
+                for i, buy, buy_price, sell, sell_price, profit_usd, profit_pct in columns]
+    return [{
+        'symbol': symbols[i],
+        'buy_exchange': names[buy],
+        'buy_price': buy_price,
+        'sell_exchange': names[sell],
+        'sell_price': sell_price,
+        'profit_usd': profit_usd,
+        'profit_pct': profit_pct,
+        'volume': min_volume
+    } for i, buy, buy_price, sell, sell_price, profit_usd, profit_pct in columns]
+
+
+def viable_pair(fees, base: str, exchanges: List[str], prices: List[Optional[float]], keep: List[float],
+                buy_ok: List[bool], sell_ok: List[bool], networks=None) -> Optional[Tuple]:
+    """Лучшая пара бирж с общей открытой сетью, когда у лучшей по цене ее нет.
+
+    Пары перебираются по убыванию выручки (цена продажи * keep) / (цена
+    покупки / keep), при равной - покупка на первой бирже, продажа на
+    последней, как у argmin / argmax. prices[j] - цена или None / NaN,
+    keep[j] = 1 - taker. Возвращает (buy, sell, buy_cost, sell_gain,
+    (сеть, комиссия вывода)) или None, если маршрута нет ни у одной пары.
+    """
+    buys, sells = [], []
+    for j, price in enumerate(prices):
+        if price is None or price != price:
+            continue
+        if buy_ok[j]:
+            buys.append((price / keep[j], j))
+        if sell_ok[j]:
+            sells.append((price * keep[j], j))
+    pairs = sorted(((gain / cost, -buy, sell, cost, gain) for cost, buy in buys for gain, sell in sells
+                    if buy != sell), reverse=True)
+    for _, buy, sell, cost, gain in pairs:
+        route = fees.route(base, exchanges[-buy], exchanges[sell], networks)
+        if route is not None:
+            return -buy, sell, cost, gain, route
+    return None
+
+
+def _net_opportunities(symbols, exchanges, prices, min_volume, min_profit, min_pct,
+                       limit, fees, networks, order_by='profit_pct', records=False) -> List:
+    taker = np.array([fees.taker(name) for name in exchanges])
+    buy_ok = np.array([[fees.can_withdraw(name, s) for name in exchanges] for s in symbols])
+    sell_ok = np.array([[fees.can_deposit(name, s) for name in exchanges] for s in symbols])
+    spreads = compute_net_spreads(prices, taker, buy_ok, sell_ok, min_volume)
+
+    # Комиссия вывода только уменьшает профит, а профит лучшей по цене пары -
+    # верхняя граница для любой другой, поэтому пороги можно применить
+    # заранее и считать маршрут лишь для прошедших. Пара на одной бирже
+    # (mask) тоже проходит: у монеты может быть другая подходящая пара
+    with np.errstate(invalid='ignore'):
+        found = np.flatnonzero(np.isfinite(spreads.profit_usd) & (spreads.profit_usd >= min_profit)
+                               & (spreads.profit_pct >= min_pct))
+
+    def candidates():
+        # Кандидаты идут потоком компактных записей прямо в кучу top_k
+        names = [name.capitalize() for name in exchanges]
+        keep = (1 - taker).tolist()
+        columns = zip(found.tolist(), spreads.buy_idx[found].tolist(), spreads.sell_idx[found].tolist(),
+                      spreads.buy_price[found].tolist(), spreads.sell_price[found].tolist(),
+                      spreads.profit_usd[found].tolist(), spreads.profit_pct[found].tolist())
+        for i, buy, sell, buy_price, sell_price, gross_usd, gross_pct in columns:
+            route = fees.route(symbols[i], exchanges[buy], exchanges[sell], networks) if buy != sell else None
+            if route is None:
+                # Невозможный перевод отсекается до выбора пары: следующая по цене пара с общей сетью
+                pair = viable_pair(fees, symbols[i], exchanges, prices[i].tolist(), keep,
+                                   buy_ok[i].tolist(), sell_ok[i].tolist(), networks)
+                if pair is None:
+                    continue
+                buy, sell, buy_cost, sell_gain, route = pair
+                buy_price, sell_price = float(prices[i, buy]), float(prices[i, sell])
+                gross_usd = min_volume / buy_cost * sell_gain - min_volume
+                gross_pct = gross_usd / min_volume * 100
+            network, withdraw_fee = route
+            withdraw_usd = withdraw_fee * sell_price * (1 - float(taker[sell]))
+            profit_usd = gross_usd - withdraw_usd
+            profit_pct = profit_usd / min_volume * 100
+            if profit_usd < min_profit or profit_pct < min_pct:
+                continue
+            # Профит линеен по объему: volume * gross_pct / 100 - withdraw_usd
+            yield Opportunity(symbols[i], names[buy], buy_price, names[sell], sell_price, profit_usd,
+                              profit_pct, min_volume, network, withdraw_fee, gross_pct, withdraw_usd)
+
+    best = top_k(candidates(), limit, sort_key(order_by))
+    return best if records else [opp.to_dict() for opp in best]
+
+
+# ========== БЕНЧМАРК ==========
+def _find_opportunities_loop(pairs: List[Dict], min_volume=100, min_profit=5, min_pct=3.0,
+                             limit: Optional[int] = 3) -> List[Dict]:
+    """Прежний цикл find_arbitrage - эталон для сравнения"""
+    opportunities = []
+    for pair in pairs:
+        prices = {k: v for k, v in pair.items() if isinstance(v, (int, float))}
+        if len(prices) >= 2:
+            sorted_prices = sorted(prices.items(), key=lambda x: x[1])
+            buy_exch, buy_price = sorted_prices[0]
+            sell_exch, sell_price = sorted_prices[-1]
+
+            profit_pct = ((sell_price - buy_price) / buy_price * 100) - TRADE_FEE_PCT
+            profit_usd = (min_volume / buy_price) * (sell_price - buy_price) * PROFIT_FACTOR
+
+            if profit_usd >= min_profit and profit_pct >= min_pct:
+                opportunities.append({
+                    'symbol': pair['symbol'],
+                    'buy_exchange': buy_exch.capitalize(),
+                    'buy_price': buy_price,
+                    'sell_exchange': sell_exch.capitalize(),
+                    'sell_price': sell_price,
+                    'profit_usd': profit_usd,
+                    'profit_pct': profit_pct,
+                    'volume': min_volume
+                })
+    return sorted(opportunities, key=lambda x: x['profit_pct'], reverse=True)[:limit]
+
+
+def benchmark(symbols: int = 10000, exchanges: int = 10, repeat: int = 5):
+    from price_table import PriceTable
+
+    rng = np.random.default_rng(42)
+    names = [f'ex{j}' for j in range(exchanges)]
+    base = rng.uniform(0.01, 1000, symbols)
+    noise = rng.uniform(0.97, 1.03, (symbols, exchanges))
+    listed = rng.random((symbols, exchanges)) < 0.6
+
+    table = PriceTable()
+    for i in range(symbols):
+        for j in range(exchanges):
+            if listed[i, j]:
+                table.update(names[j], f'C{i}', float(base[i] * noise[i, j]))
+
+    def timed(fn, *args, **kwargs):
+        best, result = float('inf'), None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            best = min(best, time.perf_counter() - started)
+        return best, result
+
+    def legacy(min_profit, min_pct):
+        return _find_opportunities_loop(table.pairs(), 100, min_profit, min_pct, limit=None)
+
+    def vectorized(min_profit, min_pct):
+        found_symbols, prices = table.matrix(names)
+        return opportunities_from_matrix(found_symbols, names, prices, 100, min_profit, min_pct,
+                                         limit=None)
+
+    _, matrix = table.matrix(names)
+    print(f"{symbols} symbols x {exchanges} exchanges")
+    for min_profit, min_pct in ((1, 1.0), (5, 3.0)):
+        loop_time, expected = timed(legacy, min_profit, min_pct)
+        vector_time, actual = timed(vectorized, min_profit, min_pct)
+        spreads_time, _ = timed(compute_spreads, matrix, 100, min_profit, min_pct)
+
+        assert actual == expected, "vectorized result differs from loop"
+        print(f"min_profit={min_profit} min_pct={min_pct}: {len(expected)} opportunities")
+        print(f"  table.pairs + loop:     {loop_time * 1000:.1f}ms")
+        print(f"  table.matrix + vector:  {vector_time * 1000:.1f}ms (x{loop_time / vector_time:.1f})")
+        print(f"  compute_spreads only:   {spreads_time * 1000:.1f}ms (x{loop_time / spreads_time:.1f})")
+
+
+if __name__ == '__main__':
+    benchmark()
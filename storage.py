@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# WAL: читатели не ждут писателя, а commit без fsync (synchronous=NORMAL)
+# остается атомарным - при сбое питания теряются лишь последние транзакции
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -8000),  # 8 МБ
+)
+STATEMENT_CACHE = 256  # подготовленных запросов на соединение
+
+
+class Storage:
+    """Долгоживущие соединения SQLite: по одному на поток, с общими pragma.
+
+    Соединение открывается при первом запросе из потока и переиспользуется;
+    sqlite3 кэширует подготовленные запросы по тексту SQL, поэтому helpers
+    должны передавать параметры через ?, а не форматировать строку.
+    Одиночные запросы выполняются в autocommit, несколько запросов можно
+    объединить через transaction() - вложенные блоки входят во внешний.
+    """
+
+    def __init__(self, path: str, pragmas: Sequence = PRAGMAS):
+        self.path = path
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE)
+            for name, value in self.pragmas:
+                conn.execute(f'PRAGMA {name}={value}')
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def execute(self, sql: str, params: Sequence = ()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+
+    def executemany(self, sql: str, rows) -> sqlite3.Cursor:
+        with self.transaction() as conn:
+            return conn.executemany(sql, rows)
+
+    def fetchone(self, sql: str, params: Sequence = ()) -> Optional[tuple]:
+        return self.connection().execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: Sequence = ()) -> List[tuple]:
+        return self.connection().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE ... COMMIT; при исключении - ROLLBACK"""
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class QueryStats:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class DBExecutor:
+    """Выполняет синхронные helpers базы в отдельном потоке для async-кода.
+
+    Один поток - одно соединение Storage, поэтому записи не спорят за
+    блокировку SQLite, а event loop не ждет диск. Очередь ограничена
+    max_pending: при переполнении корутины ждут места (backpressure),
+    а не копят задачи в памяти. Время каждого helper копится в stats.
+    """
+
+    def __init__(self, max_pending: int = 1000, slow_query: float = 0.1):
+        self.max_pending = max_pending
+        self.slow_query = slow_query
+        self.stats: Dict[str, QueryStats] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        self._pending: Optional[asyncio.Semaphore] = None  # создается внутри цикла
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, func, args, kwargs)
+
+    def _timed(self, func: Callable, args, kwargs) -> Any:
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            name = getattr(func, '__name__', repr(func))
+            self.stats.setdefault(name, QueryStats()).add(elapsed)
+            if elapsed > self.slow_query:
+                logger.warning("Slow DB call %s: %.0fms", name, elapsed * 1000)
+
+    def report(self) -> List[str]:
+        return [f"{name}: {s.count} calls, avg {s.avg * 1000:.2f}ms, max {s.max * 1000:.2f}ms"
+                for name, s in sorted(self.stats.items(), key=lambda x: -x[1].total)]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_storages: Dict[str, Storage] = {}
+
+
+def get_storage(path: str) -> Storage:
+    """Один Storage на файл базы для всех модулей процесса"""
+    key = os.path.abspath(path)
+    if key not in _storages:
+        _storages[key] = Storage(path)
+    return _storages[key]
+
+
+# ========== БЕНЧМАРК ==========
+def _per_call_write(path: str, user_id: int):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('''UPDATE users SET total_scans = total_scans + 1 WHERE user_id = ?''', (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def _per_call_read(path: str, user_id: int) -> Any:
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('''SELECT * FROM users WHERE user_id = ?''', (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+
+def benchmark(calls: int = 2000, users: int = 1000):
+    def measure(label, func):
+        started = time.perf_counter()
+        for i in range(calls):
+            func(i % users)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<28} {elapsed / calls * 1e6:8.1f}us/call {calls / elapsed:10.0f} calls/s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('per_call.db', 'pooled.db'):
+            conn = sqlite3.connect(os.path.join(tmp, name))
+            conn.execute('''CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT,
+                            total_scans INTEGER DEFAULT 0)''')
+            conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                             [(i, f'User{i}') for i in range(users)])
+            conn.commit()
+            conn.close()
+
+        per_call = os.path.join(tmp, 'per_call.db')
+        measure('connect-per-call read', lambda uid: _per_call_read(per_call, uid))
+        measure('connect-per-call write', lambda uid: _per_call_write(per_call, uid))
+
+        storage = Storage(os.path.join(tmp, 'pooled.db'))
+        measure('pooled read', lambda uid: storage.fetchone(
+            '''SELECT * FROM users WHERE user_id = ?''', (uid,)))
+        measure('pooled write', lambda uid: storage.execute(
+            '''UPDATE users SET total_scans = total_scans + 1 WHERE user_id = ?''', (uid,)))
+        storage.close()
+
+
+async def _loop_lag(updates: int, handle: Callable) -> float:
+    """Максимальная задержка таймера event loop, пока идут updates апдейтов"""
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - started - 0.001)
+
+    tick = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0.01)
+    await asyncio.gather(*(handle(i) for i in range(updates)))
+    done = True
+    await tick
+    return lag
+
+
+def load_test(updates: int = 3000, write_delays=(0.0, 0.0005, 0.002)):
+    """Задержка event loop при прямых вызовах helpers и через DBExecutor.
+
+    write_delays имитирует медленный диск: время записи растет, а задержка
+    цикла при DBExecutor должна оставаться прежней.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, 'load.db'))
+        storage.execute('''CREATE TABLE users (user_id INTEGER PRIMARY KEY, total_scans INTEGER DEFAULT 0)''')
+        storage.executemany('INSERT INTO users (user_id) VALUES (?)', [(i,) for i in range(1000)])
+
+        for delay in write_delays:
+            def increment(user_id):
+                storage.execute('''UPDATE users SET total_scans = total_scans + 1 WHERE user_id = ?''',
+                                (user_id % 1000,))
+                if delay:
+                    time.sleep(delay)
+
+            async def direct(i):
+                await asyncio.sleep(0)
+                increment(i)
+
+            executor = DBExecutor()
+
+            async def queued(i):
+                await asyncio.sleep(0)
+                await executor.run(increment, i)
+
+            direct_lag = asyncio.run(_loop_lag(updates, direct))
+            queued_lag = asyncio.run(_loop_lag(updates, queued))
+            executor.shutdown()
+            print(f"write {delay * 1000:4.1f}ms: loop lag direct {direct_lag * 1000:8.1f}ms, "
+                  f"DBExecutor {queued_lag * 1000:6.1f}ms ({executor.report()[0]})")
+        storage.close()
+
+
+if __name__ == '__main__':
+    benchmark()
+    load_test()
@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Колонки записи: фиксированная ширина, один файл .npy на колонку в сегменте
+COLUMNS = {
+    'ts': np.float64,
+    'exchange': np.uint16,
+    'symbol': np.uint32,
+    'bid': np.float64,
+    'ask': np.float64,
+    'last': np.float64,
+}
+SEGMENT_RECORDS = 1 << 20  # ~40 МБ на сегмент
+
+
+def _write_json(path: str, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+class _Dictionary:
+    """Имя -> id, только добавление; хранится списком в json"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.names: List[str] = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.names = json.load(f)
+        self.ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.dirty = False
+
+    def id(self, name: str) -> int:
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.dirty = True
+        return i
+
+    def save(self):
+        if self.dirty:
+            _write_json(self.path, self.names)
+            self.dirty = False
+
+
+class _Segment:
+    """Каталог с колонками .npy на capacity записей (файлы создаются сразу)"""
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.meta_path = os.path.join(path, 'meta.json')
+        os.makedirs(path)
+        self.columns = {name: np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+',
+                                                        dtype=dtype, shape=(capacity,))
+                        for name, dtype in COLUMNS.items()}
+        self.meta = {'count': 0, 'capacity': capacity, 'start': None, 'end': None}
+
+    @property
+    def free(self) -> int:
+        return self.meta['capacity'] - self.meta['count']
+
+    def append(self, batch: Dict[str, np.ndarray], n: int):
+        start = self.meta['count']
+        for name, column in self.columns.items():
+            column[start:start + n] = batch[name]
+        self.meta['count'] = start + n
+        ts = batch['ts']
+        if self.meta['start'] is None:
+            self.meta['start'] = float(ts[0])
+        self.meta['end'] = float(ts[-1])
+
+    def commit(self):
+        for column in self.columns.values():
+            column.flush()
+        # Счетчик пишется после данных: записи дальше count читатель не видит
+        _write_json(self.meta_path, self.meta)
+
+
+class TickRecorder:
+    """Запись котировок в колоночные memory-mapped файлы.
+
+    record() только кладет кортеж в очередь - скан не ждет диска. Фоновый
+    поток раз в flush_interval забирает очередь, переводит биржу и монету
+    в id по словарям и пишет пачку в колонки текущего сегмента (np.memmap).
+    Сегмент - каталог с файлами .npy фиксированного размера и meta.json
+    (число записей, интервал времени); заполненный сегмент закрывается и
+    начинается новый. Очередь ограничена max_pending: при переполнении
+    старые тики теряются, а не растет память.
+    """
+
+    def __init__(self, path: str, segment_records: int = SEGMENT_RECORDS, flush_interval: float = 1.0,
+                 max_pending: int = 1_000_000):
+        self.path = path
+        self.segment_records = segment_records
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+        os.makedirs(path, exist_ok=True)
+        self.exchanges = _Dictionary(os.path.join(path, 'exchanges.json'))
+        self.symbols = _Dictionary(os.path.join(path, 'symbols.json'))
+        self._pending: deque = deque(maxlen=max_pending)
+        self._segment: Optional[_Segment] = None
+        self._segment_no = len(_segment_dirs(path))
+        self._lock = threading.Lock()  # одна запись на диск за раз
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, exchange: str, base: str, bid: float, ask: float, last: float,
+               ts: Optional[float] = None):
+        """Неблокирующая запись тика (подходит как PriceTable.on_update)"""
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1  # deque с maxlen вытеснит самый старый
+        self._pending.append((ts if ts is not None else time.time(), exchange, base, bid, ask, last))
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='tick-recorder', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Tick flush failed: %s", e)
+
+    def flush(self) -> int:
+        with self._lock:
+            n = len(self._pending)
+            if not n:
+                return 0
+            pending = self._pending
+            rows = [pending.popleft() for _ in range(n)]
+            exchange_id, symbol_id = self.exchanges.id, self.symbols.id
+            batch = {
+                'ts': np.fromiter((r[0] for r in rows), np.float64, n),
+                'exchange': np.fromiter((exchange_id(r[1]) for r in rows), np.uint16, n),
+                'symbol': np.fromiter((symbol_id(r[2]) for r in rows), np.uint32, n),
+                'bid': np.fromiter((r[3] or 0.0 for r in rows), np.float64, n),
+                'ask': np.fromiter((r[4] or 0.0 for r in rows), np.float64, n),
+                'last': np.fromiter((r[5] or 0.0 for r in rows), np.float64, n),
+            }
+            # Словари раньше данных: у любого записанного id есть имя
+            self.exchanges.save()
+            self.symbols.save()
+
+            done = 0
+            while done < n:
+                segment = self._current()
+                size = min(segment.free, n - done)
+                segment.append({name: column[done:done + size] for name, column in batch.items()}, size)
+                segment.commit()
+                done += size
+            self.written += n
+            self.flushes += 1
+            return n
+
+    def _current(self) -> _Segment:
+        if self._segment is None or not self._segment.free:
+            path = os.path.join(self.path, f'seg-{self._segment_no:06d}')
+            self._segment_no += 1
+            self._segment = _Segment(path, self.segment_records)
+        return self._segment
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def report(self) -> str:
+        return (f"ticks: {self.written} written in {self.flushes} flushes, {self.pending} pending, "
+                f"{self.dropped} dropped, {len(self.symbols.names)} symbols")
+
+
+def _segment_dirs(path: str) -> List[str]:
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.startswith('seg-'))
+
+
+class TickReader:
+    """Чтение записанных тиков без разбора: колонки - np.memmap только для
+    чтения, срез по времени - представление (view) без копирования."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'symbols.json')) as f:
+            self.symbols: List[str] = json.load(f)
+        with open(os.path.join(path, 'exchanges.json')) as f:
+            self.exchanges: List[str] = json.load(f)
+        self.symbol_ids = {name: i for i, name in enumerate(self.symbols)}
+        self.exchange_ids = {name: i for i, name in enumerate(self.exchanges)}
+
+    def segments(self) -> Iterator[Tuple[Dict, Dict[str, np.ndarray]]]:
+        for path in _segment_dirs(self.path):
+            meta_path = os.path.join(path, 'meta.json')
+            if not os.path.exists(meta_path):
+                continue
+            with open(meta_path) as f:
+                meta = json.load(f)
+            count = meta['count']
+            if not count:
+                continue
+            columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')[:count]
+                       for name in COLUMNS}
+            yield meta, columns
+
+    def __len__(self):
+        return sum(meta['count'] for meta, _ in self.segments())
+
+    def select(self, start: Optional[float] = None, end: Optional[float] = None,
+               symbol: Optional[str] = None, exchange: Optional[str] = None) -> List[Dict[str, np.ndarray]]:
+        """Колонки за [start, end) по сегментам.
+
+        Сегменты вне интервала пропускаются по meta, внутри сегмента границы
+        ищутся бинарным поиском по ts (тики пишутся в порядке поступления),
+        так что без фильтра по монете/бирже результат - view на файл.
+        Фильтр по монете или бирже - булева маска, это уже копия.
+        """
+        symbol_id = self.symbol_ids.get(symbol) if symbol is not None else None
+        exchange_id = self.exchange_ids.get(exchange) if exchange is not None else None
+        if (symbol is not None and symbol_id is None) or (exchange is not None and exchange_id is None):
+            return []
+
+        parts = []
+        for meta, columns in self.segments():
+            if (start is not None and meta['end'] < start) or (end is not None and meta['start'] >= end):
+                continue
+            ts = columns['ts']
+            lo = int(np.searchsorted(ts, start, 'left')) if start is not None else 0
+            hi = int(np.searchsorted(ts, end, 'left')) if end is not None else len(ts)
+            if lo >= hi:
+                continue
+            part = {name: column[lo:hi] for name, column in columns.items()}
+            if symbol_id is not None or exchange_id is not None:
+                mask = np.ones(hi - lo, dtype=bool)
+                if symbol_id is not None:
+                    mask &= part['symbol'] == symbol_id
+                if exchange_id is not None:
+                    mask &= part['exchange'] == exchange_id
+                part = {name: column[mask] for name, column in part.items()}
+            parts.append(part)
+        return parts
+
+    def frame(self, **filters) -> Dict[str, np.ndarray]:
+        """select() одним набором колонок (склеивание сегментов копирует)"""
+        parts = self.select(**filters)
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([p[name] for p in parts]) if parts else np.empty(0, dtype)
+                for name, dtype in COLUMNS.items()}
+
+
+# ========== БЕНЧМАРК ==========
+def benchmark(ticks: int = 2_000_000, symbols: int = 2000, exchanges=('kucoin', 'bybit', 'okx', 'gateio', 'htx')):
+    path = tempfile.mkdtemp(prefix='ticks-')
+    try:
+        rng = random.Random(4)
+        names = [f'C{i}' for i in range(symbols)]
+        fair = [10 ** rng.uniform(-3, 3) for _ in names]
+        recorder = TickRecorder(path, segment_records=500_000, flush_interval=0.2, max_pending=ticks)
+        recorder.start()
+
+        t0 = 1_700_000_000.0
+        rows = []
+        for i in range(ticks):
+            s = rng.randrange(symbols)
+            price = fair[s] * (1 + rng.gauss(0, 0.002))
+            rows.append((rng.choice(exchanges), names[s], price * 0.9995, price * 1.0005, price, t0 + i * 0.001))
+
+        started = time.perf_counter()
+        for exchange, base, bid, ask, last, ts in rows:
+            recorder.record(exchange, base, bid, ask, last, ts)
+        producer = time.perf_counter() - started
+        recorder.close()
+        total = time.perf_counter() - started
+
+        size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+        print(f"{ticks} ticks: record() {producer / ticks * 1e9:.0f}ns per call in the scan loop, "
+              f"written in {total:.2f}s ({ticks / total / 1e6:.2f}M ticks/s), {size / 2**20:.0f} MiB on disk")
+        print(recorder.report())
+
+        reader = TickReader(path)
+        assert len(reader) == ticks
+        started = time.perf_counter()
+        window = reader.select(t0 + 600, t0 + 1200)
+        window_time = time.perf_counter() - started
+        shared = all(isinstance(p['last'].base, np.memmap) or isinstance(p['last'], np.memmap) for p in window)
+        print(f"time slice (10 min of {ticks / 1000 / 60:.0f}): {sum(len(p['ts']) for p in window)} ticks "
+              f"in {window_time * 1000:.2f}ms, zero-copy view: {shared}")
+
+        started = time.perf_counter()
+        one = reader.frame(symbol='C42', exchange='bybit')
+        print(f"C42 on bybit, all time: {len(one['ts'])} ticks in {(time.perf_counter() - started) * 1000:.1f}ms")
+        expected = [r for r in rows if r[1] == 'C42' and r[0] == 'bybit']
+        assert len(expected) == len(one['ts']) and np.allclose(one['last'], [r[4] for r in expected])
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    benchmark()
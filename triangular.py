@@ -0,0 +1,295 @@
+import math
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fees import DEFAULT_TAKER
+from opportunity import Opportunity, sort_key, top_k
+
+# Валюты, с которых начинается и которыми заканчивается цикл
+DEFAULT_ANCHORS = ('USDT',)
+
+
+class TriangularEngine:
+    """Треугольный арбитраж внутри одной биржи: USDT -> X -> Y -> USDT
+    (и так же от других якорных валют из anchors).
+
+    Рынки биржи - граф валют; у каждого рынка BASE/QUOTE два ребра:
+    покупка (QUOTE -> BASE по ask) и продажа (BASE -> QUOTE по bid), вес
+    ребра -log(курс с комиссией taker). Цикл выгоден, если сумма весов
+    отрицательна. Все треугольники через якорные валюты перечисляются один
+    раз при построении, и для каждого ребра хранится список его циклов.
+    Обновление тикера меняет два ребра и перепроверяет только их циклы,
+    а не весь граф (полный пересчет - O(циклов), Bellman-Ford - O(V*E)).
+    Выгодные циклы поддерживаются в словаре и доступны в любой момент.
+
+    Объем и профит - в USDT: цикл от другого якоря начинается с суммы
+    volume USDT, купленной по ask рынка якорь/USDT, а профит в якоре
+    оценивается по bid. Якоря без рынка к USDT пропускаются.
+    """
+
+    def __init__(self, exchange: str, markets: Dict[str, Dict], taker: float = DEFAULT_TAKER,
+                 anchors: Sequence[str] = DEFAULT_ANCHORS, min_pct: float = 0.0):
+        self.exchange = exchange
+        self.taker = taker
+        self.min_pct = min_pct
+        self.updates = 0
+        self.checks = 0  # перепроверенных циклов
+        self._threshold = -math.log1p(min_pct / 100)
+
+        self.currencies: List[str] = []
+        currency_index: Dict[str, int] = {}
+        self.symbols: List[str] = []
+        self._pairs: List[Tuple[str, str]] = []  # рынок -> (BASE, QUOTE)
+        self._market_index: Dict[str, int] = {}
+        adjacency: Dict[int, Dict[int, int]] = {}  # валюта -> {соседняя валюта: ребро}
+        for symbol, market in markets.items():
+            if market.get('spot') is False or market.get('active') is False:
+                continue
+            base, quote = market.get('base'), market.get('quote')
+            if not base or not quote or base == quote:
+                continue
+            ids = []
+            for name in (base, quote):
+                if name not in currency_index:
+                    currency_index[name] = len(self.currencies)
+                    self.currencies.append(name)
+                ids.append(currency_index[name])
+            b, q = ids
+            if b in adjacency.get(q, {}):
+                continue  # второй рынок той же пары валют (BASE/QUOTE и QUOTE/BASE)
+            m = len(self.symbols)
+            self._market_index[symbol] = m
+            self.symbols.append(symbol)
+            self._pairs.append((base, quote))
+            adjacency.setdefault(q, {})[b] = 2 * m  # покупка BASE за QUOTE
+            adjacency.setdefault(b, {})[q] = 2 * m + 1  # продажа BASE за QUOTE
+
+        edges = 2 * len(self.symbols)
+        # Курс ребра без комиссии и вес -log(курс * (1 - taker)); inf - нет цены
+        self._rate = np.zeros(edges)
+        self._weight = np.full(edges, np.inf)
+
+        cycles = []
+        usdt = currency_index.get('USDT')
+        # Якорь -> (ребро якорь -> USDT, ребро USDT -> якорь) для пересчета в USDT
+        self._usdt_edges: Dict[str, Tuple[int, int]] = {}
+        for anchor in anchors:
+            a = currency_index.get(anchor)
+            if a is None:
+                continue
+            if anchor != 'USDT':
+                to_usdt = adjacency.get(a, {}).get(usdt)
+                if to_usdt is None:
+                    continue  # профит не в чем оценить
+                self._usdt_edges[anchor] = (to_usdt, adjacency[usdt][a])
+            neighbors = adjacency.get(a, {})
+            for x, ax in neighbors.items():
+                for y, xy in adjacency.get(x, {}).items():
+                    if y != a and y in neighbors:
+                        cycles.append((ax, xy, adjacency[y][a]))
+        self._cycles = np.array(cycles, dtype=np.int64).reshape(-1, 3)
+        # Ребро -> циклы через него
+        order = np.argsort(self._cycles.ravel(), kind='stable')
+        edges_sorted = self._cycles.ravel()[order]
+        bounds = np.searchsorted(edges_sorted, np.arange(edges + 1))
+        self._edge_cycles = [order[bounds[e]:bounds[e + 1]] // 3 for e in range(edges)]
+        self.profitable: Dict[int, float] = {}  # цикл -> сумма весов (< порога)
+
+    def __len__(self):
+        return len(self._cycles)
+
+    @property
+    def pairs(self) -> int:
+        return len(self.symbols)
+
+    # ---------- обновления ----------
+    def _set(self, m: int, bid: Optional[float], ask: Optional[float]):
+        keep = 1 - self.taker
+        buy, sell = 2 * m, 2 * m + 1
+        if ask and ask > 0:
+            self._rate[buy] = 1 / ask
+            self._weight[buy] = -math.log(keep / ask)
+        else:
+            self._weight[buy] = np.inf
+        if bid and bid > 0:
+            self._rate[sell] = bid
+            self._weight[sell] = -math.log(bid * keep)
+        else:
+            self._weight[sell] = np.inf
+
+    def update(self, symbol: str, bid: Optional[float], ask: Optional[float]) -> int:
+        """Новый тикер одного рынка; возвращает число перепроверенных циклов"""
+        m = self._market_index.get(symbol)
+        if m is None:
+            return 0
+        self._set(m, bid, ask)
+        self.updates += 1
+        affected = np.concatenate((self._edge_cycles[2 * m], self._edge_cycles[2 * m + 1]))
+        self._recheck(affected)
+        return len(affected)
+
+    def update_many(self, quotes: Iterable[Tuple[str, Optional[float], Optional[float]]]) -> int:
+        """Пачка тикеров: затронутые циклы перепроверяются один раз"""
+        touched = []
+        for symbol, bid, ask in quotes:
+            m = self._market_index.get(symbol)
+            if m is None:
+                continue
+            self._set(m, bid, ask)
+            self.updates += 1
+            touched.append(self._edge_cycles[2 * m])
+            touched.append(self._edge_cycles[2 * m + 1])
+        if not touched:
+            return 0
+        affected = np.unique(np.concatenate(touched))
+        self._recheck(affected)
+        return len(affected)
+
+    def update_tickers(self, tickers: Dict[str, Dict]) -> int:
+        """Ответ ccxt fetch_tickers целиком (все рынки, не только USDT)"""
+        return self.update_many((symbol, t.get('bid'), t.get('ask'))
+                                for symbol, t in tickers.items() if t)
+
+    def _recheck(self, cycles: np.ndarray):
+        if not len(cycles):
+            return
+        self.checks += len(cycles)
+        with np.errstate(invalid='ignore'):
+            sums = self._weight[self._cycles[cycles]].sum(axis=1)
+        hits = sums < self._threshold
+        profitable = self.profitable
+        for cycle, total in zip(cycles[hits].tolist(), sums[hits].tolist()):
+            profitable[cycle] = total
+        for cycle in cycles[~hits].tolist():
+            profitable.pop(cycle, None)
+
+    def recompute(self):
+        """Полный пересчет всех циклов - эталон и первичное заполнение"""
+        self.profitable.clear()
+        self._recheck(np.arange(len(self._cycles)))
+
+    # ---------- результат ----------
+    def _usdt_factor(self, anchor: str) -> Optional[float]:
+        """Сколько USDT дает профит, равный 1 USDT вложения в якоре: ask -> bid
+        рынка якорь/USDT (1 для USDT); None - цены еще нет"""
+        edges = self._usdt_edges.get(anchor)
+        if edges is None:
+            return 1.0
+        to_usdt, from_usdt = edges
+        if not (math.isfinite(self._weight[to_usdt]) and math.isfinite(self._weight[from_usdt])):
+            return None
+        return float(self._rate[to_usdt] * self._rate[from_usdt])
+
+    def _describe(self, cycle: int, total: float, volume: float) -> Optional[Opportunity]:
+        ax, xy, ya = self._cycles[cycle].tolist()
+        a, x, y = self._edge_from(ax), self._edge_from(xy), self._edge_from(ya)
+        factor = self._usdt_factor(a)
+        if factor is None:
+            return None
+        # В формате кросс-биржевых связок: купить X за якорь, "продать" X
+        # через Y по эффективной цене X -> Y -> якорь (цены - в якоре)
+        buy_price = 1 / float(self._rate[ax])
+        sell_price = float(self._rate[xy] * self._rate[ya])
+        profit_pct = math.expm1(-total) * 100
+        name = self.exchange.capitalize()
+        route = f"{a}→{x}→{y}→{a}"
+        return Opportunity(x, name, buy_price, name, sell_price, volume * profit_pct / 100 * factor, profit_pct,
+                           volume, route, 0.0, profit_pct, 0.0)
+
+    def _edge_from(self, edge: int) -> str:
+        """Валюта, из которой идет ребро: покупка - из QUOTE, продажа - из BASE"""
+        base, quote = self._pairs[edge // 2]
+        return quote if edge % 2 == 0 else base
+
+    def opportunities(self, volume: float = 100, min_profit: float = 0.0, limit: Optional[int] = None,
+                      order_by: str = 'profit_pct') -> List[Opportunity]:
+        """Текущие выгодные циклы записями Opportunity (сеть - маршрут цикла)"""
+        found = (self._describe(cycle, total, volume) for cycle, total in self.profitable.items())
+        return top_k((opp for opp in found if opp is not None and opp.profit_usd >= min_profit), limit,
+                     sort_key(order_by))
+
+
+# ========== БЕНЧМАРК ==========
+def synthetic_markets(alts: int = 400, seed: int = 11) -> Tuple[Dict[str, Dict], Dict[str, float]]:
+    """Рынки, похожие на крупную биржу: альты к USDT, BTC, ETH и части других"""
+    rng = random.Random(seed)
+    quotes = {'USDT': 1.0, 'BTC': 60000.0, 'ETH': 3000.0, 'BNB': 550.0, 'USDC': 1.0}
+    fair = dict(quotes)
+    markets = {}
+
+    def add(base, quote):
+        markets[f'{base}/{quote}'] = {'base': base, 'quote': quote, 'spot': True, 'active': True}
+
+    for quote in ('BTC', 'ETH', 'BNB', 'USDC'):
+        add(quote, 'USDT')
+    add('ETH', 'BTC')
+    add('BNB', 'BTC')
+    for i in range(alts):
+        coin = f'A{i}'
+        fair[coin] = 10 ** rng.uniform(-3, 3)
+        add(coin, 'USDT')
+        for quote, share in (('BTC', 0.8), ('ETH', 0.6), ('BNB', 0.3), ('USDC', 0.4)):
+            if rng.random() < share:
+                add(coin, quote)
+    return markets, fair
+
+
+def _quote(market: Dict, fair: Dict[str, float], rng: random.Random, skew: float = 0.0):
+    mid = fair[market['base']] / fair[market['quote']] * (1 + rng.gauss(0, 0.0005) + skew)
+    spread = mid * 0.0005
+    return mid - spread, mid + spread
+
+
+def benchmark(alts: int = 400, ticks: int = 200, updates_per_tick: int = 20,
+              anchors: Sequence[str] = ('USDT', 'BTC', 'ETH', 'BNB', 'USDC')):
+    markets, fair = synthetic_markets(alts)
+    rng = random.Random(5)
+    engine = TriangularEngine('bench', markets, taker=0.001, anchors=anchors, min_pct=0.0)
+    symbols = list(markets)
+    started = time.perf_counter()
+    engine.update_many((s, *_quote(markets[s], fair, rng)) for s in symbols)
+    warmup = time.perf_counter() - started
+    print(f"{engine.pairs} pairs, {len(engine.currencies)} currencies, {len(engine)} triangles; "
+          f"initial load {warmup * 1000:.1f}ms")
+
+    incremental = full = 0.0
+    found = 0
+    for tick in range(ticks):
+        batch = []
+        for symbol in rng.sample(symbols, updates_per_tick):
+            # Изредка рынок сильно отклоняется - появляется выгодный цикл
+            skew = rng.choice((-0.02, 0.02)) if rng.random() < 0.02 else 0.0
+            batch.append((symbol, *_quote(markets[symbol], fair, rng, skew)))
+
+        started = time.perf_counter()
+        engine.update_many(batch)
+        incremental += time.perf_counter() - started
+        current = dict(engine.profitable)
+
+        started = time.perf_counter()
+        engine.recompute()
+        full += time.perf_counter() - started
+        assert set(current) == set(engine.profitable), "incremental result differs from full recompute"
+        found += len(current)
+
+    checks = engine.checks - len(engine) * (ticks + 1)
+    print(f"{ticks} ticks x {updates_per_tick} ticker updates, {found / ticks:.1f} profitable cycles avg")
+    print(f"  incremental: {incremental / ticks * 1000:.2f}ms/tick ({checks / ticks:.0f} cycles rechecked)")
+    print(f"  full recompute: {full / ticks * 1000:.2f}ms/tick ({len(engine)} cycles)")
+    best = engine.opportunities(limit=1)
+    if best:
+        print(f"  best: {best[0].network} {best[0].profit_pct:.3f}%")
+
+    single = time.perf_counter()
+    for symbol in symbols[:500]:
+        engine.update(symbol, *_quote(markets[symbol], fair, rng))
+    print(f"  single ticker update: {(time.perf_counter() - single) / 500 * 1e6:.1f}us")
+
+
+if __name__ == '__main__':
+    for size in (400, 1500):
+        benchmark(size)
+        print()
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class UserCache:
+    """LRU-кэш декодированных пользователей с TTL.
+
+    Хранит не больше max_size записей; запись старше ttl секунд считается
+    промахом. Все пути записи в базу обязаны вызывать invalidate() после
+    commit - TTL лишь страхует от пропущенной инвалидации. None (нет
+    пользователя) не кэшируется, чтобы create_user не требовал сброса.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: 'OrderedDict[Hashable, tuple]' = OrderedDict()  # key -> (значение, время)
+        self._lock = threading.Lock()
+        self._version = 0  # растет при каждой инвалидации
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and now - item[1] < self.ttl:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+            version = self._version
+
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if version != self._version:
+                    return value  # запись во время загрузки - значение могло устареть
+                self._items[key] = (value, now)
+                self._items.move_to_end(key)
+                while len(self._items) > self.max_size:
+                    self._items.popitem(last=False)
+        return value
+
+    def peek(self, key: Hashable) -> Any:
+        """Значение без загрузки: None, если записи нет или она устарела"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or time.monotonic() - item[1] >= self.ttl:
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._items.pop(key, None)
+            self._version += 1
+
+    def update_many(self, changes: Dict[Hashable, Any], apply: Callable[[Any, Any], Any]):
+        """Изменение, уже записанное в базу, применяется к закэшированным
+        записям (apply(значение, изменение) -> новое значение) вместо сброса;
+        TTL записи не продлевается"""
+        with self._lock:
+            for key, change in changes.items():
+                item = self._items.get(key)
+                if item is not None:
+                    self._items[key] = (apply(item[0], change), item[1])
+            self._version += 1  # идущая загрузка могла прочитать строку до записи
+
+    def invalidate_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+            self._version += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._version += 1
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def report(self) -> str:
+        rate = self.hit_rate
+        return (f"user cache: {len(self)}/{self.max_size} entries, "
+                f"hit rate {rate * 100:.1f}% ({self.hits} hits, {self.misses} misses)"
+                if rate is not None else f"user cache: {len(self)}/{self.max_size} entries, no lookups")
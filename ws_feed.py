@@ -0,0 +1,499 @@
+import asyncio
+import gzip
+import json
+import logging
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from order_book import DepthEvaluator
+from price_table import PriceTable, base_of, chunks
+
+logger = logging.getLogger(__name__)
+
+# (id пары на бирже, bid, ask, last)
+Update = Tuple[str, Optional[float], Optional[float], Optional[float]]
+# (id пары, bids, asks, это снимок, seq, prev_seq)
+DepthUpdate = Tuple[str, List, List, bool, Optional[int], Optional[int]]
+
+
+def _f(value) -> Optional[float]:
+    return float(value) if value not in (None, '') else None
+
+
+# ========== ФИДЫ БИРЖ ==========
+class ExchangeFeed:
+    """Подписка на тикеры одной биржи: адрес, сообщения подписки и разбор ответов"""
+
+    name = ''
+    url = ''
+    ping_interval = 20
+    depth = False  # подписываться ли на стаканы (включает StreamingFeed)
+
+    def __init__(self, symbols: List[str], markets: Optional[Dict] = None, url: Optional[str] = None):
+        self.symbols = symbols
+        self.url_override = url
+        # id пары на бирже -> базовая монета
+        self.bases = {}
+        for symbol in symbols:
+            market = (markets or {}).get(symbol)
+            native = market['id'] if market else self.native_id(symbol)
+            self.bases[native] = base_of(symbol)
+
+    def native_id(self, symbol: str) -> str:
+        return symbol.replace('/', '')
+
+    async def resolve_url(self, session: aiohttp.ClientSession) -> str:
+        return self.url_override or self.url
+
+    def subscribe_messages(self) -> List[Dict]:
+        return []
+
+    def depth_messages(self) -> List[Dict]:
+        return []
+
+    def ping(self) -> Optional[Dict]:
+        return None
+
+    def pong(self, data: Dict) -> Optional[Dict]:
+        return None
+
+    def parse(self, data: Dict) -> Iterable[Update]:
+        return ()
+
+    def parse_depth(self, data: Dict) -> Iterable[DepthUpdate]:
+        return ()
+
+    @staticmethod
+    def decode(raw) -> Optional[Dict]:
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return None  # 'pong' и прочие служебные ответы
+        return data if isinstance(data, dict) else None
+
+    @staticmethod
+    def encode(data: Dict):
+        return json.dumps(data)
+
+
+class BybitFeed(ExchangeFeed):
+    name = 'bybit'
+    url = 'wss://stream.bybit.com/v5/public/spot'
+
+    def subscribe_messages(self):
+        topics = [f'orderbook.1.{native}' for native in self.bases]
+        # Bybit spot принимает не больше 10 топиков за запрос
+        return [{'op': 'subscribe', 'args': chunk} for chunk in chunks(topics, 10)]
+
+    def depth_messages(self):
+        topics = [f'orderbook.50.{native}' for native in self.bases]
+        return [{'op': 'subscribe', 'args': chunk} for chunk in chunks(topics, 10)]
+
+    def ping(self):
+        return {'op': 'ping'}
+
+    def parse_depth(self, data):
+        if data.get('topic', '').startswith('orderbook.50.'):
+            book = data.get('data') or {}
+            # u == 1 - биржа перезапустилась, это тоже снимок
+            snapshot = data.get('type') == 'snapshot' or book.get('u') == 1
+            yield book.get('s'), book.get('b'), book.get('a'), snapshot, book.get('u'), None
+
+    def parse(self, data):
+        topic = data.get('topic', '')
+        book = data.get('data') or {}
+        if topic.startswith('orderbook.1.'):
+            bids, asks = book.get('b') or [], book.get('a') or []
+            yield (book.get('s'), _f(bids[0][0]) if bids else None,
+                   _f(asks[0][0]) if asks else None, None)
+        elif topic.startswith('tickers.'):
+            yield book.get('symbol'), None, None, _f(book.get('lastPrice'))
+
+
+class OkxFeed(ExchangeFeed):
+    name = 'okx'
+    url = 'wss://ws.okx.com:8443/ws/v5/public'
+    ping_interval = 25
+
+    def native_id(self, symbol):
+        return symbol.replace('/', '-')
+
+    def subscribe_messages(self):
+        return [{'op': 'subscribe',
+                 'args': [{'channel': 'tickers', 'instId': native} for native in self.bases]}]
+
+    def depth_messages(self):
+        return [{'op': 'subscribe',
+                 'args': [{'channel': 'books', 'instId': native} for native in self.bases]}]
+
+    def parse_depth(self, data):
+        if data.get('arg', {}).get('channel') != 'books':
+            return
+        snapshot = data.get('action') == 'snapshot'
+        for book in data.get('data') or []:
+            yield (data['arg'].get('instId'), book.get('bids'), book.get('asks'), snapshot,
+                   book.get('seqId'), None if snapshot else book.get('prevSeqId'))
+
+    def parse(self, data):
+        if data.get('arg', {}).get('channel') != 'tickers':
+            return
+        for ticker in data.get('data') or []:
+            yield (ticker.get('instId'), _f(ticker.get('bidPx')),
+                   _f(ticker.get('askPx')), _f(ticker.get('last')))
+
+
+class GateioFeed(ExchangeFeed):
+    name = 'gateio'
+    url = 'wss://api.gateio.ws/ws/v4/'
+
+    def native_id(self, symbol):
+        return symbol.replace('/', '_')
+
+    def subscribe_messages(self):
+        return [{'time': int(time.time()), 'channel': 'spot.book_ticker',
+                 'event': 'subscribe', 'payload': list(self.bases)}]
+
+    def depth_messages(self):
+        # spot.order_book присылает готовый топ-20 стакана
+        return [{'time': int(time.time()), 'channel': 'spot.order_book',
+                 'event': 'subscribe', 'payload': [native, '20', '100ms']} for native in self.bases]
+
+    def parse_depth(self, data):
+        if data.get('channel') == 'spot.order_book' and data.get('event') == 'update':
+            book = data.get('result') or {}
+            yield book.get('s'), book.get('bids'), book.get('asks'), True, None, None
+
+    def ping(self):
+        return {'time': int(time.time()), 'channel': 'spot.ping'}
+
+    def parse(self, data):
+        if data.get('channel') == 'spot.book_ticker' and data.get('event') == 'update':
+            book = data.get('result') or {}
+            yield book.get('s'), _f(book.get('b')), _f(book.get('a')), None
+
+
+class HtxFeed(ExchangeFeed):
+    name = 'htx'
+    url = 'wss://api.huobi.pro/ws'
+    ping_interval = 0  # HTX сам присылает ping, отвечаем pong
+
+    def native_id(self, symbol):
+        return symbol.replace('/', '').lower()
+
+    def subscribe_messages(self):
+        return [{'sub': f'market.{native}.bbo', 'id': native} for native in self.bases]
+
+    def depth_messages(self):
+        return [{'sub': f'market.{native}.mbp.refresh.20', 'id': native} for native in self.bases]
+
+    def parse_depth(self, data):
+        channel = data.get('ch', '')
+        if channel.endswith('.mbp.refresh.20'):
+            tick = data.get('tick') or {}
+            yield channel.split('.')[1], tick.get('bids'), tick.get('asks'), True, None, None
+
+    def pong(self, data):
+        if 'ping' in data:
+            return {'pong': data['ping']}
+        return None
+
+    def parse(self, data):
+        channel = data.get('ch', '')
+        if channel.endswith('.bbo'):
+            tick = data.get('tick') or {}
+            yield channel.split('.')[1], _f(tick.get('bid')), _f(tick.get('ask')), None
+
+    @staticmethod
+    def decode(raw):
+        if isinstance(raw, bytes):
+            raw = gzip.decompress(raw)
+        return ExchangeFeed.decode(raw)
+
+    @staticmethod
+    def encode(data):
+        return gzip.compress(json.dumps(data).encode())
+
+
+class KucoinFeed(ExchangeFeed):
+    name = 'kucoin'
+    url = 'https://api.kucoin.com/api/v1/bullet-public'
+
+    def native_id(self, symbol):
+        return symbol.replace('/', '-')
+
+    async def resolve_url(self, session):
+        if self.url_override:
+            return self.url_override
+        # Адрес WebSocket и токен KuCoin выдает через REST
+        async with session.post(self.url) as response:
+            data = (await response.json())['data']
+        server = data['instanceServers'][0]
+        self.ping_interval = server.get('pingInterval', 18000) / 1000
+        return f"{server['endpoint']}?token={data['token']}"
+
+    def subscribe_messages(self):
+        return [{'id': str(i), 'type': 'subscribe', 'response': True,
+                 'topic': '/market/ticker:' + ','.join(chunk)}
+                for i, chunk in enumerate(chunks(list(self.bases), 100))]
+
+    def depth_messages(self):
+        return [{'id': f'depth{i}', 'type': 'subscribe', 'response': True,
+                 'topic': '/spotMarket/level2Depth50:' + ','.join(chunk)}
+                for i, chunk in enumerate(chunks(list(self.bases), 100))]
+
+    def parse_depth(self, data):
+        topic = data.get('topic', '')
+        if data.get('type') == 'message' and topic.startswith('/spotMarket/level2Depth50:'):
+            book = data.get('data') or {}
+            yield topic.split(':')[1], book.get('bids'), book.get('asks'), True, None, None
+
+    def ping(self):
+        return {'id': str(int(time.time() * 1000)), 'type': 'ping'}
+
+    def parse(self, data):
+        topic = data.get('topic', '')
+        if data.get('type') == 'message' and topic.startswith('/market/ticker:'):
+            ticker = data.get('data') or {}
+            yield (topic.split(':')[1], _f(ticker.get('bestBid')),
+                   _f(ticker.get('bestAsk')), _f(ticker.get('price')))
+
+
+FEEDS = {feed.name: feed for feed in (KucoinFeed, BybitFeed, OkxFeed, GateioFeed, HtxFeed)}
+
+
+# ========== ЖИВОЙ СТАКАН ==========
+class StreamingFeed:
+    """Держит лучшие bid/ask по (биржа, монета) в PriceTable по WebSocket.
+
+    Каждая биржа работает в своей задаче; при обрыве соединение
+    восстанавливается с экспоненциальной задержкой и переподпиской.
+    """
+
+    def __init__(self, feeds: List[ExchangeFeed], table: Optional[PriceTable] = None,
+                 max_backoff: float = 30.0, record_path: Optional[str] = None,
+                 depth: Optional[DepthEvaluator] = None):
+        self.feeds = feeds
+        self.table = table if table is not None else PriceTable()
+        # Если передан DepthEvaluator - стаканы тоже ведутся по диффам из WebSocket
+        self.depth = depth
+        for feed in feeds:
+            feed.depth = depth is not None
+        self.max_backoff = max_backoff
+        self.record_path = record_path
+        self.updates = 0
+        self.connects = {feed.name: 0 for feed in feeds}
+        self._session = None
+        self._tasks = []
+        self._record = None
+
+    @classmethod
+    def for_markets(cls, markets: Dict[str, List[str]], exchanges: Optional[Dict] = None,
+                    urls: Optional[Dict[str, str]] = None, **kwargs) -> 'StreamingFeed':
+        """Фиды для ArbitrageScanner.markets (id пар берутся из рынков ccxt, если есть)"""
+        feeds = []
+        for name, symbols in markets.items():
+            if name in FEEDS and symbols:
+                ccxt_markets = getattr((exchanges or {}).get(name), 'markets', None)
+                feeds.append(FEEDS[name](symbols, ccxt_markets, (urls or {}).get(name)))
+        return cls(feeds, **kwargs)
+
+    async def start(self):
+        self._session = aiohttp.ClientSession()
+        if self.record_path:
+            self._record = open(self.record_path, 'a', encoding='utf-8')
+        self._tasks = [asyncio.ensure_future(self._run(feed)) for feed in self.feeds]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session:
+            await self._session.close()
+        if self._record:
+            self._record.close()
+            self._record = None
+
+    async def _run(self, feed: ExchangeFeed):
+        backoff = 1.0
+        while True:
+            try:
+                url = await feed.resolve_url(self._session)
+                async with self._session.ws_connect(url, autoping=True) as ws:
+                    for message in feed.subscribe_messages() + (
+                            feed.depth_messages() if feed.depth else []):
+                        await ws.send_str(json.dumps(message))
+                    self.connects[feed.name] += 1
+                    backoff = 1.0
+                    await self._read(feed, ws)
+                logger.warning("%s feed closed, reconnecting", feed.name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("%s feed error: %s", feed.name, e)
+
+            await asyncio.sleep(backoff + random.uniform(0, backoff / 2))
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _ping(self, feed: ExchangeFeed, ws):
+        while True:
+            await asyncio.sleep(feed.ping_interval)
+            message = feed.ping()
+            await ws.send_str(json.dumps(message) if message else 'ping')
+
+    async def _read(self, feed: ExchangeFeed, ws):
+        pinger = asyncio.ensure_future(self._ping(feed, ws)) if feed.ping_interval else None
+        update = self.table.update
+        bases = feed.bases
+        try:
+            async for msg in ws:
+                if msg.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                    break
+                data = feed.decode(msg.data)
+                if data is None:
+                    continue
+
+                pong = feed.pong(data)
+                if pong:
+                    await ws.send_str(json.dumps(pong))
+                    continue
+                if self._record:
+                    self._record.write(json.dumps({'exchange': feed.name, 'msg': data}) + '\n')
+
+                if self.depth is not None and not self._apply_depth(feed, data):
+                    logger.warning("%s order book gap, resubscribing", feed.name)
+                    await ws.close()
+                    break
+
+                now = time.time()
+                for native, bid, ask, last in feed.parse(data):
+                    base = bases.get(native)
+                    if base is None or not (bid or ask or last):
+                        continue
+                    if last is None:
+                        last = (bid + ask) / 2 if bid and ask else bid or ask
+                    update(feed.name, base, last, bid, ask, now)
+                    self.updates += 1
+        finally:
+            if pinger:
+                pinger.cancel()
+
+    def _apply_depth(self, feed: ExchangeFeed, data: Dict) -> bool:
+        for native, bids, asks, snapshot, seq, prev_seq in feed.parse_depth(data):
+            base = feed.bases.get(native)
+            if base is not None and not self.depth.update(
+                    feed.name, base, bids or [], asks or [], snapshot, seq, prev_seq):
+                return False
+        return True
+
+
+# ========== ЛОКАЛЬНЫЙ СЕРВЕР ДЛЯ ТЕСТОВ ==========
+def load_recording(path: str) -> Dict[str, List[Dict]]:
+    """Записанные StreamingFeed(record_path=...) сообщения по биржам"""
+    recording = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                recording.setdefault(item['exchange'], []).append(item['msg'])
+    return recording
+
+
+class ReplayServer:
+    """Локальная замена WebSocket бирж: проигрывает записанные сообщения.
+
+    Биржа выбирается путем ws://host:port/<exchange>. rate - сообщений
+    в секунду (0 - максимально быстро), drop_after - разорвать соединение
+    после N сообщений, чтобы проверить переподключение.
+    """
+
+    def __init__(self, recording: Dict[str, List[Dict]], rate: float = 0, repeat: int = 1,
+                 drop_after: Optional[int] = None, host: str = '127.0.0.1', port: int = 0):
+        self.recording = recording
+        self.rate = rate
+        self.repeat = repeat
+        self.drop_after = drop_after
+        self.host = host
+        self.port = port
+        self.sent = 0
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{exchange}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def url(self, exchange: str) -> str:
+        return f'ws://{self.host}:{self.port}/{exchange}'
+
+    async def _handle(self, request):
+        exchange = request.match_info['exchange']
+        encode = FEEDS[exchange].encode if exchange in FEEDS else ExchangeFeed.encode
+        messages = [encode(message) for message in self.recording.get(exchange, [])]
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.receive()  # ждем подписку
+
+        delay = 1 / self.rate if self.rate else 0
+        sent = 0
+        for _ in range(self.repeat):
+            for message in messages:
+                if isinstance(message, bytes):
+                    await ws.send_bytes(message)
+                else:
+                    await ws.send_str(message)
+                sent += 1
+                self.sent += 1
+                if self.drop_after and sent >= self.drop_after:
+                    await ws.close()
+                    return ws
+                if delay:
+                    await asyncio.sleep(delay)
+                elif sent % 500 == 0:
+                    await asyncio.sleep(0)
+
+        await ws.close()
+        return ws
+
+
+# ========== НАГРУЗОЧНЫЙ ТЕСТ ==========
+async def load_test(symbols: int = 500, messages: int = 50000):
+    pairs = [f'C{i}/USDT' for i in range(symbols)]
+    recording = {'okx': [
+        {'arg': {'channel': 'tickers', 'instId': f'C{i % symbols}-USDT'},
+         'data': [{'instId': f'C{i % symbols}-USDT', 'last': str(1 + i % 7),
+                   'bidPx': str(1 + i % 7 - 0.01), 'askPx': str(1 + i % 7 + 0.01)}]}
+        for i in range(messages)
+    ]}
+
+    server = ReplayServer(recording)
+    await server.start()
+    feed = StreamingFeed([OkxFeed(pairs, url=server.url('okx'))])
+
+    started = time.perf_counter()
+    await feed.start()
+    while feed.updates < messages:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    await feed.stop()
+    await server.stop()
+    print(f"{feed.updates} updates in {elapsed:.2f}s: {feed.updates / elapsed:,.0f} updates/s, "
+          f"{len(feed.table)} quotes in book")
+
+
+if __name__ == '__main__':
+    asyncio.run(load_test())